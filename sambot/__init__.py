@@ -1,32 +1,70 @@
 # SPDX-License-Identifier: BSD-3-Clause
 # Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
 
-import asyncio
-from contextlib import suppress
-from pathlib import Path
+# Imported first so the startup timer also covers the package imports.
+from sambot.utils.startup import startup  # noqa: F401  # isort: skip
 
-from aiogram import Bot, Dispatcher
-from aiogram.client.default import DefaultBotProperties
-from aiogram.enums import ParseMode
+import subprocess
+from functools import cache
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
 
 from sambot.config import config
-from sambot.utils.logging import log
-from sambot.utils.systools import ShellExceptionError, shell_run
 
-commit_count = "None"
-commit_hash = "None"
-with suppress(ShellExceptionError):
-    commit_count = asyncio.run(shell_run("git rev-list --count HEAD"))
-    commit_hash = asyncio.run(shell_run("git rev-parse --short HEAD"))
+if TYPE_CHECKING:
+    from aiogram import Bot, Dispatcher
 
-__version__ = f"{commit_hash} ({commit_count})"
+app_dir = Path(__file__).parent.parent
 
-log.info("Starting Samgung Helper Bot...", version=__version__)
 
-app_dir = Path(__file__).parent.parent
+def _git(*args: str) -> str:
+    result = subprocess.run(
+        ("git", *args), cwd=app_dir, capture_output=True, text=True, check=True, timeout=5
+    )
+    return result.stdout.strip()
+
+
+@cache
+def get_version() -> str:
+    if config.build_version:
+        return config.build_version
+
+    commit_count = "None"
+    commit_hash = "None"
+    try:
+        commit_count = _git("rev-list", "--count", "HEAD")
+        commit_hash = _git("rev-parse", "--short", "HEAD")
+    except (OSError, subprocess.SubprocessError):
+        pass
+    return f"{commit_hash} ({commit_count})"
+
+
+def _make_bot() -> "Bot":
+    from aiogram import Bot  # noqa: PLC0415
+    from aiogram.client.default import DefaultBotProperties  # noqa: PLC0415
+    from aiogram.enums import ParseMode  # noqa: PLC0415
+
+    return Bot(
+        token=config.bot_token.get_secret_value(),
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML, link_preview_is_disabled=True),
+    )
+
+
+def _make_dispatcher() -> "Dispatcher":
+    from aiogram import Dispatcher  # noqa: PLC0415
+
+    return Dispatcher()
+
+
+# The version shells out to git and the bot pulls in aiogram, so both are only
+# built when first used. The worker and the devtools never touch them.
+_LAZY = {"__version__": get_version, "bot": _make_bot, "dp": _make_dispatcher}
+
 
-bot = Bot(
-    token=config.bot_token.get_secret_value(),
-    default=DefaultBotProperties(parse_mode=ParseMode.HTML, link_preview_is_disabled=True),
-)
-dp = Dispatcher()
+def __getattr__(name: str) -> Any:
+    factory = _LAZY.get(name)
+    if factory is None:
+        msg = f"module {__name__!r} has no attribute {name!r}"
+        raise AttributeError(msg)
+    value = globals()[name] = factory()
+    return value
@@ -3,41 +3,172 @@
 
 import asyncio
 import datetime
+import signal
+import sys
+from collections.abc import Awaitable, Callable, Coroutine
 from contextlib import suppress
+from typing import Any
 
 import aiocron
-import sentry_sdk
 import uvloop
 from aiogram import __version__ as aiogram_version
 from aiogram.exceptions import TelegramForbiddenError
+from aiogram.types import Update
 from aiosqlite import __version__ as aiosqlite_version
 
-from sambot import __version__ as sambot_version
-from sambot import bot, config, dp
-from sambot.database import create_tables, run_vacuum
+from sambot import bot, config, dp, get_version
+from sambot.database import create_tables, vacuum_databases
 from sambot.database.devices import Devices
 from sambot.database.firmware import Firmwares
-from sambot.handlers import doas
+from sambot.database.kernels import Kernels
+from sambot.handlers import doas, lookup
 from sambot.utils.devices import sync_devices
+from sambot.utils.lifecycle import lifecycle
 from sambot.utils.logging import log
-from sambot.utils.notify import sync_firmwares
+from sambot.utils.lookup import device_index
+from sambot.utils.metrics import export_metrics, metrics
+from sambot.utils.notify import sync_firmwares, sync_kernels
+from sambot.utils.startup import startup
+from sambot.utils.tracing import tracer
+from sambot.utils.webhook import WebhookServer
 
+DATABASES = (Devices.db_path, Firmwares.db_path, Kernels.db_path)
 
-async def main():
-    if config.sentry_url:
-        log.info("Starting sentry.io integraion.")
+background_tasks: set[asyncio.Task] = set()
+
+
+def run_in_background(coro: Coroutine[Any, Any, None]) -> None:
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+async def send_startup_notification() -> None:
+    version = await asyncio.to_thread(get_version)
+    log.info("[Startup] - Resolved version.", version=version)
+    with suppress(TelegramForbiddenError):
+        if config.logs_channel:
+            log.info("Sending startup notification.")
+            await bot.send_message(
+                config.logs_channel,
+                text=(
+                    "<b>Samsung Helper is up and running!</b>\n\n"
+                    f"<b>Version:</b> <code>{version}</code>\n"
+                    f"<b>AIOgram version:</b> <code>{aiogram_version}</code>\n"
+                    f"<b>AIOSQLite version:</b> <code>{aiosqlite_version}</code>"
+                ),
+            )
+
+
+def report_startup() -> None:
+    for phase in startup.phases:
+        metrics.set("startup_phase_seconds", phase.seconds, phase=phase.name)
+        log.info(
+            "[Startup] - Phase finished.",
+            phase=phase.name,
+            seconds=round(phase.seconds, 3),
+            modules=phase.modules,
+        )
+    log.info(
+        "[Startup] - Bot is ready.",
+        seconds=round(startup.elapsed, 3),
+        modules=len(sys.modules),
+    )
+
+
+async def on_startup() -> None:  # noqa: RUF029
+    startup.mark("ready")
+    report_startup()
+    # VACUUM rewrites the whole file, so it runs once updates are flowing and
+    # only for databases with enough free pages to be worth it.
+    run_in_background(vacuum_databases(DATABASES, config.vacuum_min_free_ratio))
+    run_in_background(send_startup_notification())
+    run_in_background(device_index.refresh())
+    run_in_background(resume_jobs())
+
+
+async def on_shutdown() -> None:
+    await lifecycle.shutdown()
+
+
+async def resume_jobs() -> None:
+    checkpoints = await lifecycle.load_checkpoints()
+    if not checkpoints:
+        return
 
-        sentry_sdk.init(str(config.sentry_url))
+    log.info("[Lifecycle] - Resuming interrupted jobs.", jobs=list(checkpoints))
+    for job, state in checkpoints.items():
+        if lifecycle.stopping:
+            # Stopped again before getting to this job, keep it for the next start.
+            await lifecycle.checkpoint(job, state)
+        elif job == "devices":
+            await sync_devices(state.get("full", False), state.get("done"))
+        elif job == "firmwares":
+            await sync_firmwares(state.get("models"), state.get("run"))
+        elif job == "kernels":
+            await sync_kernels(state.get("models"))
+        else:
+            log.warn("[Lifecycle] - Dropping checkpoint of unknown job.", job=job)
+
+
+async def first_update(
+    handler: Callable[[Update, dict[str, Any]], Awaitable[Any]],
+    update: Update,
+    data: dict[str, Any],
+) -> Any:
+    if startup.first_update is None:
+        startup.first_update = startup.elapsed
+        metrics.set("startup_first_update_seconds", startup.first_update)
+        log.info("[Startup] - First update received.", seconds=round(startup.first_update, 3))
+    return await handler(update, data)
+
+
+async def run_webhook(allowed_updates: list[str]) -> None:
+    secret = config.webhook_secret.get_secret_value() if config.webhook_secret else None
+    server = WebhookServer(dp, bot, config.webhook_path, secret, config.webhook_concurrency)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await server.start(config.webhook_host, config.webhook_port)
+    try:
+        await bot.set_webhook(
+            url=str(config.webhook_url).rstrip("/") + config.webhook_path,
+            secret_token=secret,
+            allowed_updates=allowed_updates,
+            max_connections=config.webhook_concurrency,
+        )
+        log.info(
+            "[Webhook] - Serving updates.",
+            host=config.webhook_host,
+            port=config.webhook_port,
+            path=config.webhook_path,
+        )
+        await dp.emit_startup(bot=bot)
+        await stop.wait()
+    finally:
+        log.info("[Webhook] - Shutting down.")
+        await server.stop(config.webhook_shutdown_timeout)
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()
+
+
+async def main():
+    startup.mark("imports")
+    log.info("Starting Samgung Helper Bot...")
+    tracer.setup()
 
     await create_tables()
-    dbs = [
-        Devices().db_path,
-        Firmwares().db_path,
-    ]
-    for db in dbs:
-        await run_vacuum(db)
+    startup.mark("database")
 
     dp.include_router(doas.router)
+    dp.include_router(lookup.router)
+    dp.update.outer_middleware(first_update)
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    lifecycle.on_cleanup(bot.session.close)
 
     aiocron.crontab(
         "0 */6 * * *",
@@ -45,29 +176,36 @@ async def main():
         loop=asyncio.get_event_loop(),
         tz=datetime.UTC,
     )
+    aiocron.crontab(
+        "30 3 * * *",
+        func=sync_kernels,
+        loop=asyncio.get_event_loop(),
+        tz=datetime.UTC,
+    )
     aiocron.crontab(
         "0 0 1 * *",
         func=sync_devices,
         loop=asyncio.get_event_loop(),
         tz=datetime.UTC,
     )
+    if config.metrics_file:
+        aiocron.crontab(
+            "* * * * *",
+            func=export_metrics,
+            loop=asyncio.get_event_loop(),
+            tz=datetime.UTC,
+        )
 
-    with suppress(TelegramForbiddenError):
-        if config.logs_channel:
-            log.info("Sending startup notification.")
-            await bot.send_message(
-                config.logs_channel,
-                text=(
-                    "<b>Samsung Helper is up and running!</b>\n\n"
-                    f"<b>Version:</b> <code>{sambot_version}</code>\n"
-                    f"<b>AIOgram version:</b> <code>{aiogram_version}</code>\n"
-                    f"<b>AIOSQLite version:</b> <code>{aiosqlite_version}</code>"
-                ),
-            )
+    startup.mark("setup")
 
     # resolve used update types
     useful_updates = dp.resolve_used_update_types()
-    await dp.start_polling(bot, allowed_updates=useful_updates)
+    if config.webhook_url:
+        await run_webhook(useful_updates)
+    else:
+        # getUpdates is refused while a webhook is registered.
+        await bot.delete_webhook()
+        await dp.start_polling(bot, allowed_updates=useful_updates)
 
 
 if __name__ == "__main__":
@@ -1,7 +1,8 @@
 # SPDX-License-Identifier: BSD-3-Clause
 # Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
 
-from typing import ClassVar
+from pathlib import Path
+from typing import ClassVar, Literal
 
 from pydantic import AnyHttpUrl, SecretStr
 from pydantic_settings import BaseSettings
@@ -11,10 +12,61 @@ class Settings(BaseSettings):
     bot_token: SecretStr
     redis_host: str = "localhost"
     cors_bypass: str
+    build_version: str | None = None
     sentry_url: AnyHttpUrl | None = None
+    sentry_traces_sample_rate: float = 0.0
+    sentry_profiles_sample_rate: float = 0.0
     sudoers: ClassVar[list[int]] = [918317361]
     logs_channel: int | None = None
     fw_channel: int | None = None
+    metrics_file: Path | None = None
+    log_format: Literal["console", "json"] = "console"
+    log_queue: bool = False
+    log_sample_rate: float = 1.0
+    http_mode: Literal["live", "record", "replay"] = "live"
+    cassette_dir: Path = Path("data/cassettes")
+    replay_url: str | None = None
+    fw_fetch_interval: float = 3.0
+    region_group_ttl_hours: float = 24.0
+    kernel_fetch_interval: float = 3.0
+    kernel_sync_concurrency: int = 4
+    kernel_family_length: int = 6
+    kernel_search_ttl: float = 6 * 3600
+    kernel_download_chunk_size: int = 1024 * 1024
+    kernel_download_attempts: int = 5
+    kernel_download_progress_interval: float = 5.0
+    download_cache_max_size: int = 20 * 1024**3
+    device_sync_concurrency: int = 4
+    device_sync_buffer: int = 16
+    device_refresh_days: int = 90
+    sync_memory_limit_mb: int | None = None
+    regions_ttl_days: float = 7.0
+    regions_stale_days: float = 30.0
+    specs_storage: Literal["rows", "blob"] = "blob"
+    sync_workers: bool = False
+    sync_queue_path: Path | None = None
+    sync_queue_busy_timeout: float = 30.0
+    worker_concurrency: int = 4
+    worker_shard_size: int = 10
+    worker_lease_seconds: int = 120
+    worker_max_attempts: int = 3
+    worker_run_timeout: int = 5 * 3600
+    worker_claim_grace: int = 300
+    vacuum_min_free_ratio: float = 0.1
+    lookup_cache_size: int = 512
+    shell_timeout: float = 600.0
+    shell_edit_interval: float = 3.0
+    shell_spill_size: int = 256 * 1024
+    shutdown_grace: float = 60.0
+    checkpoint_file: Path = Path("data/checkpoint.json")
+    lookup_results: int = 10
+    webhook_url: AnyHttpUrl | None = None
+    webhook_path: str = "/webhook"
+    webhook_secret: SecretStr | None = None
+    webhook_host: str = "127.0.0.1"
+    webhook_port: int = 8080
+    webhook_concurrency: int = 32
+    webhook_shutdown_timeout: float = 30.0
 
     class Config:
         env_file = "data/config.env"
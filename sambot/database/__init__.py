@@ -1,13 +1,27 @@
 # SPDX-License-Identifier: BSD-3-Clause
 # Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
 
-from sambot.database.base import run_vacuum
+from sambot.database.base import run_vacuum, vacuum_databases
 from sambot.database.devices import Devices
 from sambot.database.firmware import Firmwares
+from sambot.database.kernels import Kernels
+from sambot.database.queue import SyncQueue
+from sambot.database.regions import RegionsCache
 
-__all__ = ("Devices", "Firmwares", "run_vacuum")
+__all__ = (
+    "Devices",
+    "Firmwares",
+    "Kernels",
+    "RegionsCache",
+    "SyncQueue",
+    "run_vacuum",
+    "vacuum_databases",
+)
 
 
 async def create_tables() -> None:
     await Devices().create_tables()
     await Firmwares().create_tables()
+    await Kernels().create_tables()
+    await SyncQueue().create_tables()
+    await RegionsCache().create_tables()
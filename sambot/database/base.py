@@ -1,6 +1,9 @@
 # SPDX-License-Identifier: BSD-3-Clause
 # Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
 
+import time
+from asyncio import CancelledError
+from collections.abc import Iterable, Iterator, Sequence
 from pathlib import Path
 from types import TracebackType
 from typing import Any, TypeVar
@@ -8,16 +11,32 @@ from typing import Any, TypeVar
 import aiosqlite
 
 from sambot.utils.logging import log
+from sambot.utils.metrics import metrics
+from sambot.utils.tracing import tracer
 
 T = TypeVar("T")
 
+# SQLite builds before 3.32 allow at most 999 bound variables per statement.
+MAX_VARIABLES = 900
+
+
+def chunked(items: Sequence[T], size: int = MAX_VARIABLES) -> Iterator[Sequence[T]]:
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def placeholders(count: int) -> str:
+    return ", ".join("?" * count)
+
 
 class SqliteDBConn:
-    def __init__(self, db_name: Path) -> None:
+    def __init__(self, db_name: Path, busy_timeout: float = 5.0) -> None:
         self.db_name = db_name
+        self.busy_timeout = busy_timeout
 
     async def __aenter__(self) -> aiosqlite.Connection:
-        self.conn = await aiosqlite.connect(self.db_name)
+        # SQLite retries a locked database for up to this many seconds.
+        self.conn = await aiosqlite.connect(self.db_name, timeout=self.busy_timeout)
         self.conn.row_factory = aiosqlite.Row
         return self.conn
 
@@ -33,6 +52,8 @@ class SqliteDBConn:
 
 
 class SqliteConnection:
+    busy_timeout: float = 5.0
+
     @staticmethod
     async def __make_request(
         db: Path,
@@ -40,26 +61,35 @@ class SqliteConnection:
         params: list[tuple] | tuple = (),
         fetch: bool = False,
         mult: bool = False,
+        busy_timeout: float = 5.0,
     ) -> Any:
-        async with SqliteDBConn(db) as conn:
-            try:
-                if ";" in sql:
-                    await conn.executescript(sql)
-                else:
-                    cursor = (
-                        await conn.executemany(sql, params)
-                        if isinstance(params, list)
-                        else await conn.execute(sql, params)
+        with tracer.span("db.sql", sql):
+            async with SqliteDBConn(db, busy_timeout) as conn:
+                metrics.inc("db_queries_total", db=db.stem)
+                try:
+                    if ";" in sql:
+                        await conn.executescript(sql)
+                    else:
+                        cursor = (
+                            await conn.executemany(sql, params)
+                            if isinstance(params, list)
+                            else await conn.execute(sql, params)
+                        )
+                        if fetch:
+                            result = await cursor.fetchall() if mult else await cursor.fetchone()
+                            # Writes with RETURNING clauses are fetched too.
+                            await conn.commit()
+                            return result
+                        await conn.commit()
+                except (KeyboardInterrupt, CancelledError):
+                    raise
+                except BaseException:
+                    metrics.inc("db_errors_total", db=db.stem)
+                    log.exception(
+                        "[SqliteConnection] - Failed to execute query! SQL: %s, Params: %s",
+                        sql,
+                        params,
                     )
-                    if fetch:
-                        return await cursor.fetchall() if mult else await cursor.fetchone()
-                    await conn.commit()
-            except BaseException:
-                log.exception(
-                    "[SqliteConnection] - Failed to execute query! SQL: %s, Params: %s",
-                    sql,
-                    params,
-                )
 
     @staticmethod
     def _convert_to_model(data: dict, model: type[T]) -> T:
@@ -69,12 +99,12 @@ class SqliteConnection:
         self,
         db: Path,
         sql: str,
-        params: tuple = (),
+        params: list[tuple] | tuple = (),
         fetch: bool = False,
         mult: bool = False,
         model_type: type[T] | None = None,
     ) -> T | list[T] | str | None:
-        raw = await self.__make_request(db, sql, params, fetch, mult)
+        raw = await self.__make_request(db, sql, params, fetch, mult, self.busy_timeout)
         if raw is None:
             return [] if mult else None
         if mult:
@@ -85,9 +115,48 @@ class SqliteConnection:
             )
         return self._convert_to_model(raw, model_type) if model_type is not None else raw
 
+    async def _fetch_in(
+        self, db: Path, sql: str, keys: Sequence, size: int = MAX_VARIABLES
+    ) -> list:
+        rows = []
+        for chunk in chunked(list(dict.fromkeys(keys)), size):
+            rows.extend(
+                await self._make_request(
+                    db, sql.format(placeholders(len(chunk))), tuple(chunk), fetch=True, mult=True
+                )
+            )
+        return rows
+
+
+async def free_ratio(conn: aiosqlite.Connection) -> float:
+    async with conn.execute("PRAGMA page_count") as cursor:
+        (pages,) = await cursor.fetchone()  # type: ignore[misc]
+    async with conn.execute("PRAGMA freelist_count") as cursor:
+        (free,) = await cursor.fetchone()  # type: ignore[misc]
+    return free / pages if pages else 0.0
 
-async def run_vacuum(db: Path) -> None:
+
+async def run_vacuum(db: Path, min_free_ratio: float = 0.0) -> None:
     async with SqliteDBConn(db) as conn:
-        await conn.execute("VACUUM")
+        ratio = await free_ratio(conn)
+        if ratio >= min_free_ratio:
+            start = time.perf_counter()
+            await conn.execute("VACUUM")
+            log.info(
+                "[Database] - Vacuumed database.",
+                db=db.name,
+                free=round(ratio, 3),
+                seconds=round(time.perf_counter() - start, 2),
+            )
         await conn.execute("PRAGMA journal_mode=WAL")
         await conn.commit()
+
+
+async def vacuum_databases(dbs: Iterable[Path], min_free_ratio: float = 0.0) -> None:
+    for db in dbs:
+        try:
+            await run_vacuum(db, min_free_ratio)
+        except (KeyboardInterrupt, CancelledError):
+            raise
+        except Exception:
+            log.exception("[Database] - Failed to vacuum database!", db=db.name)
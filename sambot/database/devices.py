@@ -1,15 +1,41 @@
 # SPDX-License-Identifier: BSD-3-Clause
 # Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
 
+import time
+import zlib
+from collections import defaultdict
 from pathlib import Path
 
+import aiosqlite
+import orjson
+
 from sambot import app_dir
+from sambot.config import config
 from sambot.database.base import SqliteConnection
+from sambot.utils.logging import log
+from sambot.utils.metrics import metrics
+from sambot.utils.tracing import tracer
+
+SPECS_VERSION = 1
+
+
+def encode_specs(details: dict[str, dict[str, str]]) -> bytes:
+    return zlib.compress(orjson.dumps(details))
+
+
+def decode_specs(version: int, data: bytes) -> dict[str, dict[str, str]] | None:
+    if version != SPECS_VERSION:
+        return None
+    return orjson.loads(zlib.decompress(data))
 
 
 class Devices(SqliteConnection):
     db_path: Path = app_dir / "sambot/database/devices.db"
 
+    def __init__(self, db_path: Path | None = None) -> None:
+        if db_path is not None:
+            self.db_path = db_path
+
     async def create_tables(self) -> None:
         sql = """
         CREATE TABLE IF NOT EXISTS devices (
@@ -36,68 +62,164 @@ class Devices(SqliteConnection):
             Value TEXT,
             FOREIGN KEY (DeviceID) REFERENCES devices(DeviceID)
         );
+        CREATE TABLE IF NOT EXISTS catalog (
+            DeviceID INTEGER PRIMARY KEY,
+            FirstSeen REAL,
+            LastFetched REAL,
+            Relevant INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS specs (
+            DeviceID INTEGER PRIMARY KEY,
+            Version INTEGER,
+            Data BLOB,
+            FOREIGN KEY (DeviceID) REFERENCES devices(DeviceID)
+        );
         """
 
         for statement in sql.strip().split(";"):
             if statement.strip():
                 await self._make_request(self.db_path, statement)
 
+        if config.specs_storage == "blob":
+            await self.migrate_specs()
+
+    @tracer.traced("db.save", name="Devices.save")
     async def save(self, device) -> list | str | None:
-        # Delete old data
-        model = await self._make_request(
-            self.db_path, "SELECT Model FROM models WHERE DeviceID = ?", (device.id,), fetch=True
-        )
+        with metrics.timer("db_duration_seconds", op="devices_save"):
+            # Delete old data
+            model = await self._make_request(
+                self.db_path,
+                "SELECT Model FROM models WHERE DeviceID = ?",
+                (device.id,),
+                fetch=True,
+            )
+
+            if model:
+                await self._make_request(
+                    self.db_path, "DELETE FROM regions WHERE Model = ?", (model[0],)
+                )
 
-        if model:
             await self._make_request(
-                self.db_path, "DELETE FROM regions WHERE Model = ?", (model[0],)
+                self.db_path,
+                """
+                DELETE FROM details WHERE DeviceID = ?;
+                DELETE FROM models WHERE DeviceID = ?;
+                DELETE FROM devices WHERE DeviceID = ?;
+                """,
+                (device.id, device.id, device.id),
             )
 
+            # Insert new data
+            await self._make_request(
+                self.db_path,
+                """
+                INSERT OR REPLACE INTO devices (DeviceID, Name, URL, ImgURL, ShortDescription)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (device.id, device.name, device.url, device.img_url, device.short_description),
+            )
+
+            for model in device.models:
+                await self._make_request(
+                    self.db_path,
+                    "INSERT OR REPLACE INTO models (DeviceID, Model) VALUES (?, ?)",
+                    (device.id, model),
+                )
+
+            for model, regions in device.regions.items():
+                for region in regions:
+                    await self._make_request(
+                        self.db_path,
+                        "INSERT OR REPLACE INTO regions (Model, Region) VALUES (?, ?)",
+                        (model, region),
+                    )
+
+            await self.save_specs(device.id, device.details)
+
+    async def save_specs(self, device_id: int, details: dict[str, dict[str, str]]) -> None:
+        if config.specs_storage == "blob":
+            await self._make_request(
+                self.db_path,
+                "INSERT OR REPLACE INTO specs (DeviceID, Version, Data) VALUES (?, ?, ?)",
+                (device_id, SPECS_VERSION, encode_specs(details)),
+            )
+            return
+
         await self._make_request(
+            self.db_path, "DELETE FROM specs WHERE DeviceID = ?", (device_id,)
+        )
+        params = [
+            (device_id, category, name, value)
+            for category, specs in details.items()
+            for name, value in specs.items()
+        ]
+        if params:
+            await self._make_request(
+                self.db_path,
+                """
+                INSERT OR REPLACE INTO details (DeviceID, Category, Name, Value)
+                VALUES (?, ?, ?, ?)
+                """,
+                params,
+            )
+
+    async def get_specs(self, device_id: int) -> dict[str, dict[str, str]]:
+        with metrics.timer("db_duration_seconds", op="specs_get"):
+            result = await self._make_request(
+                self.db_path,
+                "SELECT Version, Data FROM specs WHERE DeviceID = ?",
+                (device_id,),
+                fetch=True,
+            )
+            if result and (specs := decode_specs(result[0], result[1])) is not None:
+                return specs
+
+            # Devices saved in rows mode, or not yet migrated.
+            details: dict[str, dict[str, str]] = defaultdict(dict)
+            for row in await self.get_specs_by_id(device_id) or []:
+                details[row["Category"]][row["Name"]] = row["Value"]
+            return dict(details)
+
+    async def migrate_specs(self) -> int:
+        rows = await self._make_request(
             self.db_path,
-            """
-            DELETE FROM details WHERE DeviceID = ?;
-            DELETE FROM models WHERE DeviceID = ?;
-            DELETE FROM devices WHERE DeviceID = ?;
-            """,
-            (device.id, device.id, device.id),
+            "SELECT DeviceID, Category, Name, Value FROM details ORDER BY DeviceID",
+            fetch=True,
+            mult=True,
         )
+        if not rows:
+            return 0
 
-        # Insert new data
+        grouped: dict[int, dict[str, dict[str, str]]] = defaultdict(lambda: defaultdict(dict))
+        for device_id, category, name, value in rows:
+            grouped[device_id][category][name] = value
+
+        blobs = {device_id: encode_specs(details) for device_id, details in grouped.items()}
         await self._make_request(
             self.db_path,
-            """
-            INSERT OR REPLACE INTO devices (DeviceID, Name, URL, ImgURL, ShortDescription)
-            VALUES (?, ?, ?, ?, ?)
-            """,
-            (device.id, device.name, device.url, device.img_url, device.short_description),
+            "INSERT OR REPLACE INTO specs (DeviceID, Version, Data) VALUES (?, ?, ?)",
+            [(device_id, SPECS_VERSION, data) for device_id, data in blobs.items()],
         )
-
-        for model in device.models:
-            await self._make_request(
-                self.db_path,
-                "INSERT OR REPLACE INTO models (DeviceID, Model) VALUES (?, ?)",
-                (device.id, model),
+        # Requests swallow errors, so only drop the rows once exactly these
+        # blobs are stored; older blobs of the same devices do not count.
+        stored = await self._fetch_in(
+            self.db_path, "SELECT DeviceID, Data FROM specs WHERE DeviceID IN ({})", list(blobs)
+        )
+        migrated = {device_id for device_id, data in stored if blobs[device_id] == data}
+        if migrated != blobs.keys():
+            log.error(
+                "[Devices] - Specs migration incomplete, keeping detail rows.",
+                missing=len(blobs.keys() - migrated),
             )
+            return 0
 
-        for model, regions in device.regions.items():
-            for region in regions:
-                await self._make_request(
-                    self.db_path,
-                    "INSERT OR REPLACE INTO regions (Model, Region) VALUES (?, ?)",
-                    (model, region),
-                )
-
-        for category, details in device.details.items():
-            for name, value in details.items():
-                await self._make_request(
-                    self.db_path,
-                    """
-                    INSERT OR REPLACE INTO details (DeviceID, Category, Name, Value)
-                    VALUES (?, ?, ?, ?)
-                    """,
-                    (device.id, category, name, value),
-                )
+        await self._make_request(
+            self.db_path,
+            "DELETE FROM details WHERE DeviceID = ?",
+            [(device_id,) for device_id in migrated],
+        )
+        log.info("[Devices] - Migrated specs to compressed blobs.", devices=len(grouped))
+        return len(grouped)
 
     async def get_all_models(self) -> list | str | None:
         result = await self._make_request(
@@ -138,3 +260,84 @@ class Devices(SqliteConnection):
             fetch=True,
             mult=True,
         )
+
+    async def get_regions_by_models(self, models: list[str]) -> dict[str, list[str]]:
+        rows = await self._fetch_in(
+            self.db_path, "SELECT Model, Region FROM regions WHERE Model IN ({})", models
+        )
+        result: dict[str, list[str]] = defaultdict(list)
+        for model, region in rows:
+            result[model].append(region)
+        return dict(result)
+
+    async def get_devices_by_ids(self, device_ids: list[int]) -> dict[int, aiosqlite.Row]:
+        rows = await self._fetch_in(
+            self.db_path, "SELECT * FROM devices WHERE DeviceID IN ({})", device_ids
+        )
+        return {row["DeviceID"]: row for row in rows}
+
+    async def get_specs_by_ids(
+        self, device_ids: list[int]
+    ) -> dict[int, dict[str, dict[str, str]]]:
+        result: dict[int, dict[str, dict[str, str]]] = {}
+        with metrics.timer("db_duration_seconds", op="specs_get_many"):
+            rows = await self._fetch_in(
+                self.db_path,
+                "SELECT DeviceID, Version, Data FROM specs WHERE DeviceID IN ({})",
+                device_ids,
+            )
+            for device_id, version, data in rows:
+                if (specs := decode_specs(version, data)) is not None:
+                    result[device_id] = specs
+
+            missing = [device_id for device_id in device_ids if device_id not in result]
+            rows = await self._fetch_in(
+                self.db_path,
+                "SELECT DeviceID, Category, Name, Value FROM details WHERE DeviceID IN ({})",
+                missing,
+            )
+            for device_id, category, name, value in rows:
+                result.setdefault(device_id, {}).setdefault(category, {})[name] = value
+        return result
+
+    async def get_catalog(self) -> dict[int, float]:
+        result = await self._make_request(
+            self.db_path, "SELECT DeviceID, FirstSeen FROM catalog", fetch=True, mult=True
+        )
+        return {row[0]: row[1] for row in result} if result else {}
+
+    async def get_listings(self) -> dict[int, tuple[str, str, str]]:
+        result = await self._make_request(
+            self.db_path,
+            "SELECT DeviceID, Name, ImgURL, ShortDescription FROM devices",
+            fetch=True,
+            mult=True,
+        )
+        return {row[0]: (row[1], row[2], row[3]) for row in result} if result else {}
+
+    async def get_all_devices(self) -> list[aiosqlite.Row]:
+        return (
+            await self._make_request(self.db_path, "SELECT * FROM devices", fetch=True, mult=True)
+            or []
+        )
+
+    async def get_models_by_device(self) -> dict[int, list[str]]:
+        result = await self._make_request(
+            self.db_path, "SELECT DeviceID, Model FROM models", fetch=True, mult=True
+        )
+        models: dict[int, list[str]] = defaultdict(list)
+        for device_id, model in result or []:
+            models[device_id].append(model)
+        return dict(models)
+
+    async def mark_fetched(self, device_id: int, first_seen: float, relevant: bool) -> None:
+        sql = """
+        INSERT INTO catalog (DeviceID, FirstSeen, LastFetched, Relevant)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (DeviceID) DO UPDATE SET
+            LastFetched = excluded.LastFetched,
+            Relevant = excluded.Relevant
+        """
+        await self._make_request(
+            self.db_path, sql, (device_id, first_seen, time.time(), int(relevant))
+        )
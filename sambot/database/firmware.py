@@ -1,24 +1,141 @@
 # SPDX-License-Identifier: BSD-3-Clause
 # Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
 
+import hashlib
+import time
+import zlib
 from pathlib import Path
+from typing import TYPE_CHECKING
+
+import aiosqlite
 
 from sambot import app_dir
 from sambot.database.base import SqliteConnection
+from sambot.utils.logging import log
+from sambot.utils.metrics import metrics
+
+if TYPE_CHECKING:
+    from sambot.utils.firmware import FirmwareMeta
+
+
+def hash_changelog(text: str) -> str:
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
 
 
 class Firmwares(SqliteConnection):
-    def __init__(self, db_path: Path = app_dir / "sambot/database/firmwares.db") -> None:
-        self.db_path = db_path
+    db_path: Path = app_dir / "sambot/database/firmwares.db"
+
+    def __init__(self, db_path: Path | None = None) -> None:
+        if db_path is not None:
+            self.db_path = db_path
 
     async def create_tables(self) -> None:
         sql = """
         CREATE TABLE IF NOT EXISTS pda (
             Model TEXT PRIMARY KEY,
             PDA TEXT
-        )
+        );
+        CREATE TABLE IF NOT EXISTS firmware_history (
+            Model TEXT,
+            Region TEXT,
+            PDA TEXT,
+            OSVersion TEXT,
+            BuildDate TEXT,
+            SecurityPatch TEXT,
+            Name TEXT,
+            ChangelogHash TEXT,
+            PRIMARY KEY (Model, Region, PDA)
+        );
+        CREATE TABLE IF NOT EXISTS changelogs (
+            Hash TEXT PRIMARY KEY,
+            Data BLOB
+        );
+        CREATE INDEX IF NOT EXISTS idx_firmware_history_date
+            ON firmware_history (Model, Region, BuildDate);
+        CREATE TABLE IF NOT EXISTS region_groups (
+            Model TEXT,
+            Region TEXT,
+            Magic TEXT,
+            CheckedAt REAL,
+            PRIMARY KEY (Model, Region)
+        );
         """
-        await self._make_request(self.db_path, sql)
+
+        for statement in sql.strip().split(";"):
+            if statement.strip():
+                await self._make_request(self.db_path, statement)
+
+        await self.migrate_changelogs()
+
+    async def migrate_changelogs(self) -> None:
+        columns = await self._make_request(
+            self.db_path, "PRAGMA table_info(firmware_history)", fetch=True, mult=True
+        )
+        names = {column["name"] for column in columns}
+        if "ChangelogHash" not in names:
+            await self._make_request(
+                self.db_path, "ALTER TABLE firmware_history ADD COLUMN ChangelogHash TEXT"
+            )
+        if "Changelog" not in names:
+            return
+
+        rows = await self._make_request(
+            self.db_path,
+            "SELECT rowid, Changelog FROM firmware_history WHERE Changelog IS NOT NULL",
+            fetch=True,
+            mult=True,
+        )
+        if not rows:
+            return
+
+        hashes = [(row[0], hash_changelog(row[1])) for row in rows]
+        await self.add_changelogs({
+            digest: row[1] for row, (_, digest) in zip(rows, hashes, strict=True)
+        })
+        # Requests swallow errors, so only clear the inline text of rows whose
+        # body is confirmed stored under its hash.
+        digests = {digest for _, digest in hashes}
+        stored = {
+            row[0]
+            for row in await self._fetch_in(
+                self.db_path, "SELECT Hash FROM changelogs WHERE Hash IN ({})", list(digests)
+            )
+        }
+        migrated = [(digest, rowid) for rowid, digest in hashes if digest in stored]
+        if len(stored) < len(digests):
+            log.error(
+                "[Firmwares] - Changelog migration incomplete, keeping inline text.",
+                missing=len(digests - stored),
+            )
+        if not migrated:
+            return
+
+        await self._make_request(
+            self.db_path,
+            "UPDATE firmware_history SET ChangelogHash = ?, Changelog = NULL WHERE rowid = ?",
+            migrated,
+        )
+        log.info(
+            "[Firmwares] - Moved changelogs to content-addressed storage.",
+            rows=len(migrated),
+            unique=len(stored),
+        )
+
+    async def add_changelogs(self, changelogs: dict[str, str]) -> None:
+        if not changelogs:
+            return
+
+        await self._make_request(
+            self.db_path,
+            "INSERT OR IGNORE INTO changelogs (Hash, Data) VALUES (?, ?)",
+            [(digest, zlib.compress(text.encode())) for digest, text in changelogs.items()],
+        )
+
+    async def get_changelog(self, digest: str) -> str | None:
+        result = await self._make_request(
+            self.db_path, "SELECT Data FROM changelogs WHERE Hash = ?", (digest,), fetch=True
+        )
+        return zlib.decompress(result[0]).decode() if result else None
 
     async def get_pda(self, model: str) -> str | None:
         sql = "SELECT PDA FROM pda WHERE Model = ?"
@@ -39,3 +156,113 @@ class Firmwares(SqliteConnection):
             sql = "INSERT INTO pda (Model, PDA) VALUES (?, ?)"
         params = (model, pda) if "INSERT" in sql else (pda, model)
         await self._make_request(self.db_path, sql, params)
+
+    async def add_history(self, history: list["FirmwareMeta"]) -> None:
+        if not history:
+            return
+
+        sql = """
+        INSERT OR IGNORE INTO firmware_history
+            (Model, Region, PDA, OSVersion, BuildDate, SecurityPatch, Name, ChangelogHash)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """
+        params = [
+            (
+                info.model,
+                info.region,
+                info.pda,
+                info.os_version,
+                info.build_date.strftime("%Y-%m-%d"),
+                info.securitypatch.strftime("%Y-%m-%d"),
+                info.name,
+                info.changelog_hash,
+            )
+            for info in history
+        ]
+        with metrics.timer("db_duration_seconds", op="firmware_history_add"):
+            await self.add_changelogs({
+                info.changelog_hash: info.changelog
+                for info in history
+                if info.changelog_hash and info.changelog is not None
+            })
+            await self._make_request(self.db_path, sql, params)
+
+    async def get_history(
+        self, model: str, region: str | None = None, limit: int = 50
+    ) -> list | str | None:
+        if region is None:
+            sql = """
+            SELECT * FROM firmware_history WHERE Model = ?
+            ORDER BY BuildDate DESC LIMIT ?
+            """
+            params = (model, limit)
+        else:
+            sql = """
+            SELECT * FROM firmware_history WHERE Model = ? AND Region = ?
+            ORDER BY BuildDate DESC LIMIT ?
+            """
+            params = (model, region, limit)
+        return await self._make_request(self.db_path, sql, params, fetch=True, mult=True)
+
+    async def get_latest(self, model: str, region: str) -> list | str | None:
+        sql = """
+        SELECT * FROM firmware_history WHERE Model = ? AND Region = ?
+        ORDER BY BuildDate DESC LIMIT 1
+        """
+        return await self._make_request(self.db_path, sql, (model, region), fetch=True)
+
+    async def get_pdas(self, models: list[str]) -> dict[str, str]:
+        rows = await self._fetch_in(
+            self.db_path, "SELECT Model, PDA FROM pda WHERE Model IN ({})", models
+        )
+        return {row[0]: row[1] for row in rows}
+
+    async def get_latest_by_models(
+        self, models: list[str]
+    ) -> dict[tuple[str, str], aiosqlite.Row]:
+        sql = """
+        SELECT * FROM (
+            SELECT *, ROW_NUMBER() OVER (
+                PARTITION BY Model, Region ORDER BY BuildDate DESC
+            ) AS Position
+            FROM firmware_history WHERE Model IN ({})
+        ) WHERE Position = 1
+        """
+        rows = await self._fetch_in(self.db_path, sql, models)
+        return {(row["Model"], row["Region"]): row for row in rows}
+
+    async def get_all_latest(self) -> list[aiosqlite.Row]:
+        sql = """
+        SELECT * FROM (
+            SELECT *, ROW_NUMBER() OVER (
+                PARTITION BY Model, Region ORDER BY BuildDate DESC
+            ) AS Position
+            FROM firmware_history
+        ) WHERE Position = 1
+        """
+        return await self._make_request(self.db_path, sql, fetch=True, mult=True) or []
+
+    async def get_region_magics(
+        self, models: list[str]
+    ) -> dict[tuple[str, str], tuple[str, float]]:
+        rows = await self._fetch_in(
+            self.db_path,
+            "SELECT Model, Region, Magic, CheckedAt FROM region_groups WHERE Model IN ({})",
+            models,
+        )
+        return {(row[0], row[1]): (row[2], row[3]) for row in rows}
+
+    async def set_region_magic(self, model: str, region: str, magic: str) -> None:
+        sql = """
+        INSERT OR REPLACE INTO region_groups (Model, Region, Magic, CheckedAt)
+        VALUES (?, ?, ?, ?)
+        """
+        await self._make_request(self.db_path, sql, (model, region, magic, time.time()))
+
+    async def get_region_pda(self, model: str, region: str) -> str | None:
+        sql = """
+        SELECT PDA FROM firmware_history WHERE Model = ? AND Region = ?
+        ORDER BY BuildDate DESC LIMIT 1
+        """
+        result = await self._make_request(self.db_path, sql, (model, region), fetch=True)
+        return result[0] if result else None
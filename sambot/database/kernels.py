@@ -0,0 +1,64 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
+
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import aiosqlite
+
+from sambot import app_dir
+from sambot.database.base import SqliteConnection
+
+if TYPE_CHECKING:
+    from sambot.utils.kernel import KernelMeta
+
+
+class Kernels(SqliteConnection):
+    db_path: Path = app_dir / "sambot/database/kernels.db"
+
+    def __init__(self, db_path: Path | None = None) -> None:
+        if db_path is not None:
+            self.db_path = db_path
+
+    async def create_tables(self) -> None:
+        sql = """
+        CREATE TABLE IF NOT EXISTS kernels (
+            Model TEXT PRIMARY KEY,
+            PDA TEXT,
+            UploadID TEXT,
+            PatchKernel TEXT,
+            CheckedAt REAL,
+            UpdatedAt REAL
+        )
+        """
+        await self._make_request(self.db_path, sql)
+
+    async def get_kernel(self, model: str) -> aiosqlite.Row | None:
+        sql = "SELECT * FROM kernels WHERE Model = ?"
+        return await self._make_request(self.db_path, sql, (model,), fetch=True)
+
+    async def get_kernels(self, models: list[str]) -> dict[str, aiosqlite.Row]:
+        rows = await self._fetch_in(
+            self.db_path, "SELECT * FROM kernels WHERE Model IN ({})", models
+        )
+        return {row["Model"]: row for row in rows}
+
+    async def save_kernel(self, kernel: "KernelMeta") -> None:
+        sql = """
+        INSERT INTO kernels (Model, PDA, UploadID, PatchKernel, CheckedAt, UpdatedAt)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (Model) DO UPDATE SET
+            PDA = excluded.PDA,
+            UploadID = excluded.UploadID,
+            PatchKernel = excluded.PatchKernel,
+            CheckedAt = excluded.CheckedAt,
+            UpdatedAt = excluded.UpdatedAt
+        """
+        now = time.time()
+        params = (kernel.model, kernel.pda, kernel.upload_id, kernel.patch_kernel, now, now)
+        await self._make_request(self.db_path, sql, params)
+
+    async def mark_checked(self, model: str) -> None:
+        sql = "UPDATE kernels SET CheckedAt = ? WHERE Model = ?"
+        await self._make_request(self.db_path, sql, (time.time(), model))
@@ -0,0 +1,126 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
+
+import time
+from pathlib import Path
+
+from sambot import app_dir
+from sambot.config import config
+from sambot.database.base import SqliteConnection
+
+PENDING = "pending"
+CLAIMED = "claimed"
+DONE = "done"
+FAILED = "failed"
+
+
+class SyncQueue(SqliteConnection):
+    def __init__(self, db_path: Path | None = None) -> None:
+        self.db_path = db_path or config.sync_queue_path or app_dir / "sambot/database/queue.db"
+        # Every worker writes to this file, so wait for the lock instead of
+        # failing a claim or heartbeat that would then look like no work.
+        self.busy_timeout = config.sync_queue_busy_timeout
+
+    async def create_tables(self) -> None:
+        sql = """
+        CREATE TABLE IF NOT EXISTS sync_jobs (
+            JobID INTEGER PRIMARY KEY AUTOINCREMENT,
+            RunID TEXT,
+            Model TEXT,
+            Region TEXT,
+            State TEXT DEFAULT 'pending',
+            Owner TEXT,
+            LeaseUntil REAL,
+            Attempts INTEGER DEFAULT 0,
+            UpdatedAt REAL,
+            UNIQUE (RunID, Model, Region)
+        );
+        CREATE INDEX IF NOT EXISTS idx_sync_jobs_state ON sync_jobs (State, LeaseUntil);
+        CREATE INDEX IF NOT EXISTS idx_sync_jobs_run ON sync_jobs (RunID, State)
+        """
+
+        for statement in sql.strip().split(";"):
+            if statement.strip():
+                await self._make_request(self.db_path, statement)
+
+    async def enqueue(self, run_id: str, jobs: list[tuple[str, str]]) -> None:
+        if not jobs:
+            return
+
+        now = time.time()
+        sql = """
+        INSERT OR IGNORE INTO sync_jobs (RunID, Model, Region, State, UpdatedAt)
+        VALUES (?, ?, ?, 'pending', ?)
+        """
+        params = [(run_id, model, region, now) for model, region in jobs]
+        await self._make_request(self.db_path, sql, params)
+
+    async def claim(
+        self, owner: str, limit: int, lease_seconds: float, max_attempts: int = 3
+    ) -> list | str | None:
+        now = time.time()
+        # A single UPDATE holds SQLite's write lock, so two workers can never
+        # claim the same job; expired leases are taken over as if pending.
+        sql = """
+        UPDATE sync_jobs
+        SET State = 'claimed', Owner = ?, LeaseUntil = ?, Attempts = Attempts + 1,
+            UpdatedAt = ?
+        WHERE JobID IN (
+            SELECT JobID FROM sync_jobs
+            WHERE (State = 'pending' OR (State = 'claimed' AND LeaseUntil < ?))
+            AND Attempts < ?
+            ORDER BY RunID, Model, Region
+            LIMIT ?
+        )
+        RETURNING JobID, RunID, Model, Region, Attempts
+        """
+        params = (owner, now + lease_seconds, now, now, max_attempts, limit)
+        return await self._make_request(self.db_path, sql, params, fetch=True, mult=True)
+
+    async def heartbeat(self, owner: str, job_ids: list[int], lease_seconds: float) -> None:
+        if not job_ids:
+            return
+
+        now = time.time()
+        sql = """
+        UPDATE sync_jobs SET LeaseUntil = ?, UpdatedAt = ?
+        WHERE JobID = ? AND Owner = ? AND State = 'claimed'
+        """
+        params = [(now + lease_seconds, now, job_id, owner) for job_id in job_ids]
+        await self._make_request(self.db_path, sql, params)
+
+    async def complete(self, owner: str, job_id: int) -> None:
+        sql = """
+        UPDATE sync_jobs SET State = 'done', LeaseUntil = NULL, UpdatedAt = ?
+        WHERE JobID = ? AND Owner = ?
+        """
+        await self._make_request(self.db_path, sql, (time.time(), job_id, owner))
+
+    async def release(self, owner: str, job_id: int, max_attempts: int = 3) -> None:
+        sql = """
+        UPDATE sync_jobs
+        SET State = CASE WHEN Attempts >= ? THEN 'failed' ELSE 'pending' END,
+            Owner = NULL, LeaseUntil = NULL, UpdatedAt = ?
+        WHERE JobID = ? AND Owner = ?
+        """
+        await self._make_request(self.db_path, sql, (max_attempts, time.time(), job_id, owner))
+
+    async def expire(self, max_attempts: int = 3) -> None:
+        sql = """
+        UPDATE sync_jobs SET State = 'failed', UpdatedAt = ?
+        WHERE State = 'claimed' AND LeaseUntil < ? AND Attempts >= ?
+        """
+        now = time.time()
+        await self._make_request(self.db_path, sql, (now, now, max_attempts))
+
+    async def get_counts(self, run_id: str) -> dict[str, int]:
+        sql = "SELECT State, COUNT(*) FROM sync_jobs WHERE RunID = ? GROUP BY State"
+        result = await self._make_request(self.db_path, sql, (run_id,), fetch=True, mult=True)
+        return {row[0]: row[1] for row in result} if result else {}
+
+    async def get_jobs(self, run_id: str, state: str = DONE) -> list | str | None:
+        sql = "SELECT Model, Region FROM sync_jobs WHERE RunID = ? AND State = ?"
+        return await self._make_request(self.db_path, sql, (run_id, state), fetch=True, mult=True)
+
+    async def purge(self, run_id: str) -> None:
+        await self._make_request(self.db_path, "DELETE FROM sync_jobs WHERE RunID = ?", (run_id,))
@@ -0,0 +1,42 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
+
+import time
+from pathlib import Path
+
+from sambot import app_dir
+from sambot.database.base import SqliteConnection
+
+
+class RegionsCache(SqliteConnection):
+    db_path: Path = app_dir / "sambot/database/regions.db"
+
+    def __init__(self, db_path: Path | None = None) -> None:
+        if db_path is not None:
+            self.db_path = db_path
+
+    async def create_tables(self) -> None:
+        sql = """
+        CREATE TABLE IF NOT EXISTS regions_cache (
+            Model TEXT PRIMARY KEY,
+            Regions TEXT,
+            FetchedAt REAL
+        )
+        """
+        await self._make_request(self.db_path, sql)
+
+    async def get(self, model: str) -> tuple[set[str], float] | None:
+        sql = "SELECT Regions, FetchedAt FROM regions_cache WHERE Model = ?"
+        result = await self._make_request(self.db_path, sql, (model,), fetch=True)
+        if not result:
+            return None
+        return set(filter(None, result[0].split(","))), result[1]
+
+    async def put(self, model: str, regions: set[str]) -> None:
+        sql = "INSERT OR REPLACE INTO regions_cache (Model, Regions, FetchedAt) VALUES (?, ?, ?)"
+        params = (model, ",".join(sorted(regions)), time.time())
+        await self._make_request(self.db_path, sql, params)
+
+    async def purge(self, older_than: float) -> None:
+        sql = "DELETE FROM regions_cache WHERE FetchedAt < ?"
+        await self._make_request(self.db_path, sql, (older_than,))
@@ -0,0 +1,69 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
+
+import argparse
+import os
+import time
+
+import picologging as logging
+import structlog
+
+from sambot.config import config
+from sambot.utils.logging import configure_logging, stop_logging
+
+MODES = {
+    "console": ("console", False),
+    "console+queue": ("console", True),
+    "json": ("json", False),
+    "json+queue": ("json", True),
+}
+
+
+def measure(mode: str, events: int, sample_rate: float) -> tuple[float, float]:
+    log_format, use_queue = MODES[mode]
+    config.log_sample_rate = sample_rate
+    with open(os.devnull, "w", encoding="utf-8") as sink:  # noqa: PTH123
+        configure_logging(log_format, use_queue, sink)
+        logger = structlog.wrap_logger(logging.getLogger(f"bench-{mode}"))
+
+        start = time.perf_counter()
+        for i in range(events):
+            logger.info(
+                "[FirmwaresSync] - Found firmware for model %s in region %s: PDA %s",
+                "SM-S921B",
+                "EUX",
+                f"S921BXXU{i}AXA1",
+                sampled=True,
+            )
+        emitted = time.perf_counter() - start
+        # Include the time the listener needs to drain the queue.
+        stop_logging()
+        total = time.perf_counter() - start
+    return emitted / events * 1e6, total / events * 1e6
+
+
+def run_benchmark(args: argparse.Namespace) -> None:
+    print(f"Events:          {args.events} per mode, sample rate {args.sample_rate}")
+    print("Mode".ljust(17) + "caller us/event".rjust(16) + "total us/event".rjust(16))
+    for mode in args.modes:
+        caller, total = measure(mode, args.events, args.sample_rate)
+        print(f"{mode:<17}{caller:>16.2f}{total:>16.2f}")
+    configure_logging()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m sambot.devtools.logging_bench",
+        description=(
+            "Measure the per-event cost of each log format, with and without the "
+            "queue-backed handler, writing to /dev/null."
+        ),
+    )
+    parser.add_argument("--events", type=int, default=50_000)
+    parser.add_argument("--modes", nargs="+", choices=tuple(MODES), default=list(MODES))
+    parser.add_argument("--sample-rate", type=float, default=1.0, help="LOG_SAMPLE_RATE to use")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    run_benchmark(parse_args())
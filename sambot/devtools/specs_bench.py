@@ -0,0 +1,124 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
+
+import argparse
+import asyncio
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import uvloop
+
+from sambot.config import config
+from sambot.database import Devices, run_vacuum
+
+Specs = dict[str, dict[str, str]]
+
+CATEGORIES = (
+    "Network",
+    "Launch",
+    "Body",
+    "Display",
+    "Platform",
+    "Memory",
+    "Main Camera",
+    "Selfie camera",
+    "Sound",
+    "Comms",
+    "Features",
+    "Battery",
+    "Misc",
+)
+
+
+def synthetic_specs(devices: int, seed: int) -> dict[int, Specs]:
+    rng = random.Random(seed)
+    words = ("Super", "AMOLED", "Octa-core", "mAh", "GHz", "Li-Ion", "nits", "HDR10+", "5G", "USB")
+    result = {}
+    for device_id in range(1, devices + 1):
+        result[device_id] = {
+            category: {
+                f"Field {index}": " ".join(rng.choices(words, k=rng.randint(2, 12)))
+                for index in range(rng.randint(3, 10))
+            }
+            for category in CATEGORIES
+        }
+        result[device_id]["Misc"]["Models"] = f"SM-A{device_id:03d}F, SM-A{device_id:03d}B"
+    return result
+
+
+async def load_specs(source: Path) -> dict[int, Specs]:
+    devices = Devices(source)
+    result = {
+        device_id: await devices.get_specs(device_id) for device_id in await devices.get_listings()
+    }
+    return {device_id: specs for device_id, specs in result.items() if specs}
+
+
+async def bench_storage(storage: str, specs: dict[int, Specs], workdir: Path) -> tuple[float, ...]:
+    config.specs_storage = storage  # type: ignore[assignment]
+    path = workdir / f"{storage}.db"
+    devices = Devices(path)
+    await devices.create_tables()
+
+    writes = []
+    for device_id, details in specs.items():
+        start = time.perf_counter()
+        await devices.save_specs(device_id, details)
+        writes.append(time.perf_counter() - start)
+
+    reads = []
+    for device_id, details in specs.items():
+        start = time.perf_counter()
+        loaded = await devices.get_specs(device_id)
+        reads.append(time.perf_counter() - start)
+        if loaded != details:
+            msg = f"{storage}: specs of device {device_id} did not round-trip"
+            raise RuntimeError(msg)
+
+    await run_vacuum(path)
+    return (
+        path.stat().st_size / 1024,
+        statistics.fmean(writes) * 1000,
+        statistics.quantiles(writes, n=20)[-1] * 1000,
+        statistics.fmean(reads) * 1000,
+        statistics.quantiles(reads, n=20)[-1] * 1000,
+    )
+
+
+async def run_benchmark(args: argparse.Namespace) -> None:
+    specs = await load_specs(args.source) if args.source else synthetic_specs(args.devices, 0)
+    if len(specs) < 2:
+        msg = "Need at least two devices with specs to benchmark."
+        raise SystemExit(msg)
+
+    workdir = Path(tempfile.mkdtemp(prefix="sambot-specs-"))
+    print(
+        f"Devices: {len(specs)}, specs: {sum(len(v) for d in specs.values() for v in d.values())}"
+    )
+    print("storage   size KiB  write ms     p95   read ms     p95")
+    for storage in ("rows", "blob"):
+        size, write_mean, write_p95, read_mean, read_p95 = await bench_storage(
+            storage, specs, workdir
+        )
+        print(
+            f"{storage:<8}{size:>10.1f}{write_mean:>10.2f}{write_p95:>8.2f}"
+            f"{read_mean:>10.2f}{read_p95:>8.2f}"
+        )
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m sambot.devtools.specs_bench",
+        description="Compare database size and latency of per-row and compressed blob specs.",
+    )
+    parser.add_argument("--source", type=Path, default=None, help="devices.db to take specs from")
+    parser.add_argument("--devices", type=int, default=300, help="synthetic devices to generate")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+        runner.run(run_benchmark(parse_args()))
@@ -0,0 +1,112 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from operator import itemgetter
+
+from sambot import app_dir
+
+
+@dataclass(slots=True)
+class ImportRun:
+    wall: float
+    # Self and cumulative import time in microseconds, keyed by module name.
+    modules: dict[str, tuple[int, int]] = field(default_factory=dict)
+    top_level: list[str] = field(default_factory=list)
+
+    @property
+    def total_us(self) -> int:
+        return sum(self.modules[name][1] for name in self.top_level)
+
+    def by_package(self) -> dict[str, int]:
+        packages: dict[str, int] = defaultdict(int)
+        for name, (self_us, _) in self.modules.items():
+            packages[name.split(".")[0]] += self_us
+        return packages
+
+
+def parse_importtime(wall: float, stderr: str) -> ImportRun:
+    run = ImportRun(wall)
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative, name = line.removeprefix("import time:").split("|")
+        # Nested imports are indented by two extra spaces per level.
+        module = name.strip()
+        run.modules[module] = (int(self_us), int(cumulative))
+        if not name[1:].startswith(" "):
+            run.top_level.append(module)
+    return run
+
+
+def run_once(target: str) -> ImportRun:
+    start = time.perf_counter()
+    result = subprocess.run(
+        (sys.executable, "-X", "importtime", "-c", f"import {target}"),
+        cwd=app_dir,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        msg = f"Importing {target} failed:\n{result.stderr.strip().splitlines()[-1]}"
+        raise RuntimeError(msg)
+    return parse_importtime(wall, result.stderr)
+
+
+def run_benchmark(args: argparse.Namespace) -> int:
+    runs = [run_once(args.target) for _ in range(args.runs)]
+    walls = [run.wall * 1000 for run in runs]
+    median = statistics.median(walls)
+    last = runs[-1]
+
+    print(f"Target:          {args.target}")
+    print(f"Runs:            {args.runs}")
+    print(f"Wall time:       median {median:.0f}ms ({min(walls):.0f}-{max(walls):.0f}ms)")
+    print(f"Import time:     {last.total_us / 1000:.0f}ms in {len(last.modules)} modules")
+    print("Slowest packages (self time, last run):")
+    slowest = sorted(last.by_package().items(), key=itemgetter(1), reverse=True)
+    for name, us in slowest[: args.top]:
+        print(f"  {us / 1000:8.1f}ms  {name}")
+
+    failed = False
+    loaded = {name.split(".")[0] for name in last.modules}
+    if forbidden := sorted(loaded.intersection(args.forbid)):
+        print(f"FAIL: imported at startup: {", ".join(forbidden)}")
+        failed = True
+    if args.budget is not None and median > args.budget:
+        print(f"FAIL: median {median:.0f}ms is over the {args.budget:.0f}ms budget")
+        failed = True
+    return 1 if failed else 0
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m sambot.devtools.startup_bench",
+        description=(
+            "Time how long a fresh interpreter takes to import the bot, using "
+            "-X importtime for the per-module breakdown."
+        ),
+    )
+    parser.add_argument("--target", default="sambot.__main__", help="module to import")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="slowest imports to list")
+    parser.add_argument("--budget", type=float, default=None, help="fail over this median (ms)")
+    parser.add_argument(
+        "--forbid",
+        nargs="*",
+        default=["bs4", "lxml"],
+        help="top-level packages that must not be imported at startup",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(run_benchmark(parse_args()))
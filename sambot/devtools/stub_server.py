@@ -0,0 +1,108 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
+
+import argparse
+import asyncio
+import random
+from dataclasses import dataclass
+from pathlib import Path
+
+from aiohttp import web
+
+from sambot.utils.aiohttp.replay import load_cassette
+from sambot.utils.logging import log
+
+
+@dataclass(slots=True)
+class StubStats:
+    requests: int = 0
+    hits: int = 0
+    misses: int = 0
+    errors: int = 0
+
+
+class StubServer:
+    def __init__(
+        self,
+        cassette_dir: Path,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        seed: int | None = None,
+    ) -> None:
+        self.cassette_dir = cassette_dir
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.stats = StubStats()
+        self.url = ""
+
+        self.app = web.Application()
+        self.app.router.add_route("*", "/{upstream:.*}", self.handle)
+        self.runner = web.AppRunner(self.app, access_log=None)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.stats.requests += 1
+
+        delay = self.latency + self.random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+
+        if self.random.random() < self.error_rate:
+            self.stats.errors += 1
+            return web.Response(status=503, text="Injected error")
+
+        cassette = await load_cassette(self.cassette_dir, request.raw_path.removeprefix("/"))
+        if cassette is None:
+            self.stats.misses += 1
+            log.warn("[StubServer] - No cassette for request!", path=request.raw_path)
+            return web.Response(status=404, text="No cassette recorded")
+
+        self.stats.hits += 1
+        meta, body = cassette
+        headers = {"Content-Type": meta["content_type"]} if meta.get("content_type") else None
+        return web.Response(status=meta["status"], body=body, headers=headers)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        bound_host, bound_port = self.runner.addresses[0][:2]
+        self.url = f"http://{bound_host}:{bound_port}"
+        return self.url
+
+    async def stop(self) -> None:
+        await self.runner.cleanup()
+
+
+async def serve(args: argparse.Namespace) -> None:
+    server = StubServer(args.cassettes, args.latency, args.jitter, args.error_rate, args.seed)
+    url = await server.start(args.host, args.port)
+    log.info("[StubServer] - Serving cassettes.", url=url, cassettes=str(args.cassettes))
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m sambot.devtools.stub_server",
+        description="Serve recorded upstream responses as a local cors-style proxy.",
+    )
+    parser.add_argument("--cassettes", type=Path, default=Path("data/cassettes"))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.0, help="base latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of 503s")
+    parser.add_argument("--seed", type=int, default=None)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(serve(parse_args()))
+    except KeyboardInterrupt:
+        log.info("[StubServer] - Stopped.")
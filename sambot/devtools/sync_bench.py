@@ -0,0 +1,142 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
+
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import uvloop
+
+from sambot.config import config
+from sambot.database import Devices, Firmwares, Kernels, RegionsCache, create_tables
+from sambot.devtools.stub_server import StubServer
+from sambot.utils.devices import sync_devices
+from sambot.utils.memory import peak_rss_mb
+from sambot.utils.metrics import metrics
+from sambot.utils.notify import sync_firmwares, sync_kernels
+
+JOBS = {"devices": sync_devices, "firmwares": sync_firmwares, "kernels": sync_kernels}
+
+
+class LoopLagMonitor:
+    def __init__(self, interval: float = 0.05) -> None:
+        self.interval = interval
+        self.samples: list[float] = []
+        self._task: asyncio.Task | None = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - start - self.interval))
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+
+    @property
+    def max_lag(self) -> float:
+        return max(self.samples, default=0.0)
+
+    @property
+    def mean_lag(self) -> float:
+        return statistics.fmean(self.samples) if self.samples else 0.0
+
+
+def isolate_databases(workdir: Path) -> None:
+    Devices.db_path = workdir / "devices.db"
+    Firmwares.db_path = workdir / "firmwares.db"
+    Kernels.db_path = workdir / "kernels.db"
+    RegionsCache.db_path = workdir / "regions.db"
+    config.sync_queue_path = workdir / "queue.db"
+
+
+async def run_benchmark(args: argparse.Namespace) -> None:
+    workdir = Path(tempfile.mkdtemp(prefix="sambot-bench-"))
+    isolate_databases(workdir)
+
+    config.logs_channel = None
+    config.metrics_file = None
+    config.sync_workers = False
+    config.fw_fetch_interval = args.fetch_interval
+    config.kernel_fetch_interval = args.fetch_interval
+    # Notifications only fire for models with a known PDA, which the fresh
+    # benchmark databases never have, so no message is ever sent.
+    config.fw_channel = config.fw_channel or -1
+
+    server = None
+    if args.record:
+        config.http_mode = "record"
+        config.cassette_dir = args.cassettes
+    else:
+        server = StubServer(args.cassettes, args.latency, args.jitter, args.error_rate, args.seed)
+        config.http_mode = "replay"
+        config.replay_url = await server.start()
+
+    await create_tables()
+    metrics.reset()
+
+    monitor = LoopLagMonitor()
+    monitor.start()
+    timings = {}
+    total_start = time.perf_counter()
+    try:
+        for job in args.jobs:
+            start = time.perf_counter()
+            await JOBS[job]()
+            timings[job] = time.perf_counter() - start
+    finally:
+        total = time.perf_counter() - total_start
+        monitor.stop()
+        if server:
+            await server.stop()
+
+    requests = server.stats.requests if server else metrics.get_counter("http_requests_total")
+    print(f"Mode:            {config.http_mode}")
+    print(f"Databases:       {workdir}")
+    for job, elapsed in timings.items():
+        print(f"sync_{job + ":":<11}{elapsed:.2f}s")
+    print(f"Total time:      {total:.2f}s")
+    print(f"Requests:        {requests:.0f} ({requests / total if total else 0:.1f} req/s)")
+    if server:
+        stats = server.stats
+        print(f"Cassettes:       {stats.hits} hits, {stats.misses} misses, {stats.errors} errors")
+    print(f"Peak RSS:        {peak_rss_mb():.1f} MiB")
+    max_lag, mean_lag = monitor.max_lag * 1000, monitor.mean_lag * 1000
+    print(f"Event-loop lag:  max {max_lag:.1f}ms, mean {mean_lag:.2f}ms")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m sambot.devtools.sync_bench",
+        description=(
+            "Run sync_devices and sync_firmwares end to end against recorded upstream "
+            "responses. Use --record once against the live sites to capture them."
+        ),
+    )
+    parser.add_argument("--cassettes", type=Path, default=Path("data/cassettes"))
+    parser.add_argument("--record", action="store_true", help="hit live upstreams and record")
+    parser.add_argument("--jobs", nargs="+", choices=tuple(JOBS), default=["devices", "firmwares"])
+    parser.add_argument("--latency", type=float, default=0.05, help="stub latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.05, help="extra random stub latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of stub 503s")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument(
+        "--fetch-interval",
+        type=float,
+        default=0.0,
+        help="pause before each firmware and kernel request (the bot uses 3s)",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+        runner.run(run_benchmark(parse_args()))
@@ -0,0 +1,89 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
+
+import argparse
+import asyncio
+import statistics
+import time
+from collections import Counter
+
+import aiohttp
+import orjson
+
+from sambot.utils.webhook import SECRET_HEADER
+
+# Not a sudoer, so the doas handlers filter these updates out without calling
+# the Telegram API.
+STUB_USER = {"id": 1000, "is_bot": False, "first_name": "Stub"}
+
+
+def make_update(update_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": STUB_USER["id"], "type": "private", "first_name": "Stub"},
+            "from": STUB_USER,
+            "text": text,
+        },
+    }
+
+
+async def post_updates(args: argparse.Namespace) -> None:
+    headers = {"Content-Type": "application/json"}
+    if args.secret:
+        headers[SECRET_HEADER] = args.secret
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    statuses: Counter[str] = Counter()
+    latencies: list[float] = []
+
+    async def post(session: aiohttp.ClientSession, update_id: int) -> None:
+        body = orjson.dumps(make_update(update_id, args.text))
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                async with session.post(args.url, data=body, headers=headers) as response:
+                    statuses[str(response.status)] += 1
+            except aiohttp.ClientError as error:
+                statuses[type(error).__name__] += 1
+            latencies.append(time.perf_counter() - start)
+
+    total_start = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(post(session, args.first_id + i) for i in range(args.updates)))
+    total = time.perf_counter() - total_start
+
+    latencies.sort()
+    print(f"Webhook:         {args.url}")
+    print(f"Updates:         {args.updates} in {total:.2f}s ({args.updates / total:.1f}/s)")
+    responses = ", ".join(f"{status}: {count}" for status, count in sorted(statuses.items()))
+    print(f"Responses:       {responses}")
+    if latencies:
+        p95 = latencies[int(len(latencies) * 0.95) - 1]
+        print(
+            f"Latency:         median {statistics.median(latencies) * 1000:.1f}ms, "
+            f"p95 {p95 * 1000:.1f}ms, max {latencies[-1] * 1000:.1f}ms"
+        )
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m sambot.devtools.webhook_stub",
+        description=(
+            "Post fake Telegram updates to a local webhook, the way the Bot API "
+            "delivers them. Start the bot with WEBHOOK_URL set first."
+        ),
+    )
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret", default=None, help="value of WEBHOOK_SECRET, if set")
+    parser.add_argument("--updates", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=40, help="like max_connections")
+    parser.add_argument("--text", default="/start")
+    parser.add_argument("--first-id", type=int, default=1)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(post_updates(parse_args()))
@@ -1,44 +1,85 @@
 # SPDX-License-Identifier: BSD-3-Clause
 # Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
 
+import asyncio
 import datetime
 import html
 import io
+import itertools
 import os
 import sys
+import time
 import traceback
 from collections.abc import Callable
+from contextlib import suppress
+from functools import partial
 from signal import SIGINT
 
 import humanize
 from aiogram import F, Router
+from aiogram.exceptions import TelegramBadRequest, TelegramNetworkError
 from aiogram.filters import Command, CommandObject
-from aiogram.types import BufferedInputFile, CallbackQuery, InaccessibleMessage, Message
+from aiogram.types import (
+    BufferedInputFile,
+    CallbackQuery,
+    FSInputFile,
+    InaccessibleMessage,
+    Message,
+)
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from meval import meval
 
+from sambot.config import config
 from sambot.filters.users import IsSudo
-from sambot.utils.callback_data import StartCallback
+from sambot.utils.callback_data import ShellCallback, StartCallback
 from sambot.utils.devices import sync_devices
-from sambot.utils.notify import sync_firmwares
-from sambot.utils.systools import ShellExceptionError, parse_commits, shell_run
+from sambot.utils.downloads import download_cache
+from sambot.utils.lifecycle import lifecycle
+from sambot.utils.metrics import Histogram, metrics
+from sambot.utils.notify import sync_firmwares, sync_kernels
+from sambot.utils.systools import (
+    ShellExceptionError,
+    ShellOutput,
+    ShellResult,
+    parse_commits,
+    shell_run,
+    stream_shell,
+)
 
 router = Router(name="doas")
 
+# Cancel events of the /shell commands still running, by job id.
+shell_jobs: dict[int, asyncio.Event] = {}
+shell_job_ids = itertools.count(1)
+
 # Only sudo users can use these commands
 router.message.filter(IsSudo())
 router.callback_query.filter(IsSudo())
 
 
+async def drain(sent: Message) -> None:
+    for cancel in shell_jobs.values():
+        cancel.set()
+
+    if lifecycle.running:
+        jobs = ", ".join(lifecycle.running)
+        await sent.edit_text(
+            f"Waiting up to <code>{config.shutdown_grace:.0f}s</code> for {jobs} to finish..."
+        )
+    await lifecycle.shutdown()
+
+
 @router.message(Command(commands=["reboot", "restart"]))
 async def reboot(message: Message):
-    await message.reply("Rebooting...")
-    os.execv(sys.executable, [sys.executable, "-m", "sambot"])
+    sent = await message.reply("Rebooting...")
+    await drain(sent)
+    await lifecycle.restart()
 
 
 @router.message(Command("shutdown"))
 async def shutdown_message(message: Message):
-    await message.reply("Turning off...")
+    sent = await message.reply("Turning off...")
+    await drain(sent)
     os.kill(os.getpid(), SIGINT)
 
 
@@ -98,32 +139,84 @@ async def upgrade_callback(callback: CallbackQuery):
     document = BufferedInputFile(document.getvalue(), filename=document.name)
     await sent.reply_document(document=document)
 
-    await sent.reply("Restarting...")
-    os.execv(sys.executable, [sys.executable, "-m", "sambot"])
+    sent = await sent.reply("Restarting...")
+    await drain(sent)
+    await lifecycle.restart()
+
+
+def render_shell(code: str, output: ShellOutput, status: str = "Running...") -> str:
+    text = f"<b>Input\n&gt;</b> <code>{html.escape(code)}</code>\n\n"
+    footer = f"\n\n<i>{status}</i>"
+    # Escaping can grow the text, so leave some room under the message limit.
+    room = (4096 - len(text) - len(footer)) // 2
+    if output.size and room > 0:
+        tail = output.tail(room)
+        if output.size > len(tail):
+            tail = f"[...]\n{tail}"
+        text += f"<b>Output\n&gt;</b> <code>{html.escape(tail)}</code>"
+    return text + footer
+
+
+def shell_status(result: ShellResult) -> str:
+    if result.cancelled:
+        return "Cancelled."
+    if result.timed_out:
+        return f"Timed out after {config.shell_timeout:.0f}s."
+    return f"Exited with code {result.returncode}."
 
 
 @router.message(Command(commands=["shell", "sh"]))
 async def bot_shell(message: Message, command: CommandObject):
     code = str(command.args)
-    sent = await message.reply("Running...")
+    job = next(shell_job_ids)
+    keyboard = InlineKeyboardBuilder()
+    keyboard.button(text="⏹ Cancel", callback_data=ShellCallback(job=job))
+    markup = keyboard.as_markup()
+    sent = await message.reply("Running...", reply_markup=markup)
+
+    async def show(output: ShellOutput) -> None:
+        with suppress(TelegramBadRequest):
+            await sent.edit_text(render_shell(code, output), reply_markup=markup)
 
+    cancel = shell_jobs[job] = asyncio.Event()
     try:
-        stdout = await shell_run(command=code)
-    except ShellExceptionError as error:
-        await sent.edit_text(f"<code>{html.escape(str(error))}</code>")
-        return
+        result = await stream_shell(
+            code,
+            show,
+            deadline=config.shell_timeout,
+            cancel=cancel,
+            interval=config.shell_edit_interval,
+            spill_size=config.shell_spill_size,
+        )
+    finally:
+        shell_jobs.pop(job, None)
 
-    output = f"<b>Input\n&gt;</b> <code>{code}</code>\n\n"
-    if stdout:
-        if len(stdout) > (4096 - len(output)):
-            document = io.BytesIO(stdout.encode())
-            document.name = "output.txt"
-            document = BufferedInputFile(document.getvalue(), filename=document.name)
-            await message.reply_document(document=document)
-        else:
-            output += f"<b>Output\n&gt;</b> <code>{html.escape(stdout)}</code>"
+    output = result.output
+    try:
+        if output.spilled:
+            await message.reply_document(
+                document=FSInputFile(output.path, filename="output.txt")  # type: ignore[arg-type]
+            )
+        elif output.size > 4096 - 200:
+            await message.reply_document(
+                document=BufferedInputFile(output.getvalue(), filename="output.txt")
+            )
+    finally:
+        output.cleanup()
+
+    with suppress(TelegramBadRequest):
+        await sent.edit_text(render_shell(code, output, shell_status(result)))
+
+
+@router.callback_query(ShellCallback.filter())
+async def shell_cancel(callback: CallbackQuery, callback_data: ShellCallback):
+    cancel = shell_jobs.get(callback_data.job)
+    if cancel is None:
+        await callback.answer("This command has already finished.")
+        return
 
-    await sent.edit_text(output)
+    cancel.set()
+    await callback.answer("Cancelling...")
 
 
 @router.message(Command(commands=["eval", "ev"]))
@@ -133,6 +226,8 @@ async def evaluate(message: Message, command: CommandObject):
 
     try:
         stdout = await meval(query, globals(), **locals())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        raise
     except BaseException:
         exc = sys.exc_info()
         exc = "".join(
@@ -175,12 +270,24 @@ async def ping(message: Message):
 
 
 async def measure_and_edit(message: Message, task_name: str, task_func: Callable) -> None:
+    if lifecycle.stopping:
+        await message.reply("The bot is shutting down, try again after it restarts.")
+        return
+
     start_time = datetime.datetime.now(tz=datetime.UTC)
     sent = await message.reply(f"Syncing {task_name}...")
     await task_func()
     delta = (datetime.datetime.now(tz=datetime.UTC) - start_time).total_seconds()
     human_readable_delta = humanize.precisedelta(datetime.timedelta(seconds=delta))
-    await sent.edit_text(f"Synced {task_name} in <code>{human_readable_delta}</code>.")
+    text = f"Synced {task_name} in <code>{human_readable_delta}</code>."
+    if lifecycle.stopping:
+        text = (
+            f"Sync of {task_name} interrupted after <code>{human_readable_delta}</code>, "
+            "it will resume from the checkpoint after the restart."
+        )
+    # The bot session may already be closing when a shutdown drained the sync.
+    with suppress(TelegramBadRequest, TelegramNetworkError):
+        await sent.edit_text(text)
 
 
 @router.message(Command("syncfirmware"))
@@ -188,6 +295,74 @@ async def sync_f(message: Message):
     await measure_and_edit(message, "firmwares", sync_firmwares)
 
 
+@router.message(Command("synckernels"))
+async def sync_k(message: Message):
+    await measure_and_edit(message, "kernels", sync_kernels)
+
+
 @router.message(Command("syncdevices"))
-async def sync_d(message: Message):
+async def sync_d(message: Message, command: CommandObject):
+    if command.args == "full":
+        await measure_and_edit(message, "all devices", partial(sync_devices, full=True))
+        return
+
     await measure_and_edit(message, "devices", sync_devices)
+
+
+def format_duration(seconds: float) -> str:
+    return f"{seconds * 1000:.0f}ms" if seconds < 10 else f"{seconds:.0f}s"
+
+
+def format_p95(histogram: Histogram) -> str:
+    p95 = histogram.quantile(0.95)
+    if p95 == float("inf"):
+        return f"p95 &gt; <code>{format_duration(histogram.buckets[-1])}</code>"
+    return f"p95 ≤ <code>{format_duration(p95)}</code>"
+
+
+def format_histograms(name: str, label: str) -> str:
+    text = ""
+    for labels, histogram in sorted(metrics.histograms.get(name, {}).items()):
+        key = dict(labels).get(label, "total")
+        text += (
+            f"  - <code>{html.escape(key)}</code>: {histogram.count}x, "
+            f"avg <code>{format_duration(histogram.average)}</code>, {format_p95(histogram)}"
+        )
+        if name == "http_request_duration_seconds":
+            retries = metrics.get_counter("http_retries_total", host=key)
+            failures = metrics.get_counter("http_failures_total", host=key)
+            text += f", {retries:.0f} retries, {failures:.0f} failures"
+        text += "\n"
+    return text or "  - <i>No data yet.</i>\n"
+
+
+@router.message(Command("stats"))
+async def stats(message: Message):
+    uptime = humanize.precisedelta(datetime.timedelta(seconds=time.time() - metrics.started_at))
+    queue_depth = metrics.gauges.get("firmware_queue_depth", {}).get((), 0)
+    cache = await asyncio.to_thread(download_cache.stats)
+    cache_size = humanize.naturalsize(cache.size, binary=True)
+    cache_limit = humanize.naturalsize(cache.max_size, binary=True)
+    text = (
+        "<b>Sync statistics</b>\n\n"
+        f"<b>Uptime:</b> <code>{uptime}</code>\n"
+        f"<b>Firmware queue depth:</b> <code>{queue_depth:.0f}</code>\n"
+        f"<b>Notifications sent:</b> "
+        f"<code>{metrics.get_counter("notifications_sent_total"):.0f}</code>\n"
+        f"<b>DB queries:</b> <code>{metrics.get_counter("db_queries_total"):.0f}</code> "
+        f"(<code>{metrics.get_counter("db_errors_total"):.0f}</code> errors)\n"
+        f"<b>Download cache:</b> <code>{cache.files}</code> files, "
+        f"<code>{cache_size}</code> of <code>{cache_limit}</code> "
+        f"(<code>{cache.hits:.0f}</code> hits, <code>{cache.misses:.0f}</code> misses)\n\n"
+        f"<b>Sync runs:</b>\n{format_histograms("sync_duration_seconds", "job")}\n"
+        f"<b>Requests:</b>\n{format_histograms("http_request_duration_seconds", "host")}\n"
+        f"<b>Parsing:</b>\n{format_histograms("parse_duration_seconds", "page")}\n"
+        f"<b>Database:</b>\n{format_histograms("db_duration_seconds", "op")}"
+    )
+
+    if len(text) > 4096:
+        document = BufferedInputFile(metrics.render_prometheus().encode(), filename="metrics.prom")
+        await message.reply_document(document=document)
+        return
+
+    await message.reply(text)
@@ -0,0 +1,173 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
+
+import html
+
+from aiogram import Router
+from aiogram.filters import Command, CommandObject
+from aiogram.types import (
+    InlineQuery,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+    Message,
+)
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from sambot.config import config
+from sambot.utils.lookup import DeviceEntry, device_index, normalize
+
+router = Router(name="lookup")
+
+MESSAGE_LIMIT = 4096
+INLINE_CACHE_TIME = 300
+ELLIPSIS = "[...]"
+
+
+def join_lines(lines: list[str]) -> str:
+    # Lines are already escaped HTML, so cut between whole lines to never
+    # leave an unclosed tag or half an entity behind.
+    text = ""
+    for line in lines:
+        if len(text) + len(line) + len(ELLIPSIS) > MESSAGE_LIMIT:
+            return text + ELLIPSIS
+        text += line
+    return text
+
+
+def render_device(entry: DeviceEntry) -> str:
+    models = ", ".join(f"<code>{model}</code>" for model in entry.models) or "—"
+    text = f"<b>{html.escape(entry.name)}</b>\n\n<b>Models:</b> {models}\n"
+    if entry.description:
+        text += f"\n{html.escape(entry.description)}\n"
+    return text
+
+
+def render_matches(query: str, matches: list[DeviceEntry]) -> str:
+    text = f"<b>Devices matching</b> <code>{html.escape(query)}</code>:\n\n"
+    for entry in matches:
+        models = ", ".join(entry.models[:3])
+        text += f"  - <b>{html.escape(entry.name)}</b> (<code>{models}</code>)\n"
+    return text
+
+
+async def render_specs(entry: DeviceEntry) -> str:
+    specs = await device_index.devices_db.get_specs(entry.device_id)
+    if not specs:
+        return f"No specs saved for <b>{html.escape(entry.name)}</b> yet."
+
+    lines = [f"<b>{html.escape(entry.name)}</b>\n"]
+    for category, details in specs.items():
+        lines.append(f"\n<b>{html.escape(category)}</b>\n")
+        lines.extend(
+            f"  <b>{html.escape(name)}:</b> {html.escape(value)}\n"
+            for name, value in details.items()
+        )
+    return join_lines(lines)
+
+
+def render_firmwares(model: str) -> str:
+    firmwares = device_index.firmwares_for(model)
+    if not firmwares:
+        return f"No firmware known for <code>{html.escape(model)}</code>."
+
+    model = next(iter(firmwares.values())).model
+    entry = device_index.device_by_model(model)
+    name = entry.name if entry else model
+    lines = [f"<b>Latest firmware for {html.escape(name)}</b> (<code>{model}</code>)\n\n"]
+    for region, info in sorted(firmwares.items()):
+        build_date = info.build_date.strftime("%Y-%m-%d")
+        lines.append(
+            f"<b>{region}:</b> <code>{info.pda}</code> "
+            f"(Android {info.os_version}, {build_date})\n"
+        )
+    return join_lines(lines)
+
+
+def device_keyboard(entry: DeviceEntry) -> InlineKeyboardBuilder | None:
+    if not entry.url:
+        return None
+    keyboard = InlineKeyboardBuilder()
+    keyboard.button(text="GSMArena 🔗", url=f"https://www.gsmarena.com/{entry.url}")
+    return keyboard
+
+
+async def index_ready(message: Message, command: CommandObject, usage: str) -> bool:
+    if not command.args or not command.args.strip():
+        await message.reply(f"Usage: <code>/{command.command} &lt;{usage}&gt;</code>")
+        return False
+
+    if not device_index.ready:
+        await message.reply("The device index is still loading, try again in a moment.")
+        return False
+    return True
+
+
+async def find_devices(message: Message, command: CommandObject) -> list[DeviceEntry]:
+    if not await index_ready(message, command, "name or model"):
+        return []
+
+    query = str(command.args).strip()
+    matches = device_index.search(query, config.lookup_results)
+    if not matches:
+        await message.reply(f"No devices found for <code>{html.escape(query)}</code>.")
+    return matches
+
+
+@router.message(Command("device"))
+async def device_command(message: Message, command: CommandObject):
+    matches = await find_devices(message, command)
+    if not matches:
+        return
+
+    query = str(command.args).strip()
+    entry = device_index.device_by_model(query)
+    if entry is None:
+        if len(matches) > 1 and normalize(matches[0].name) != normalize(query):
+            await message.reply(render_matches(query, matches))
+            return
+        entry = matches[0]
+
+    keyboard = device_keyboard(entry)
+    await message.reply(
+        render_device(entry), reply_markup=keyboard.as_markup() if keyboard else None
+    )
+
+
+@router.message(Command("specs"))
+async def specs_command(message: Message, command: CommandObject):
+    matches = await find_devices(message, command)
+    if not matches:
+        return
+
+    entry = device_index.device_by_model(str(command.args).strip()) or matches[0]
+    text = await device_index.render("specs", str(entry.device_id), lambda: render_specs(entry))
+    await message.reply(text)
+
+
+@router.message(Command(commands=["fw", "firmware"]))
+async def firmware_command(message: Message, command: CommandObject):
+    if not await index_ready(message, command, "model"):
+        return
+
+    model = str(command.args).split()[0]
+    text = await device_index.render("firmware", normalize(model), lambda: render_firmwares(model))
+    await message.reply(text)
+
+
+@router.inline_query()
+async def inline_search(inline_query: InlineQuery):
+    matches = device_index.search(inline_query.query, config.lookup_results)
+    results = []
+    for entry in matches:
+        keyboard = device_keyboard(entry)
+        results.append(
+            InlineQueryResultArticle(
+                id=str(entry.device_id),
+                title=entry.name,
+                description=", ".join(entry.models) or None,
+                thumbnail_url=entry.img_url or None,
+                input_message_content=InputTextMessageContent(message_text=render_device(entry)),
+                reply_markup=keyboard.as_markup() if keyboard else None,
+            )
+        )
+    await inline_query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=False)
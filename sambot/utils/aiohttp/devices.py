@@ -5,50 +5,75 @@ import asyncio
 
 import aiohttp
 
-from sambot.config import Settings
+from sambot.config import config
+from sambot.utils.metrics import metrics
+from sambot.utils.tracing import tracer
 
 from .headers import GENERIC_HEADER
+from .replay import record, upstream_url
 
 HEADERS = {**GENERIC_HEADER, "referer": "https://www.gsmarena.com/"}
 
 
 class GSMClient:
     @staticmethod
+    @tracer.traced("http.fetch")
     async def get_devices_list(page: int):
-        config = Settings()  # type: ignore
         url = f"{config.cors_bypass}/https://www.gsmarena.com/samsung-phones-9.php"
         if page != 1:
             url = (
                 f"{config.cors_bypass}/https://www.gsmarena.com/samsung-phones-f-9-0-p{page!s}.php"
             )
 
-        async with aiohttp.ClientSession(
-            timeout=aiohttp.ClientTimeout(total=60), headers=HEADERS
-        ) as session:
-            r = await session.get(url)
-            return await r.content.read()
+        with metrics.timer("http_request_duration_seconds", host="www.gsmarena.com"):
+            async with aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=60), headers=HEADERS
+            ) as session:
+                r = await session.get(upstream_url(url))
+                metrics.inc("http_requests_total", host="www.gsmarena.com", status=r.status)
+                body = await r.content.read()
+                await record(url, r.status, body, r.headers.get("Content-Type"))
+                return body
 
     @staticmethod
+    @tracer.traced("http.fetch")
     async def get_device(url: str):
-        config = Settings()  # type: ignore
-        async with aiohttp.ClientSession(headers=HEADERS) as session:
-            r = await session.get(f"{config.cors_bypass}/https://www.gsmarena.com/{url}")
-            return await r.content.read()
+        url = f"{config.cors_bypass}/https://www.gsmarena.com/{url}"
+        with metrics.timer("http_request_duration_seconds", host="www.gsmarena.com"):
+            async with aiohttp.ClientSession(headers=HEADERS) as session:
+                r = await session.get(upstream_url(url))
+                metrics.inc("http_requests_total", host="www.gsmarena.com", status=r.status)
+                body = await r.content.read()
+                await record(url, r.status, body, r.headers.get("Content-Type"))
+                return body
 
 
 class RegionsClient:
     @staticmethod
+    @tracer.traced("http.fetch")
     async def get_regions(model: str):
         max_retries = 3
+        url = f"https://samfw.com/firmware/{model}"
         for attempt in range(max_retries):
             try:
-                async with aiohttp.ClientSession(
-                    timeout=aiohttp.ClientTimeout(total=60), headers=GENERIC_HEADER
-                ) as session:
-                    r = await session.get(url=f"https://samfw.com/firmware/{model}")
-                    return await r.content.read()
+                with metrics.timer("http_request_duration_seconds", host="samfw.com"):
+                    async with aiohttp.ClientSession(
+                        timeout=aiohttp.ClientTimeout(total=60), headers=GENERIC_HEADER
+                    ) as session:
+                        r = await session.get(url=upstream_url(url))
+                        metrics.inc("http_requests_total", host="samfw.com", status=r.status)
+                        body = await r.content.read()
+                        await record(url, r.status, body, r.headers.get("Content-Type"))
+                        if r.status == 404:
+                            return None
+                        # A rate limit or challenge page would parse as a model
+                        # without regions, so it must not look like a result.
+                        r.raise_for_status()
+                        return body
             except aiohttp.ClientError:
                 if attempt == max_retries - 1:
+                    metrics.inc("http_failures_total", host="samfw.com")
                     raise
+                metrics.inc("http_retries_total", host="samfw.com")
                 await asyncio.sleep(1)
         return None
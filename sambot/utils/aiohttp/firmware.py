@@ -4,37 +4,53 @@
 import asyncio
 
 import aiohttp
+from yarl import URL
 
+from sambot.config import config
 from sambot.utils.logging import log
+from sambot.utils.metrics import metrics
+from sambot.utils.tracing import tracer
 
 from .headers import GENERIC_HEADER
+from .replay import record, upstream_url
 
 
 class FWClient:
     def __init__(self) -> None:
         self.max_retries: int = 5
         self.retry_backoff: float = 2.0
+        self.fetch_interval: float = config.fw_fetch_interval
 
+    @tracer.traced("http.fetch")
     async def fetch_with_retry(self, url: str):
         retries = 0
-        await asyncio.sleep(3)
+        host = URL(url).host
+        await asyncio.sleep(self.fetch_interval)
         while retries < self.max_retries:
             try:
-                async with (
-                    aiohttp.ClientSession(
-                        timeout=aiohttp.ClientTimeout(60), headers=GENERIC_HEADER
-                    ) as session,
-                    session.get(url) as response,
-                ):
-                    response.raise_for_status()
-                    return await response.text()
+                with metrics.timer("http_request_duration_seconds", host=host):
+                    async with (
+                        aiohttp.ClientSession(
+                            timeout=aiohttp.ClientTimeout(60), headers=GENERIC_HEADER
+                        ) as session,
+                        session.get(upstream_url(url)) as response,
+                    ):
+                        metrics.inc("http_requests_total", host=host, status=response.status)
+                        response.raise_for_status()
+                        body = await response.read()
+                        await record(
+                            url, response.status, body, response.headers.get("Content-Type")
+                        )
+                        return body.decode(response.get_encoding())
             except (aiohttp.ClientConnectorError, aiohttp.ClientError):
                 retries += 1
+                metrics.inc("http_retries_total", host=host)
                 await asyncio.sleep(self.retry_backoff**retries)
             except Exception as e:
                 log.error("[FWClient] Unexpected error: %s", e)
                 break
 
+        metrics.inc("http_failures_total", host=host)
         log.error("[FWClient] Failed to fetch %s after %s retries", url, self.max_retries)
         return None
 
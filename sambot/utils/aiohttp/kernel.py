@@ -5,19 +5,28 @@ import asyncio
 
 import aiohttp
 
+from sambot.config import config
+from sambot.utils.metrics import metrics
+from sambot.utils.tracing import tracer
+
 from .headers import GENERIC_HEADER
+from .replay import record, upstream_url
 
 
 class KernelClient:
     def __init__(self) -> None:
-        self.fetch_interval: int = 3
+        self.fetch_interval: float = config.kernel_fetch_interval
 
+    @tracer.traced("http.fetch")
     async def search(self, model: str):
         await asyncio.sleep(self.fetch_interval)
-        async with aiohttp.ClientSession(
-            timeout=aiohttp.ClientTimeout(60), headers=GENERIC_HEADER
-        ) as session:
-            r = await session.get(
-                url=f"https://opensource.samsung.com/uploadSearch?searchValue={model}"
-            )
-            return await r.content.read()
+        with metrics.timer("http_request_duration_seconds", host="opensource.samsung.com"):
+            async with aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(60), headers=GENERIC_HEADER
+            ) as session:
+                url = f"https://opensource.samsung.com/uploadSearch?searchValue={model}"
+                r = await session.get(url=upstream_url(url))
+                metrics.inc("http_requests_total", host="opensource.samsung.com", status=r.status)
+                body = await r.content.read()
+                await record(url, r.status, body, r.headers.get("Content-Type"))
+                return body
@@ -0,0 +1,51 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
+
+import hashlib
+from pathlib import Path
+
+import orjson
+from aiofile import async_open
+from yarl import URL
+
+from sambot.config import config
+
+
+def strip_proxy(url: str) -> str:
+    return url.removeprefix(f"{config.cors_bypass}/")
+
+
+def cassette_key(url: str) -> str:
+    return hashlib.sha1(str(URL(strip_proxy(url))).encode()).hexdigest()
+
+
+def upstream_url(url: str) -> str:
+    if config.http_mode == "replay" and config.replay_url:
+        return f"{config.replay_url.rstrip("/")}/{strip_proxy(url)}"
+    return url
+
+
+async def record(url: str, status: int, body: bytes, content_type: str | None = None) -> None:
+    if config.http_mode != "record":
+        return
+
+    config.cassette_dir.mkdir(parents=True, exist_ok=True)
+    key = cassette_key(url)
+    meta = {"url": strip_proxy(url), "status": status, "content_type": content_type}
+    async with async_open(config.cassette_dir / f"{key}.body", "wb") as file:
+        await file.write(body)
+    async with async_open(config.cassette_dir / f"{key}.json", "wb") as file:
+        await file.write(orjson.dumps(meta))
+
+
+async def load_cassette(cassette_dir: Path, url: str) -> tuple[dict, bytes] | None:
+    key = cassette_key(url)
+    meta_path = cassette_dir / f"{key}.json"
+    if not meta_path.exists():
+        return None
+
+    async with async_open(meta_path, "rb") as file:
+        meta = orjson.loads(await file.read())
+    async with async_open(cassette_dir / f"{key}.body", "rb") as file:
+        body = await file.read()
+    return meta, body
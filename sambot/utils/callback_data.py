@@ -6,3 +6,7 @@ from aiogram.filters.callback_data import CallbackData
 
 class StartCallback(CallbackData, prefix="start"):
     menu: str
+
+
+class ShellCallback(CallbackData, prefix="shell"):
+    job: int
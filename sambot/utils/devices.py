@@ -2,14 +2,25 @@
 # Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
 
 import asyncio
-from dataclasses import dataclass, field
-
-from bs4 import BeautifulSoup
+import sys
+import time
+from asyncio import CancelledError
+from collections.abc import AsyncIterator
+from dataclasses import asdict, dataclass, field
+from functools import partial
 
+from sambot.config import config
 from sambot.database.devices import Devices
 from sambot.utils.aiohttp import GSMClient
-from sambot.utils.aiohttp.devices import RegionsClient
+from sambot.utils.lifecycle import lifecycle
 from sambot.utils.logging import log
+from sambot.utils.lookup import device_index
+from sambot.utils.memory import release_memory, report_memory, rss_mb, wait_for_memory
+from sambot.utils.metrics import export_metrics, metrics
+from sambot.utils.pipeline import iterate, stage
+from sambot.utils.regions import region_lookup
+from sambot.utils.soup import make_soup
+from sambot.utils.tracing import tracer
 
 
 @dataclass(slots=True)
@@ -20,23 +31,76 @@ class DeviceMeta:
     img_url: str | None = None
     short_description: str | None = None
     details: dict[str, dict[str, str]] = field(default_factory=dict)
-    model_supername: str | None = None
     models: list[str] = field(default_factory=list)
     regions: dict[str, set[str]] = field(default_factory=dict)
 
     def raw(self) -> dict:
-        return self.__dict__
+        return asdict(self)
 
     def __str__(self) -> str:
         return str(self.raw())
 
 
+@dataclass(slots=True)
+class CatalogState:
+    first_seen: dict[int, float]
+    listings: dict[int, tuple[str, str, str]]
+    refresh_after: float
+    full: bool = False
+    unchanged: int = 0
+    done: set[int] = field(default_factory=set)
+
+    def fetch_reason(self, device_meta: DeviceMeta) -> str | None:
+        if device_meta.id in self.done:
+            return None
+
+        if self.full:
+            return "full"
+
+        listing = self.listings.get(device_meta.id)
+        if listing is None and device_meta.id not in self.first_seen:
+            return "new"
+
+        if listing is not None and listing != (
+            device_meta.name,
+            device_meta.img_url,
+            device_meta.short_description,
+        ):
+            return "changed"
+
+        if self.first_seen.get(device_meta.id, 0) >= self.refresh_after:
+            return "recent"
+
+        return None
+
+    def get_first_seen(self, device_meta: DeviceMeta) -> float:
+        if device_meta.id in self.first_seen:
+            return self.first_seen[device_meta.id]
+        # Devices saved before the catalog existed are not treated as recent.
+        return 0.0 if device_meta.id in self.listings else time.time()
+
+
+async def load_catalog_state(full: bool = False, done: list[int] | None = None) -> CatalogState:
+    devices_db = Devices()
+    return CatalogState(
+        first_seen=await devices_db.get_catalog(),
+        listings=await devices_db.get_listings(),
+        refresh_after=time.time() - config.device_refresh_days * 86400,
+        full=full,
+        done=set(done or ()),
+    )
+
+
 async def fetch_page(page: int) -> list[DeviceMeta]:
     devices_list = await GSMClient.get_devices_list(page)
-    soup = BeautifulSoup(devices_list, "lxml")
+    return parse_page(devices_list)
+
+
+def parse_page(devices_list: bytes) -> list[DeviceMeta]:
+    soup = make_soup(devices_list)
     elements = soup.select("#review-body > div.makers > ul > li")
 
-    return [
+    devices = [
         DeviceMeta(
             name=element.select_one("a > strong > span").text,  # type: ignore
             url=element.select_one("a").attrs["href"],  # type: ignore
@@ -46,6 +110,8 @@ async def fetch_page(page: int) -> list[DeviceMeta]:
         )
         for element in elements
     ]
+    soup.decompose()
+    return devices
 
 
 def get_normalized_models(device_meta: DeviceMeta) -> set[str]:
@@ -53,25 +119,6 @@ def get_normalized_models(device_meta: DeviceMeta) -> set[str]:
     return {model.strip().split("/")[0] for model in models.split(",") if model.startswith("SM-")}
 
 
-def get_model_supername(device_meta: DeviceMeta) -> str:
-    if not device_meta.models:
-        return ""
-    if len(device_meta.models) == 1:
-        return device_meta.models[0]
-    return device_meta.models[0][
-        : next(
-            (
-                i
-                for i, (x, y) in enumerate(
-                    zip(device_meta.models[0], device_meta.models[1:], strict=False)
-                )
-                if x != y
-            ),
-            len(device_meta.models[0]),
-        )
-    ]
-
-
 def is_device_relevant(device_meta: DeviceMeta) -> bool:
     return bool(device_meta.details) and all(
         model.startswith("SM-") for model in get_normalized_models(device_meta)
@@ -79,23 +126,34 @@ def is_device_relevant(device_meta: DeviceMeta) -> bool:
 
 
 async def fill_details(device_meta: DeviceMeta) -> DeviceMeta:
+    await fill_specs(device_meta)
+    return await fill_regions(device_meta)
+
+
+@tracer.traced("devices.specs")
+async def fill_specs(device_meta: DeviceMeta) -> DeviceMeta:
     device = await GSMClient.get_device(str(device_meta.url))
-    soup = BeautifulSoup(device, "lxml")
-    tables = soup.select("#specs-list > table")
-    for table in tables:
-        category = table.select_one("tr > th").text  # type: ignore
-        if category:
-            inner_map = device_meta.details.get(category, {})
-            for row in table.select("tr"):
-                header = row.select_one("td.ttl")
-                content = row.select_one("td.nfo")
-                if header and content:
-                    inner_map[header.get_text()] = content.get_text()
-            device_meta.details[category] = inner_map
+    with metrics.timer("parse_duration_seconds", page="specs"):
+        soup = make_soup(device)
+        tables = soup.select("#specs-list > table")
+        for table in tables:
+            category = sys.intern(table.select_one("tr > th").text)  # type: ignore
+            if category:
+                inner_map = device_meta.details.get(category, {})
+                for row in table.select("tr"):
+                    header = row.select_one("td.ttl")
+                    content = row.select_one("td.nfo")
+                    if header and content:
+                        inner_map[sys.intern(header.get_text())] = content.get_text()
+                device_meta.details[category] = inner_map
+        soup.decompose()
 
     device_meta.models.extend(get_normalized_models(device_meta))
-    device_meta.model_supername = get_model_supername(device_meta)
+    return device_meta
+
 
+@tracer.traced("devices.regions")
+async def fill_regions(device_meta: DeviceMeta) -> DeviceMeta:
     tasks = [fetch_regions(device_meta, model) for model in device_meta.models]
     await asyncio.gather(*tasks)
     return device_meta
@@ -103,67 +161,171 @@ async def fill_details(device_meta: DeviceMeta) -> DeviceMeta:
 
 async def fetch_regions(device_meta: DeviceMeta, model: str):
     try:
-        device_regions = await RegionsClient.get_regions(model)
-        if not device_regions:
+        regions = await region_lookup.get(model)
+        if not regions:
             log.warn("[DeviceScraper] - No regions found for model!", model=model)
             return
 
-        document = BeautifulSoup(device_regions, "lxml")
-        region_elements = document.select(
-            "body > div.intro.bg-light > div > div > div > div > "
-            "div.card-body.text-justify.card-csc > div.item_csc > a > b"
-        )
-        device_meta.regions[model] = {element.text for element in region_elements}
+        device_meta.regions[model] = regions
+    except (KeyboardInterrupt, CancelledError):
+        raise
     except BaseException:
         log.exception("[DeviceScraper] - Failed to get regions!", model=model)
 
 
-async def sync_devices() -> None:
-    log.info("[DeviceScraper] - Starting device scraping")
+async def fetch_first_page() -> tuple[int | None, list[DeviceMeta]]:
     devices_list = await GSMClient.get_devices_list(1)
-    doc = BeautifulSoup(devices_list, "lxml")
+    doc = make_soup(devices_list)
     try:
         pages_count = int(
             doc.select_one("#body > div > div.review-nav-v2 > div > a:nth-child(5)").text  # type: ignore
         )
     except Exception:
         log.exception("[DeviceScraper] - Failed to get pages count!")
-        return
+        return None, []
+    finally:
+        doc.decompose()
 
-    log.info("[DeviceScraper] - Found pages of devices.", pages=pages_count)
+    return pages_count, parse_page(devices_list)
 
-    devices = []
-    log.info("[DeviceScraper] - Fetching pages, please wait...")
-    tasks = [fetch_page(i) for i in range(1, pages_count + 1)]
-    results = await asyncio.gather(*tasks)
-    for result in results:
-        devices.extend(result)
 
-    log.info("[DeviceScraper] - Devices found.", count=len(devices))
-    devices = [
-        device for device in devices if "Galaxy" in device.name and "Watch" not in device.name
-    ]
-    log.info("[DeviceScraper] - (Stage 1) Filtered devices.", filtered=len(devices))
-
-    details_devices = []
-    for i, device in enumerate(devices):
-        log.info(
-            "[DeviceScraper] - Fetching device details...",
-            device=device.name,
-            proccess=f"{i + 1}/{len(devices)}",
+async def list_devices(
+    pages_count: int, first_page: list[DeviceMeta]
+) -> AsyncIterator[DeviceMeta]:
+    async def fetch(page: int) -> list[DeviceMeta]:
+        try:
+            return await fetch_page(page)
+        except (KeyboardInterrupt, CancelledError):
+            raise
+        except Exception:
+            metrics.inc("devices_failed_total", stage="listing")
+            log.exception("[DeviceScraper] - Failed to fetch devices page!", page=page)
+            return []
+
+    for device in first_page:
+        metrics.inc("devices_listed_total")
+        yield device
+
+    pages = stage(iterate(range(2, pages_count + 1)), fetch, config.device_sync_concurrency)
+    async for devices in pages:
+        for device in devices:
+            metrics.inc("devices_listed_total")
+            yield device
+
+
+async def filter_devices(devices: AsyncIterator[DeviceMeta]) -> AsyncIterator[DeviceMeta]:
+    async for device in devices:
+        if "Galaxy" in str(device.name) and "Watch" not in str(device.name):
+            yield device
+
+
+async def select_devices(
+    devices: AsyncIterator[DeviceMeta], state: CatalogState
+) -> AsyncIterator[DeviceMeta]:
+    async for device in devices:
+        if lifecycle.stopping:
+            break
+
+        reason = state.fetch_reason(device)
+        if reason is None:
+            state.unchanged += 1
+            metrics.inc("devices_unchanged_total")
+            continue
+
+        metrics.inc("devices_selected_total", reason=reason)
+        log.debug(
+            "[DeviceScraper] - Selected device.", device=device.name, reason=reason, sampled=True
         )
-        device = await fill_details(device)
-        details_devices.append(device)
+        yield device
 
-    devices = list(filter(is_device_relevant, details_devices))
-    log.info("[DeviceScraper] - (Stage 2) Filtered devices.", filtered=len(devices))
-    devices = sorted(devices, key=get_model_supername)
 
-    for device in devices:
-        try:
-            await Devices().save(device)
-            log.info("[DeviceScraper] - Saved device to database.", device=device.name)
-        except BaseException:
-            log.exception(
-                "[DeviceScraper] - Failed to save device to database!", device=device.name
-            )
+async def specs_step(state: CatalogState, device: DeviceMeta) -> DeviceMeta | None:
+    await wait_for_memory(config.sync_memory_limit_mb)
+    try:
+        await fill_specs(device)
+    except (KeyboardInterrupt, CancelledError):
+        raise
+    except Exception:
+        metrics.inc("devices_failed_total", stage="details")
+        log.exception("[DeviceScraper] - Failed to fetch device details!", device=device.name)
+        return None
+
+    relevant = is_device_relevant(device)
+    await Devices().mark_fetched(device.id, state.get_first_seen(device), relevant)
+    if not relevant:
+        log.debug(
+            "[DeviceScraper] - Skipping irrelevant device.", device=device.name, sampled=True
+        )
+        return None
+    return device
+
+
+async def regions_step(device: DeviceMeta) -> DeviceMeta | None:
+    return await fill_regions(device)
+
+
+@lifecycle.tracked("devices")
+@tracer.traced("sync", name="sync_devices", transaction=True)
+async def sync_devices(full: bool = False, done: list[int] | None = None) -> None:
+    start_rss = rss_mb()
+    with metrics.timer("sync_duration_seconds", job="devices"):
+        await _sync_devices(full, done)
+    await region_lookup.purge()
+    release_memory()
+    report_memory("devices", start_rss)
+    metrics.inc("sync_runs_total", job="devices")
+    await device_index.refresh()
+    await export_metrics()
+
+
+async def _sync_devices(full: bool, done: list[int] | None) -> None:
+    log.info("[DeviceScraper] - Starting device scraping", full=full, resumed=len(done or ()))
+    pages_count, first_page = await fetch_first_page()
+    if pages_count is None:
+        return
+
+    log.info("[DeviceScraper] - Found pages of devices.", pages=pages_count)
+    state = await load_catalog_state(full, done)
+
+    workers = config.device_sync_concurrency
+    buffer = config.device_sync_buffer
+    devices = select_devices(filter_devices(list_devices(pages_count, first_page)), state)
+    devices = stage(devices, partial(specs_step, state), workers, buffer)
+    devices = stage(devices, regions_step, workers, buffer)
+
+    saved = failed = 0
+    devices_db = Devices()
+    try:
+        async for device in devices:
+            try:
+                await devices_db.save(device)
+            except (KeyboardInterrupt, CancelledError):
+                raise
+            except BaseException:
+                failed += 1
+                metrics.inc("devices_failed_total", stage="save")
+                log.exception(
+                    "[DeviceScraper] - Failed to save device to database!", device=device.name
+                )
+            else:
+                saved += 1
+                state.done.add(device.id)
+                metrics.inc("devices_saved_total")
+                log.info(
+                    "[DeviceScraper] - Saved device to database.",
+                    device=device.name,
+                    saved=saved,
+                    sampled=True,
+                )
+    finally:
+        if lifecycle.stopping:
+            # Listing changes are picked up by any later run, but a full run
+            # would start over, so remember which devices are already saved.
+            await lifecycle.checkpoint("devices", {"full": full, "done": sorted(state.done)})
+
+    log.info(
+        "[DeviceScraper] - Device scraping finished.",
+        saved=saved,
+        failed=failed,
+        unchanged=state.unchanged,
+    )
@@ -0,0 +1,140 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
+
+import asyncio
+import os
+from dataclasses import dataclass
+from pathlib import Path
+
+from sambot import app_dir
+from sambot.config import config
+from sambot.utils.kernel import KernelMeta, Progress, is_valid_zip
+from sambot.utils.logging import log
+from sambot.utils.metrics import metrics
+
+
+@dataclass(slots=True)
+class CacheStats:
+    files: int
+    size: int
+    max_size: int
+    hits: float
+    misses: float
+
+
+class DownloadCache:
+    def __init__(
+        self, folder: Path = app_dir / "data/downloads", max_size: int | None = None
+    ) -> None:
+        self.folder = folder
+        self.max_size = max_size
+        self._inflight: dict[str, asyncio.Task[Path | None]] = {}
+
+    @property
+    def size_limit(self) -> int:
+        return self.max_size if self.max_size is not None else config.download_cache_max_size
+
+    async def get_kernel(
+        self, kernel: KernelMeta, progress: Progress | None = None
+    ) -> Path | None:
+        name = f"{kernel.model}-{kernel.pda}.zip"
+        path = self.folder / name
+        if path.exists() and await self._verify(path):
+            metrics.inc("download_cache_total", result="hit")
+            # The mtime doubles as the last access time for LRU eviction.
+            os.utime(path)
+            return path
+
+        task = self._inflight.get(name)
+        if task is None:
+            metrics.inc("download_cache_total", result="miss")
+            task = self._inflight[name] = asyncio.create_task(self._download(kernel, progress))
+            task.add_done_callback(lambda _: self._inflight.pop(name, None))
+        else:
+            metrics.inc("download_cache_total", result="shared")
+        return await asyncio.shield(task)
+
+    @staticmethod
+    def _stamp(path: Path) -> Path:
+        return path.with_name(f"{path.name}.ok")
+
+    def _mark_verified(self, path: Path) -> None:
+        # The stamp holds the verified size; the mtime is taken by the LRU.
+        self._stamp(path).write_text(str(path.stat().st_size))
+
+    def _is_stamped(self, path: Path) -> bool:
+        stamp = self._stamp(path)
+        try:
+            return stamp.read_text() == str(path.stat().st_size)
+        except (OSError, ValueError):
+            return False
+
+    def _check(self, path: Path) -> bool:
+        if self._is_stamped(path):
+            return True
+
+        # Archives without a matching stamp, e.g. saved before downloads were
+        # verified, get a full check once.
+        if not is_valid_zip(path):
+            log.warn("[DownloadCache] - Dropping corrupt archive.", file=path.name)
+            path.unlink(missing_ok=True)
+            self._stamp(path).unlink(missing_ok=True)
+            return False
+
+        self._mark_verified(path)
+        return True
+
+    async def _verify(self, path: Path) -> bool:
+        return await asyncio.to_thread(self._check, path)
+
+    async def _download(self, kernel: KernelMeta, progress: Progress | None) -> Path | None:
+        self.folder.mkdir(parents=True, exist_ok=True)
+        path = await kernel.download(self.folder, progress)
+        if path is not None:
+            await asyncio.to_thread(self._mark_verified, path)
+            await asyncio.to_thread(self.evict, path)
+        return path
+
+    def _archives(self) -> list[tuple[Path, os.stat_result]]:
+        return [(path, path.stat()) for path in self.folder.glob("*.zip") if path.is_file()]
+
+    def evict(self, keep: Path | None = None) -> list[Path]:
+        archives = sorted(self._archives(), key=lambda item: item[1].st_mtime)
+        total = sum(stat.st_size for _, stat in archives)
+        # Partial downloads count against the budget but are never evicted.
+        total += sum(path.stat().st_size for path in self.folder.glob("*.zip.part"))
+
+        evicted = []
+        for path, stat in archives:
+            if total <= self.size_limit:
+                break
+            if path == keep or path.name in self._inflight:
+                continue
+            path.unlink(missing_ok=True)
+            self._stamp(path).unlink(missing_ok=True)
+            total -= stat.st_size
+            evicted.append(path)
+            metrics.inc("download_cache_evictions_total")
+            log.info("[DownloadCache] - Evicted archive.", file=path.name, size=stat.st_size)
+
+        self._update_gauges()
+        return evicted
+
+    def _update_gauges(self) -> CacheStats:
+        archives = self._archives() if self.folder.exists() else []
+        stats = CacheStats(
+            files=len(archives),
+            size=sum(stat.st_size for _, stat in archives),
+            max_size=self.size_limit,
+            hits=metrics.get_counter("download_cache_total", result="hit"),
+            misses=metrics.get_counter("download_cache_total", result="miss"),
+        )
+        metrics.set("download_cache_files", stats.files)
+        metrics.set("download_cache_bytes", stats.size)
+        return stats
+
+    def stats(self) -> CacheStats:
+        return self._update_gauges()
+
+
+download_cache = DownloadCache()
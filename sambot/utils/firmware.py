@@ -1,20 +1,34 @@
 # SPDX-License-Identifier: BSD-3-Clause
 # Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
 
+import asyncio
+import time
+import zlib
 from asyncio import CancelledError
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from datetime import datetime
+from typing import TYPE_CHECKING
 
-from bs4 import BeautifulSoup
-
+from sambot.config import config
+from sambot.database.firmware import Firmwares, hash_changelog
 from sambot.utils.aiohttp.firmware import FWClient
 from sambot.utils.logging import log
+from sambot.utils.metrics import metrics
 from sambot.utils.pda import (
     get_build_id,
     get_build_month,
     get_build_year,
     get_major_version,
 )
+from sambot.utils.soup import make_soup
+from sambot.utils.tracing import tracer
+
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup, Tag
+
+
+class FirmwareFetchError(Exception):
+    pass
 
 
 @dataclass(slots=True)
@@ -26,7 +40,12 @@ class FirmwareMeta:
     build_date: datetime
     securitypatch: datetime
     name: str
-    changelog: str
+    changelog: str | None = None
+    changelog_hash: str | None = None
+
+    def __post_init__(self) -> None:
+        if self.changelog is not None and self.changelog_hash is None:
+            self.changelog_hash = hash_changelog(self.changelog)
 
     def download_url(self) -> str:
         return f"https://samfw.com/firmware/{self.model}/{self.region}/{self.pda}"
@@ -54,6 +73,19 @@ class FirmwareMeta:
 
         return False
 
+    @classmethod
+    def from_row(cls, row) -> "FirmwareMeta":
+        return cls(
+            model=row["Model"],
+            region=row["Region"],
+            os_version=row["OSVersion"],
+            pda=row["PDA"],
+            build_date=datetime.strptime(row["BuildDate"], "%Y-%m-%d"),  # noqa: DTZ007
+            securitypatch=datetime.strptime(row["SecurityPatch"], "%Y-%m-%d"),  # noqa: DTZ007
+            name=row["Name"],
+            changelog_hash=row["ChangelogHash"],
+        )
+
     def raw(self) -> dict:
         return self.__dict__
 
@@ -61,40 +93,143 @@ class FirmwareMeta:
         return str(self.raw())
 
 
-async def fetch_latest_firmware(model: str, region: str) -> FirmwareMeta | None:
+async def fetch_magic(model: str, region: str) -> str | None:
+    device_doc = await FWClient().get_device_doc(model, region)
+    if not device_doc:
+        msg = f"Failed to fetch device document of {model}/{region}"
+        raise FirmwareFetchError(msg)
+
+    with metrics.timer("parse_duration_seconds", page="doc"):
+        return extract_magic(device_doc)
+
+
+async def fetch_history_by_magic(model: str, region: str, magic: str) -> list[FirmwareMeta]:
+    device_eng = await FWClient().get_device_eng(model, magic)
+    if not device_eng:
+        msg = f"Failed to fetch device engineering document of {model}/{magic}"
+        raise FirmwareFetchError(msg)
+
+    with metrics.timer("parse_duration_seconds", page="eng"):
+        return parse_firmware_history(device_eng, model, region)
+
+
+async def fetch_firmware_history(model: str, region: str) -> list[FirmwareMeta]:
     try:
-        device_doc = await FWClient().get_device_doc(model, region)
-        if not device_doc:
-            log.error(
-                "[SamsungFirmwareInfo] Failed to fetch device document",
-                model=model,
-                region=region,
+        with tracer.span("firmware.fetch", f"{model}/{region}"):
+            magic = await fetch_magic(model, region)
+            if not magic:
+                return []
+            return await fetch_history_by_magic(model, region, magic)
+    except (KeyboardInterrupt, CancelledError):
+        raise
+    except BaseException:
+        log.exception("[SamsungFirmwareInfo] Failed to fetch firmware history")
+        return []
+
+
+class RegionGroups:
+    def __init__(self, firmwares_db: Firmwares) -> None:
+        self.firmwares_db = firmwares_db
+        self._magics: dict[tuple[str, str], tuple[str, float]] = {}
+        self._loaded: set[str] = set()
+        self._histories: dict[tuple[str, str], asyncio.Task[list[FirmwareMeta]]] = {}
+
+    async def preload(self, models: list[str]) -> None:
+        self._magics.update(await self.firmwares_db.get_region_magics(models))
+        self._loaded.update(models)
+
+    @staticmethod
+    def is_fresh(model: str, region: str, checked_at: float) -> bool:
+        # Spread revalidation over 0.5-1.5x the TTL so regions of a model
+        # do not all expire in the same run.
+        spread = 0.5 + zlib.crc32(f"{model}/{region}".encode()) % 1000 / 1000
+        return time.time() - checked_at < config.region_group_ttl_hours * 3600 * spread
+
+    async def get_magic(self, model: str, region: str) -> str | None:
+        if model not in self._loaded:
+            await self.preload([model])
+
+        cached = self._magics.get((model, region))
+        if cached and self.is_fresh(model, region, cached[1]):
+            metrics.inc("region_groups_total", result="cached")
+            return cached[0]
+
+        try:
+            magic = await fetch_magic(model, region)
+        except FirmwareFetchError:
+            if not cached:
+                raise
+            log.warn(
+                "[SamsungFirmwareInfo] Using the cached build group", model=model, region=region
             )
-            return None
-
-        magic = extract_magic(device_doc)
+            return cached[0]
         if not magic:
-            return None
+            return cached[0] if cached else None
 
-        device_eng = await FWClient().get_device_eng(model, magic)
-        if not device_eng:
-            log.error(
-                "[SamsungFirmwareInfo] Failed to fetch device engineering document",
+        if cached and cached[0] != magic:
+            metrics.inc("region_groups_total", result="moved")
+            log.info(
+                "[SamsungFirmwareInfo] Region moved to another build group",
                 model=model,
-                magic=magic,
+                region=region,
+                old=cached[0],
+                new=magic,
             )
-            return None
+        else:
+            metrics.inc("region_groups_total", result="checked")
+
+        self._magics[model, region] = (magic, time.time())
+        await self.firmwares_db.set_region_magic(model, region, magic)
+        return magic
+
+    async def fetch_history(
+        self, model: str, region: str, strict: bool = False
+    ) -> list[FirmwareMeta]:
+        try:
+            with tracer.span("firmware.fetch", f"{model}/{region}"):
+                magic = await self.get_magic(model, region)
+                if not magic:
+                    return []
+
+                task = self._histories.get((model, magic))
+                if task is None:
+                    task = asyncio.create_task(fetch_history_by_magic(model, region, magic))
+                    self._histories[model, magic] = task
+                else:
+                    metrics.inc("region_groups_total", result="shared")
+
+                try:
+                    history = await asyncio.shield(task)
+                finally:
+                    # Let the next region of the group retry a failed fetch.
+                    if task.done() and (task.cancelled() or task.exception() or not task.result()):
+                        self._histories.pop((model, magic), None)
+
+                return [
+                    info if info.region == region else replace(info, region=region)
+                    for info in history
+                ]
+        except (KeyboardInterrupt, CancelledError):
+            raise
+        except BaseException:
+            # Sync workers retry failed jobs, so they need the error itself.
+            if strict:
+                raise
+            log.exception("[SamsungFirmwareInfo] Failed to fetch firmware history")
+            return []
+
+    def forget(self, model: str) -> None:
+        for key in [key for key in self._histories if key[0] == model]:
+            del self._histories[key]
 
-        return parse_firmware_meta(device_eng, model, region)
-    except (KeyboardInterrupt, CancelledError):
-        raise
-    except BaseException:
-        log.exception("[SamsungFirmwareInfo] Failed to fetch latest firmware info")
-        return None
+
+async def fetch_latest_firmware(model: str, region: str) -> FirmwareMeta | None:
+    history = await fetch_firmware_history(model, region)
+    return history[0] if history else None
 
 
 def extract_magic(device_doc: str) -> str | None:
-    soup = BeautifulSoup(device_doc, features="xml")
+    soup = make_soup(device_doc, "xml")
     inp = soup.find(id="dflt_page")
     if inp is not None:
         return inp["value"].split("/")[3]  # type: ignore
@@ -102,43 +237,67 @@ def extract_magic(device_doc: str) -> str | None:
 
 
 def parse_firmware_meta(device_eng: str, model: str, region: str) -> FirmwareMeta | None:
-    soup = BeautifulSoup(device_eng, features="xml")
-    changelog_entries = soup.find_all(class_="row")
-    if len(changelog_entries) < 2:
-        return None
-
-    latest_entry = changelog_entries[1]
-    info = latest_entry.find_all(class_="col-md-3")
-    if len(info) < 4:
-        return None
-
-    pda = info[0].text.split(":")[1].strip()
-    os_version = info[1].text.split(":")[1].strip().replace("(Android ", " (")
-    release_date = info[2].text.split(":")[1].strip()
-    security_patch = info[3].text.split(":")[1].strip()
+    history = parse_firmware_history(device_eng, model, region)
+    return history[0] if history else None
+
+
+def parse_firmware_history(device_eng: str, model: str, region: str) -> list[FirmwareMeta]:
+    soup = make_soup(device_eng, "xml")
+    changelog_entries = soup.find_all(class_="row")[1:]
     name = extract_name(soup)
-    changelog_txt = extract_changelog(soup)
+    # The latest entry keeps the original page-wide lookup, older ones
+    # take the changelog written right after their own row.
+    latest_changelog = extract_changelog(soup)
+
+    history = []
+    for index, entry in enumerate(changelog_entries):
+        info = entry.find_all(class_="col-md-3")
+        if len(info) < 4:
+            continue
+
+        try:
+            pda = info[0].text.split(":")[1].strip()
+            os_version = info[1].text.split(":")[1].strip().replace("(Android ", " (")
+            release_date = info[2].text.split(":")[1].strip()
+            security_patch = info[3].text.split(":")[1].strip()
+            build_date = datetime.strptime(release_date, "%Y-%m-%d")  # noqa: DTZ007
+            securitypatch = datetime.strptime(security_patch, "%Y-%m-%d")  # noqa: DTZ007
+        except (IndexError, ValueError):
+            log.warn("[SamsungFirmwareInfo] Skipping malformed history entry", model=model)
+            continue
+
+        if history:
+            next_entry = (
+                changelog_entries[index + 1] if index + 1 < len(changelog_entries) else None
+            )
+            changelog_txt = extract_entry_changelog(entry, next_entry)
+        else:
+            changelog_txt = latest_changelog
+
+        history.append(
+            FirmwareMeta(
+                model=model,
+                region=region,
+                os_version=os_version,
+                pda=pda,
+                build_date=build_date,
+                securitypatch=securitypatch,
+                name=name,
+                changelog=changelog_txt,
+            )
+        )
 
-    return FirmwareMeta(
-        model=model,
-        region=region,
-        os_version=os_version,
-        pda=pda,
-        build_date=datetime.strptime(release_date, "%Y-%m-%d"),  # noqa: DTZ007
-        securitypatch=datetime.strptime(security_patch, "%Y-%m-%d"),  # noqa: DTZ007
-        name=name,
-        changelog=changelog_txt,
-    )
+    return history
 
 
-def extract_name(soup: BeautifulSoup) -> str:
+def extract_name(soup: "BeautifulSoup") -> str:
     h1 = soup.find_all("h1")
     if h1:
         return h1[0].text.split("(")[0].strip()
     return ""
 
 
-def extract_changelog(soup: BeautifulSoup) -> str:
+def extract_changelog(soup: "BeautifulSoup") -> str:
     for br in soup.find_all("br"):
         br.replace_with("\n")
 
@@ -146,3 +305,13 @@ def extract_changelog(soup: BeautifulSoup) -> str:
     if len(changelog_text) > 1:
         return changelog_text[1].get_text()
     return ""
+
+
+def extract_entry_changelog(entry: "Tag", next_entry: "Tag | None") -> str:
+    spans = []
+    for element in entry.find_all_next():
+        if element is next_entry:
+            break
+        if element.name == "span":
+            spans.append(element)
+    return spans[-1].get_text() if spans else ""
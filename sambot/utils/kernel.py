@@ -1,30 +1,167 @@
 # SPDX-License-Identifier: BSD-3-Clause
 # Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
 
+import asyncio
 import re
+import shutil
+import tarfile
+import time
+import zipfile
 from asyncio import CancelledError
-from dataclasses import asdict, dataclass
+from collections.abc import Awaitable, Callable
+from dataclasses import asdict, dataclass, field, replace
 from pathlib import Path
+from typing import TYPE_CHECKING
 from urllib.parse import urlencode
 
 import aiohttp
+import humanize
 from aiofile import async_open
-from bs4 import BeautifulSoup
 from yarl import URL
 
 from sambot import app_dir
-from sambot.config import Settings
+from sambot.config import config
 from sambot.utils.aiohttp.kernel import KernelClient
 from sambot.utils.logging import log
+from sambot.utils.metrics import metrics
 from sambot.utils.pda import (
     get_build_id,
     get_build_month,
     get_build_year,
     get_major_version,
 )
+from sambot.utils.soup import make_soup
+
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup
 
 OSS_BASE_URL = "https://opensource.samsung.com"
 OSS_SEARCH_URL = f"{OSS_BASE_URL}/uploadSearch?searchValue="
+# How long a failed family search blocks new searches of that family.
+FAILED_SEARCH_BACKOFF = 300.0
+
+KERNEL_TARBALL = "Kernel.tar.gz"
+MAKEFILE_VERSION = re.compile(
+    r"^(VERSION|PATCHLEVEL|SUBLEVEL|EXTRAVERSION)[ \t]*=[ \t]*(\S*)", re.MULTILINE
+)
+
+# Called with (received bytes, total bytes or None when unknown).
+Progress = Callable[[int, int | None], Awaitable[None]]
+
+
+def content_range_start(response: aiohttp.ClientResponse) -> int | None:
+    # Content-Range: bytes 1000-1999/2000
+    value = response.headers.get("Content-Range", "")
+    match = re.match(r"bytes (\d+)-", value)
+    return int(match.group(1)) if match else None
+
+
+def is_valid_zip(path: Path) -> bool:
+    try:
+        with zipfile.ZipFile(path) as archive:
+            return archive.testzip() is None
+    except (zipfile.BadZipFile, OSError):
+        return False
+
+
+@dataclass(slots=True)
+class TransferStats:
+    start_offset: int
+    total: int | None
+    received: int = field(init=False)
+    started_at: float = field(default_factory=time.monotonic)
+    last_report: float = 0.0
+
+    def __post_init__(self) -> None:
+        self.received = self.start_offset
+
+    def update(self, size: int) -> bool:
+        self.received += size
+        now = time.monotonic()
+        if now - self.last_report < config.kernel_download_progress_interval:
+            return False
+        self.last_report = now
+        return True
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    @property
+    def speed(self) -> float:
+        elapsed = self.elapsed
+        return (self.received - self.start_offset) / elapsed if elapsed else 0.0
+
+
+@dataclass(slots=True)
+class KernelArchiveInfo:
+    entries: list[tuple[str, int]] = field(default_factory=list)
+    tarball: str | None = None
+    version: str | None = None
+    defconfigs: list[str] = field(default_factory=list)
+
+
+def parse_makefile_version(makefile: str) -> str | None:
+    fields = dict(MAKEFILE_VERSION.findall(makefile))
+    if "VERSION" not in fields or "PATCHLEVEL" not in fields:
+        return None
+    numbers = [fields[key] for key in ("VERSION", "PATCHLEVEL", "SUBLEVEL") if fields.get(key)]
+    return ".".join(numbers) + fields.get("EXTRAVERSION", "")
+
+
+def find_kernel_tarball(archive: zipfile.ZipFile) -> zipfile.ZipInfo | None:
+    return next(
+        (info for info in archive.infolist() if Path(info.filename).name == KERNEL_TARBALL), None
+    )
+
+
+def inspect_kernel_archive(path: Path) -> KernelArchiveInfo:
+    with zipfile.ZipFile(path) as archive:
+        info = KernelArchiveInfo(
+            entries=[(entry.filename, entry.file_size) for entry in archive.infolist()]
+        )
+        tarball = find_kernel_tarball(archive)
+        if tarball is None:
+            return info
+
+        info.tarball = tarball.filename
+        # "r|gz" reads the nested tarball as a stream, nothing is unpacked, but
+        # every member up to the last one needed is still decompressed.
+        with archive.open(tarball) as stream, tarfile.open(fileobj=stream, mode="r|gz") as tar:
+            seen_arch = False
+            for member in tar:
+                parts = Path(member.name).parts
+                parts = parts[1:] if parts and parts[0] == "." else parts
+                in_arch = "arch" in parts[:2]
+                if seen_arch and not in_arch and info.version is not None:
+                    # Tarballs list a directory's members together, so no
+                    # defconfig can follow once the scan is past arch/.
+                    break
+                seen_arch = seen_arch or in_arch
+                if not member.isfile() or not parts:
+                    continue
+                # The top-level Makefile, either at the root or in a single source folder.
+                if parts[-1] == "Makefile" and len(parts) <= 2 and info.version is None:
+                    makefile = tar.extractfile(member)
+                    if makefile is not None:
+                        head = makefile.read(4096).decode(errors="ignore")
+                        info.version = parse_makefile_version(head)
+                elif "configs" in parts and parts[-1].endswith("defconfig"):
+                    info.defconfigs.append("/".join(parts))
+    return info
+
+
+def extract_kernel_tarball(path: Path, dst: Path) -> Path | None:
+    with zipfile.ZipFile(path) as archive:
+        tarball = find_kernel_tarball(archive)
+        if tarball is None:
+            return None
+
+        tmp = dst.with_name(f"{dst.name}.part")
+        with archive.open(tarball) as source, tmp.open("wb") as target:
+            shutil.copyfileobj(source, target, config.kernel_download_chunk_size)
+        tmp.replace(dst)
+    return dst
 
 
 @dataclass(slots=True)
@@ -63,15 +200,61 @@ class KernelMeta:
     def __str__(self) -> str:
         return str(self.raw())
 
-    async def download(self, folder: Path = app_dir / "data/downloads/") -> Path | None:
+    async def download(
+        self, folder: Path = app_dir / "data/downloads/", progress: Progress | None = None
+    ) -> Path | None:
         dst = folder / f"{self.model}-{self.pda}.zip"
+        part = dst.with_name(f"{dst.name}.part")
+        for attempt in range(1, config.kernel_download_attempts + 1):
+            try:
+                # Download tokens are single use, so every attempt asks for a new one.
+                prepared = await self._prepare_download()
+                if prepared is None:
+                    return None
+                if not await self._download_file(part, *prepared, progress):
+                    return None
+                break
+            except (aiohttp.ClientError, TimeoutError) as e:
+                metrics.inc("http_retries_total", host="opensource.samsung.com")
+                log.warn(
+                    "[SamsungKernelInfo] - Download interrupted, resuming.",
+                    model=self.model,
+                    attempt=attempt,
+                    received=part.stat().st_size if part.exists() else 0,
+                    error=str(e),
+                )
+                await asyncio.sleep(2**attempt)
+        else:
+            metrics.inc("http_failures_total", host="opensource.samsung.com")
+            log.error("[SamsungKernelInfo] - Download failed!", model=self.model)
+            return None
+
+        if not await asyncio.to_thread(is_valid_zip, part):
+            log.error(
+                "[SamsungKernelInfo] - Downloaded file is not a valid zip!", model=self.model
+            )
+            part.unlink(missing_ok=True)
+            return None
+
+        part.replace(dst)
+        return dst
+
+    @staticmethod
+    async def inspect_archive(path: Path) -> KernelArchiveInfo:
+        return await asyncio.to_thread(inspect_kernel_archive, path)
+
+    @staticmethod
+    async def extract_tarball(path: Path, dst: Path) -> Path | None:
+        return await asyncio.to_thread(extract_kernel_tarball, path, dst)
+
+    async def _prepare_download(self) -> tuple[bytes, str | None] | None:
         async with aiohttp.ClientSession(cookie_jar=aiohttp.CookieJar()) as session:
             response = await session.get(
                 f"{OSS_BASE_URL}/downSrcMPop?uploadId={self.upload_id}", allow_redirects=False
             )
             data = await response.content.read()
 
-        doc = BeautifulSoup(data, "lxml")
+        doc = make_soup(data)
         _csrf_elem = doc.find_all(attrs={"name": "_csrf"})
         checkboxes = doc.find_all(attrs={"type": "checkbox"})
 
@@ -83,10 +266,9 @@ class KernelMeta:
         query, cookies_str = self._prepare_download_query(doc, _csrf_elem, attach_ids, session)
         if not query:
             return None
+        return query, cookies_str
 
-        return await self._download_file(dst, query, cookies_str)
-
-    def _extract_attach_ids(self, doc: BeautifulSoup, checkboxes: list) -> str | None:
+    def _extract_attach_ids(self, doc: "BeautifulSoup", checkboxes: list) -> str | None:
         if len(checkboxes) <= 1:
             return None
         if self.patch_kernel is None:
@@ -103,7 +285,11 @@ class KernelMeta:
         return None
 
     def _prepare_download_query(
-        self, doc: BeautifulSoup, _csrf_elem: list, attach_ids: str, session: aiohttp.ClientSession
+        self,
+        doc: "BeautifulSoup",
+        _csrf_elem: list,
+        attach_ids: str,
+        session: aiohttp.ClientSession,
     ) -> tuple[bytes | None, str | None]:
         token_elem = doc.find(id="token")
         if token_elem is None:
@@ -127,8 +313,12 @@ class KernelMeta:
         return query, cookies_str
 
     async def _download_file(
-        self, dst: Path, query_bin: bytes, cookies_str: str | None
-    ) -> Path | None:
+        self,
+        part: Path,
+        query_bin: bytes,
+        cookies_str: str | None,
+        progress: Progress | None = None,
+    ) -> bool:
         headers = {
             "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
             "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
@@ -138,69 +328,211 @@ class KernelMeta:
             "Referer": f"{OSS_SEARCH_URL}{self.model}",
             "User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:90.0) Gecko/20100101 Firefox/90.0",
         }
-
-        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5400)) as session:
-            config = Settings()  # type: ignore
-            response = await session.post(
+        offset = part.stat().st_size if part.exists() else 0
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=60, sock_read=300)
+        async with (
+            aiohttp.ClientSession(timeout=timeout) as session,
+            session.post(
                 f"{config.cors_bypass}/https://opensource.samsung.com/downSrcCode",
                 headers=headers,
                 data=query_bin,
-            )
-            if (
+            ) as response,
+        ):
+            if response.status == 206 and content_range_start(response) == offset:
+                mode = "ab"
+            elif (
                 response.status == 200
                 and response.headers.get("Content-Transfer-Encoding") == "binary"
             ):
-                async with async_open(dst, "wb") as file:
-                    async for chunk in response.content.iter_chunked(16144):
-                        await file.write(chunk)
-                return dst
+                # No range support for this request, start over.
+                offset, mode = 0, "wb"
+            elif response.status == 206:
+                part.unlink(missing_ok=True)
+                msg = "Server resumed from an unexpected offset"
+                raise aiohttp.ClientPayloadError(msg)
+            else:
+                log.error(
+                    "[SamsungKernelInfo] - Unexpected download response!",
+                    model=self.model,
+                    status=response.status,
+                )
+                return False
+
+            total = offset + response.content_length if response.content_length else None
+            stats = TransferStats(offset, total)
+            async with async_open(part, mode) as file:
+                chunks = response.content.iter_chunked(config.kernel_download_chunk_size)
+                async for chunk in chunks:
+                    await file.write(chunk)
+                    if stats.update(len(chunk)) and progress:
+                        await progress(stats.received, stats.total)
+
+        if total is not None and stats.received < total:
+            msg = f"Transfer ended at {stats.received} of {total} bytes"
+            raise aiohttp.ClientPayloadError(msg)
+
+        if progress:
+            await progress(stats.received, stats.total)
+        log.info(
+            "[SamsungKernelInfo] - Download finished.",
+            model=self.model,
+            size=humanize.naturalsize(stats.received, binary=True),
+            resumed_from=offset,
+            elapsed=round(stats.elapsed, 1),
+            speed=f"{humanize.naturalsize(stats.speed, binary=True)}/s",
+        )
+        return True
+
+
+def parse_kernel_row(table_data: list, model: str) -> KernelMeta:
+    fw_versions = table_data[2].get_text(separator="\n", strip=True).splitlines()
+    fw_version = re.sub("[^a-zA-Z0-9]", "", fw_versions[-1].strip() if fw_versions else "")
+
+    upload_id = ""
+    download_td = table_data[4].find("a").get("href").split("'")
+    if len(download_td) > 1:
+        upload_id = download_td[1].strip()
+
+    download_files = table_data[3].get_text(strip=True, separator=" ").split(" ")
+    if len(download_files) > 1:
+        patch_version = download_files[-1].split("_")[-1].split(".")[0]
+        return KernelMeta(
+            model=model,
+            pda=patch_version,
+            upload_id=upload_id,
+            patch_kernel=fw_version,
+        )
 
-        return None
+    return KernelMeta(model=model, pda=fw_version, upload_id=upload_id, patch_kernel=None)
+
+
+def parse_kernel_index(kernel_search: bytes) -> dict[str, KernelMeta]:
+    index: dict[str, KernelMeta] = {}
+    soup = make_soup(kernel_search)
+    for table_row in soup.find_all("tr"):
+        table_data = table_row.find_all("td")
+        if len(table_data) <= 4:
+            continue
+
+        models = re.split(r"[\s,]+", table_data[1].get_text(separator="\n", strip=True))
+        for model in filter(None, models):
+            try:
+                kernel = parse_kernel_row(table_data, model)
+            except (AttributeError, IndexError, TypeError):
+                continue
+            # Results are listed newest first, later rows only win when newer.
+            current = index.get(model)
+            if current is None or kernel.is_newer_than(current.pda):
+                index[model] = kernel
+    soup.decompose()
+    return index
 
 
 async def fetch_latest_kernel(model: str) -> KernelMeta | None:
     try:
         kernel_search = await KernelClient().search(model)
-        soup = BeautifulSoup(kernel_search, "lxml")
-        table_rows = soup.find_all("tr")
-
-        for table_row in table_rows:
-            table_data = table_row.find_all("td")
-
-            if len(table_data) > 4:
-                models = table_data[1].get_text(strip=True).split("<br>")
-
-                if model in models:
-                    fw_versions = table_data[2].get_text(strip=True).split("<br>")
-                    fw_version = re.sub(
-                        "[^a-zA-Z0-9]", "", fw_versions[-1].strip() if fw_versions else ""
-                    )
-
-                    upload_id = ""
-                    download_td = table_data[4].find("a").get("href").split("'")
-
-                    if len(download_td) > 1:
-                        upload_id = download_td[1].strip()
-
-                    download_files = table_data[3].get_text(strip=True, separator=" ").split(" ")
-                    if len(download_files) > 1:
-                        patch_version = download_files[-1].split("_")[-1].split(".")[0]
-
-                        return KernelMeta(
-                            model=model,
-                            pda=patch_version,
-                            upload_id=upload_id,
-                            patch_kernel=fw_version,
-                        )
-
-                    return KernelMeta(
-                        model=model,
-                        pda=fw_version,
-                        upload_id=upload_id,
-                        patch_kernel=None,
-                    )
+        return parse_kernel_index(kernel_search).get(model)
     except (KeyboardInterrupt, CancelledError):
         raise
     except Exception as e:
         log.error(f"[SamsungKernelInfo] - Failed to fetch latest kernel! Error: {e}", device=model)
         return None
+
+
+class KernelIndex:
+    def __init__(self) -> None:
+        # Models known to have no source are kept as None, so they are not
+        # searched again until the family expires.
+        self._families: dict[str, tuple[float, dict[str, KernelMeta | None]]] = {}
+        self._failed: dict[str, float] = {}
+        self._inflight: dict[str, asyncio.Task[dict[str, KernelMeta | None] | None]] = {}
+
+    @staticmethod
+    def family(model: str) -> str:
+        return model[: config.kernel_family_length]
+
+    async def lookup(self, model: str) -> KernelMeta | None:
+        family = self.family(model)
+        index = await self.get_family(family)
+        if index is None:
+            # The family search failed, searching each model would only
+            # multiply the failing requests.
+            return None
+
+        if model not in index:
+            # The family search only covers its first results page, so a large
+            # family can leave models out; search for those on their own.
+            metrics.inc("kernel_index_total", result="fallback")
+            found = await self._search_model(model)
+            if found is None:
+                return None
+            index.update((key, kernel) for key, kernel in found.items() if key.startswith(family))
+            index.setdefault(model, None)
+
+        kernel = index[model]
+        return replace(kernel) if kernel else None
+
+    async def get_family(self, family: str) -> dict[str, KernelMeta | None] | None:
+        now = time.monotonic()
+        cached = self._families.get(family)
+        if cached and now - cached[0] < config.kernel_search_ttl:
+            metrics.inc("kernel_index_total", result="hit")
+            return cached[1]
+
+        failed_at = self._failed.get(family)
+        if failed_at is not None and now - failed_at < FAILED_SEARCH_BACKOFF:
+            metrics.inc("kernel_index_total", result="failed")
+            return None
+
+        task = self._inflight.get(family)
+        if task is None:
+            metrics.inc("kernel_index_total", result="miss")
+            task = self._inflight[family] = asyncio.create_task(self._search(family))
+            task.add_done_callback(lambda _: self._inflight.pop(family, None))
+        else:
+            metrics.inc("kernel_index_total", result="shared")
+        return await asyncio.shield(task)
+
+    async def _search(self, family: str) -> dict[str, KernelMeta | None] | None:
+        try:
+            kernel_search = await KernelClient().search(family)
+            with metrics.timer("parse_duration_seconds", page="kernels"):
+                index: dict[str, KernelMeta | None] = dict(parse_kernel_index(kernel_search))
+        except (KeyboardInterrupt, CancelledError):
+            raise
+        except Exception:
+            log.exception("[SamsungKernelInfo] - Failed to search kernel family!", family=family)
+            self._failed[family] = time.monotonic()
+            return None
+
+        self._failed.pop(family, None)
+        self._families[family] = (time.monotonic(), index)
+        log.debug("[SamsungKernelInfo] - Indexed kernel family.", family=family, models=len(index))
+        return index
+
+    @staticmethod
+    async def _search_model(model: str) -> dict[str, KernelMeta] | None:
+        try:
+            kernel_search = await KernelClient().search(model)
+            with metrics.timer("parse_duration_seconds", page="kernels"):
+                return parse_kernel_index(kernel_search)
+        except (KeyboardInterrupt, CancelledError):
+            raise
+        except Exception:
+            log.exception("[SamsungKernelInfo] - Failed to search kernel model!", model=model)
+            return None
+
+    def purge(self) -> None:
+        now = time.monotonic()
+        for family, (fetched_at, _) in list(self._families.items()):
+            if now - fetched_at >= config.kernel_search_ttl:
+                del self._families[family]
+        for family, failed_at in list(self._failed.items()):
+            if now - failed_at >= FAILED_SEARCH_BACKOFF:
+                del self._failed[family]
+
+
+kernel_index = KernelIndex()
@@ -0,0 +1,139 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
+
+import asyncio
+import functools
+import os
+import sys
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+from typing import Any, NoReturn
+
+import orjson
+from aiofile import async_open
+
+from sambot.config import config
+from sambot.utils.logging import log, stop_logging
+from sambot.utils.metrics import export_metrics, metrics
+
+CANCEL_GRACE = 10.0
+
+
+class Lifecycle:
+    def __init__(self, checkpoint_file: Path | None = None) -> None:
+        self.checkpoint_file = checkpoint_file or config.checkpoint_file
+        self.jobs: dict[asyncio.Task, str] = {}
+        self.cleanups: list[Callable[[], Awaitable[Any]]] = []
+        self.stopping = False
+        self._shutdown: asyncio.Task | None = None
+        # Jobs checkpoint at the same moment during a drain, and each one
+        # rewrites the whole file.
+        self._checkpoint_lock = asyncio.Lock()
+
+    @property
+    def running(self) -> list[str]:
+        return sorted(self.jobs.values())
+
+    def tracked(
+        self, name: str
+    ) -> Callable[[Callable[..., Awaitable[Any]]], Callable[..., Awaitable[Any]]]:
+        def decorator(func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+            @functools.wraps(func)
+            async def wrapper(*args: Any, **kwargs: Any) -> Any:
+                if self.stopping:
+                    log.warn("[Lifecycle] - Refusing to start job while shutting down.", job=name)
+                    return None
+
+                task = asyncio.current_task()
+                assert task is not None
+                self.jobs[task] = name
+                metrics.set("lifecycle_jobs_running", len(self.jobs))
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    self.jobs.pop(task, None)
+                    metrics.set("lifecycle_jobs_running", len(self.jobs))
+
+            return wrapper
+
+        return decorator
+
+    def on_cleanup(self, callback: Callable[[], Awaitable[Any]]) -> None:
+        self.cleanups.append(callback)
+
+    async def checkpoint(self, job: str, state: dict[str, Any]) -> None:
+        async with self._checkpoint_lock:
+            checkpoints = await self._read()
+            checkpoints[job] = state
+            self.checkpoint_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.checkpoint_file.with_suffix(f"{self.checkpoint_file.suffix}.tmp")
+            async with async_open(tmp_path, "wb") as file:
+                await file.write(orjson.dumps(checkpoints))
+            tmp_path.replace(self.checkpoint_file)
+        metrics.inc("lifecycle_checkpoints_total", job=job)
+        log.info("[Lifecycle] - Saved checkpoint.", job=job)
+
+    async def load_checkpoints(self) -> dict[str, dict[str, Any]]:
+        async with self._checkpoint_lock:
+            checkpoints = await self._read()
+            self.checkpoint_file.unlink(missing_ok=True)
+        return checkpoints
+
+    async def _read(self) -> dict[str, dict[str, Any]]:
+        if not self.checkpoint_file.exists():
+            return {}
+        async with async_open(self.checkpoint_file, "rb") as file:
+            data = await file.read()
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            log.exception("[Lifecycle] - Ignoring corrupt checkpoint file!")
+            return {}
+
+    async def shutdown(self, grace: float | None = None) -> None:
+        # Every caller waits on the same drain, so running it from /reboot and
+        # again from the dispatcher shutdown hook is safe.
+        if self._shutdown is None:
+            self._shutdown = asyncio.create_task(
+                self._drain(config.shutdown_grace if grace is None else grace)
+            )
+        await asyncio.shield(self._shutdown)
+
+    async def _drain(self, grace: float) -> None:
+        self.stopping = True
+        if self.jobs:
+            log.info("[Lifecycle] - Waiting for running jobs.", jobs=self.running, grace=grace)
+            _, pending = await asyncio.wait(set(self.jobs), timeout=grace)
+            if pending:
+                # Jobs checkpoint their unfinished units when cancelled too.
+                log.warn(
+                    "[Lifecycle] - Cancelling jobs past the deadline.",
+                    jobs=[self.jobs.get(task) for task in pending],
+                )
+                for task in pending:
+                    task.cancel()
+                # Give them a moment to checkpoint, but never hang on a job
+                # that does not stop when cancelled.
+                _, stuck = await asyncio.wait(pending, timeout=CANCEL_GRACE)
+                if stuck:
+                    log.error(
+                        "[Lifecycle] - Jobs ignored cancellation!",
+                        jobs=[self.jobs.get(task) for task in stuck],
+                    )
+
+        for cleanup in self.cleanups:
+            try:
+                await cleanup()
+            except Exception:
+                log.exception("[Lifecycle] - Cleanup failed!", cleanup=repr(cleanup))
+        await export_metrics()
+        log.info("[Lifecycle] - Shutdown complete.")
+
+    async def restart(self, grace: float | None = None) -> NoReturn:
+        await self.shutdown(grace)
+        log.info("[Lifecycle] - Restarting.")
+        stop_logging()
+        os.execv(sys.executable, [sys.executable, "-m", "sambot"])
+
+
+lifecycle = Lifecycle()
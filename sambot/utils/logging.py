@@ -1,27 +1,102 @@
 # SPDX-License-Identifier: BSD-3-Clause
 # Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
 
+import atexit
+import queue
+import random
 import sys
+from typing import Any, TextIO
 
+import orjson
 import picologging as logging
 import structlog
+from picologging.handlers import QueueHandler, QueueListener
+
+from sambot.config import config
 
 level = logging.DEBUG if "--debug" in sys.argv else logging.INFO
 
-structlog.configure(
-    cache_logger_on_first_use=True,
-    processors=[
+SAMPLED_METHODS = frozenset({"debug", "info"})
+
+_listener: QueueListener | None = None
+
+
+def sample_events(_: Any, method_name: str, event_dict: dict) -> dict:
+    # Per-model and per-region events pass sampled=True; warnings and errors
+    # are always kept.
+    if not event_dict.pop("sampled", False) or method_name not in SAMPLED_METHODS:
+        return event_dict
+    if random.random() < config.log_sample_rate:
+        return event_dict
+    raise structlog.DropEvent
+
+
+def dumps(obj: Any, **_: Any) -> str:
+    return orjson.dumps(obj, default=str).decode()
+
+
+def build_processors(log_format: str) -> list:
+    processors = [
+        structlog.stdlib.filter_by_level,
         structlog.contextvars.merge_contextvars,
+        sample_events,
         structlog.processors.add_log_level,
-        structlog.processors.TimeStamper(fmt="%d-%m-%Y %H:%M.%S", utc=False),
-        structlog.dev.ConsoleRenderer(),
-    ],
-)
-
-logging.basicConfig(
-    format="%(message)s",
-    stream=sys.stdout,
-    level=level,
-)
+        structlog.stdlib.PositionalArgumentsFormatter(),
+    ]
+    if log_format == "json":
+        processors.extend((
+            structlog.processors.TimeStamper(fmt="iso", utc=True),
+            structlog.processors.ExceptionRenderer(
+                structlog.tracebacks.ExceptionDictTransformer(show_locals=False)
+            ),
+            structlog.processors.JSONRenderer(serializer=dumps),
+        ))
+    else:
+        processors.extend((
+            structlog.processors.TimeStamper(fmt="%d-%m-%Y %H:%M.%S", utc=False),
+            structlog.dev.ConsoleRenderer(),
+        ))
+    return processors
+
+
+def stop_logging() -> None:
+    global _listener  # noqa: PLW0603
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def configure_logging(
+    log_format: str = config.log_format,
+    use_queue: bool = config.log_queue,
+    stream: TextIO = sys.stdout,
+) -> None:
+    global _listener  # noqa: PLW0603
+    stop_logging()
+
+    structlog.configure(
+        cache_logger_on_first_use=True,
+        processors=build_processors(log_format),
+    )
+
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    if use_queue:
+        # Events are still rendered by the caller, but the write to the stream
+        # happens on the listener thread instead of blocking the event loop.
+        records: queue.Queue = queue.Queue(-1)
+        _listener = QueueListener(records, handler)
+        _listener.start()
+        handler = QueueHandler(records)
+
+    root = logging.getLogger()
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+
+atexit.register(stop_logging)
+configure_logging()
 
 log = structlog.wrap_logger(logging.getLogger("korone"))
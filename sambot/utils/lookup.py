@@ -0,0 +1,178 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
+
+import asyncio
+import inspect
+import sys
+import time
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+
+from sambot.config import config
+from sambot.database import Devices, Firmwares
+from sambot.utils.firmware import FirmwareMeta
+from sambot.utils.logging import log
+from sambot.utils.metrics import metrics
+
+EXACT, PREFIX, SUBSTRING = range(3)
+
+
+def normalize(text: str) -> str:
+    return "".join(char for char in text.casefold() if char.isalnum())
+
+
+def trigrams(key: str) -> set[str]:
+    return {key[i : i + 3] for i in range(len(key) - 2)}
+
+
+@dataclass(slots=True)
+class DeviceEntry:
+    device_id: int
+    name: str
+    url: str
+    img_url: str
+    description: str
+    models: tuple[str, ...]
+
+
+class DeviceIndex:
+    def __init__(self, devices_db: Devices | None = None, firmwares_db: Firmwares | None = None):
+        self.devices_db = devices_db or Devices()
+        self.firmwares_db = firmwares_db or Firmwares()
+        self.devices: dict[int, DeviceEntry] = {}
+        self.by_model: dict[str, int] = {}
+        self.firmwares: dict[str, dict[str, FirmwareMeta]] = {}
+        # Sorted (key, device id) pairs for prefix search, and trigram postings
+        # over the same keys for substring search.
+        self.keys: list[tuple[str, int]] = []
+        self.postings: dict[str, set[int]] = {}
+        self.rendered: OrderedDict[tuple[str, str], str] = OrderedDict()
+        self.built_at = 0.0
+        self._lock = asyncio.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.built_at > 0
+
+    async def refresh(self) -> None:
+        async with self._lock:
+            start = time.perf_counter()
+            rows = await self.devices_db.get_all_devices()
+            models = await self.devices_db.get_models_by_device()
+            latest = await self.firmwares_db.get_all_latest()
+
+            devices: dict[int, DeviceEntry] = {}
+            by_model: dict[str, int] = {}
+            keys: list[tuple[str, int]] = []
+            postings: dict[str, set[int]] = defaultdict(set)
+            for row in rows:
+                device_id = row["DeviceID"]
+                device_models = tuple(sorted(models.get(device_id, ())))
+                devices[device_id] = DeviceEntry(
+                    device_id,
+                    row["Name"],
+                    row["URL"],
+                    row["ImgURL"],
+                    row["ShortDescription"],
+                    device_models,
+                )
+                name_key = normalize(row["Name"])
+                names = {name_key, name_key.removeprefix("samsung")}
+                for key in names | set(map(normalize, device_models)):
+                    keys.append((key, device_id))
+                    for trigram in trigrams(key):
+                        postings[trigram].add(device_id)
+                for model in device_models:
+                    by_model[normalize(model)] = device_id
+
+            firmwares: dict[str, dict[str, FirmwareMeta]] = defaultdict(dict)
+            for row in latest:
+                info = FirmwareMeta.from_row(row)
+                info.region = sys.intern(info.region)
+                info.os_version = sys.intern(info.os_version)
+                firmwares[normalize(info.model)][info.region] = info
+
+            keys.sort()
+            self.devices, self.by_model, self.keys = devices, by_model, keys
+            self.postings, self.firmwares = dict(postings), dict(firmwares)
+            self.rendered.clear()
+            self.built_at = time.time()
+
+        elapsed = time.perf_counter() - start
+        metrics.set("lookup_index_devices", len(devices))
+        metrics.set("lookup_index_keys", len(keys))
+        metrics.observe("lookup_index_build_seconds", elapsed)
+        log.info(
+            "[DeviceIndex] - Index refreshed.",
+            devices=len(devices),
+            keys=len(keys),
+            firmwares=len(latest),
+            seconds=round(elapsed, 3),
+        )
+
+    def _rank(self, query: str) -> dict[int, int]:
+        ranks: dict[int, int] = {}
+        position = bisect_left(self.keys, (query, -1))
+        while position < len(self.keys) and self.keys[position][0].startswith(query):
+            key, device_id = self.keys[position]
+            rank = EXACT if key == query else PREFIX
+            ranks[device_id] = min(rank, ranks.get(device_id, rank))
+            position += 1
+
+        if len(query) < 3:
+            return ranks
+
+        postings = [self.postings.get(trigram, set()) for trigram in trigrams(query)]
+        candidates = set.intersection(*sorted(postings, key=len))
+        for device_id in candidates - ranks.keys():
+            entry = self.devices[device_id]
+            if query in normalize(entry.name) or any(
+                query in normalize(model) for model in entry.models
+            ):
+                ranks[device_id] = SUBSTRING
+        return ranks
+
+    def search(self, query: str, limit: int = 10) -> list[DeviceEntry]:
+        if not (key := normalize(query)):
+            return []
+
+        with metrics.timer("lookup_duration_seconds", op="search"):
+            ranks = self._rank(key)
+            if not ranks and key.startswith("samsung") and key != "samsung":
+                ranks = self._rank(key.removeprefix("samsung"))
+            ordered = sorted(
+                ranks,
+                key=lambda device_id: (
+                    ranks[device_id],
+                    len(self.devices[device_id].name),
+                    self.devices[device_id].name,
+                ),
+            )
+        return [self.devices[device_id] for device_id in ordered[:limit]]
+
+    def device_by_model(self, model: str) -> DeviceEntry | None:
+        device_id = self.by_model.get(normalize(model))
+        return self.devices.get(device_id) if device_id is not None else None
+
+    def firmwares_for(self, model: str) -> dict[str, FirmwareMeta]:
+        return self.firmwares.get(normalize(model), {})
+
+    async def render(self, kind: str, key: str, build: Callable[[], str | Awaitable[str]]) -> str:
+        cache_key = (kind, key)
+        if (text := self.rendered.get(cache_key)) is not None:
+            self.rendered.move_to_end(cache_key)
+            metrics.inc("lookup_cache_total", result="hit")
+            return text
+
+        metrics.inc("lookup_cache_total", result="miss")
+        rendered = build()
+        text = await rendered if inspect.isawaitable(rendered) else rendered
+        self.rendered[cache_key] = text
+        if len(self.rendered) > config.lookup_cache_size:
+            self.rendered.popitem(last=False)
+        return text
+
+
+device_index = DeviceIndex()
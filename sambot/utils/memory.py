@@ -0,0 +1,73 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
+
+import asyncio
+import ctypes
+import ctypes.util
+import gc
+import os
+import resource
+from pathlib import Path
+
+from sambot.utils.logging import log
+from sambot.utils.metrics import metrics
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+STATM = Path("/proc/self/statm")
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library("c"))
+    _malloc_trim = _libc.malloc_trim
+except (AttributeError, OSError):
+    _malloc_trim = None
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is reported in KiB on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def rss_mb() -> float:
+    try:
+        return int(STATM.read_text().split()[1]) * PAGE_SIZE / 1024 / 1024
+    except (OSError, IndexError, ValueError):
+        return peak_rss_mb()
+
+
+def release_memory() -> None:
+    gc.collect()
+    # Hand freed arenas back to the OS, otherwise RSS never goes down.
+    if _malloc_trim is not None:
+        _malloc_trim(0)
+
+
+async def wait_for_memory(limit_mb: int | None, poll: float = 0.5, max_wait: float = 30) -> None:
+    if not limit_mb or rss_mb() < limit_mb:
+        return
+
+    metrics.inc("memory_throttled_total")
+    # Collect once up front; malloc_trim can take a while on a large heap, so
+    # it runs off the event loop. The loop below only polls RSS.
+    gc.collect()
+    if _malloc_trim is not None:
+        await asyncio.to_thread(_malloc_trim, 0)
+
+    waited = 0.0
+    while (rss := rss_mb()) >= limit_mb and waited < max_wait:
+        log.debug("[Memory] - Waiting for memory to be released.", rss=rss, limit=limit_mb)
+        await asyncio.sleep(poll)
+        waited += poll
+
+
+def report_memory(job: str, start_rss: float) -> None:
+    rss, peak = rss_mb(), peak_rss_mb()
+    metrics.set("process_rss_megabytes", rss)
+    metrics.set("process_peak_rss_megabytes", peak)
+    log.info(
+        "[Memory] - RSS report.",
+        job=job,
+        start=round(start_rss, 1),
+        current=round(rss, 1),
+        peak=round(peak, 1),
+        growth=round(rss - start_rss, 1),
+    )
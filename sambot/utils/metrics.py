@@ -0,0 +1,157 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
+
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from aiofile import async_open
+
+from sambot.config import config
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Whole syncs run for minutes to hours.
+SYNC_BUCKETS = (10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1200.0, 1800.0, 3600.0, 7200.0, 14400.0)
+BUCKETS = {"sync_duration_seconds": SYNC_BUCKETS}
+
+Labels = tuple[tuple[str, str], ...]
+
+
+@dataclass(slots=True)
+class Histogram:
+    buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    counts: list[int] = field(default_factory=list)
+    total: float = 0.0
+    count: int = 0
+
+    def __post_init__(self) -> None:
+        if not self.counts:
+            self.counts = [0] * (len(self.buckets) + 1)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    @property
+    def average(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts, strict=False):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+
+class MetricsRegistry:
+    def __init__(self, prefix: str = "sambot") -> None:
+        self.prefix = prefix
+        self.started_at = time.time()
+        self.counters: dict[str, dict[Labels, float]] = defaultdict(lambda: defaultdict(float))
+        self.gauges: dict[str, dict[Labels, float]] = defaultdict(dict)
+        self.histograms: dict[str, dict[Labels, Histogram]] = defaultdict(dict)
+
+    @staticmethod
+    def _labels(labels: dict[str, object]) -> Labels:
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels: object) -> None:
+        self.counters[name][self._labels(labels)] += value
+
+    def set(self, name: str, value: float, **labels: object) -> None:
+        self.gauges[name][self._labels(labels)] = value
+
+    def observe(self, name: str, value: float, **labels: object) -> None:
+        key = self._labels(labels)
+        histogram = self.histograms[name].get(key)
+        if histogram is None:
+            buckets = BUCKETS.get(name, DEFAULT_BUCKETS)
+            histogram = self.histograms[name][key] = Histogram(buckets)
+        histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels: object) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def get_counter(self, name: str, **labels: object) -> float:
+        if labels:
+            return self.counters[name].get(self._labels(labels), 0)
+        return sum(self.counters[name].values())
+
+    def reset(self) -> None:
+        self.started_at = time.time()
+        self.counters.clear()
+        self.gauges.clear()
+        self.histograms.clear()
+
+    @staticmethod
+    def _escape(value: str) -> str:
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    @classmethod
+    def _format_labels(cls, labels: Labels, extra: Labels = ()) -> str:
+        pairs = labels + extra
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{key}="{cls._escape(value)}"' for key, value in pairs) + "}"
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for kind, metric_map in (("counter", self.counters), ("gauge", self.gauges)):
+            for name, series in sorted(metric_map.items()):
+                metric = f"{self.prefix}_{name}"
+                lines.append(f"# TYPE {metric} {kind}")
+                lines.extend(
+                    f"{metric}{self._format_labels(labels)} {value}"
+                    for labels, value in series.items()
+                )
+
+        for name, series in sorted(self.histograms.items()):
+            metric = f"{self.prefix}_{name}"
+            lines.append(f"# TYPE {metric} histogram")
+            for labels, histogram in series.items():
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts, strict=False):
+                    cumulative += count
+                    le = self._format_labels(labels, (("le", str(bound)),))
+                    lines.append(f"{metric}_bucket{le} {cumulative}")
+                le = self._format_labels(labels, (("le", "+Inf"),))
+                lines.extend((
+                    f"{metric}_bucket{le} {histogram.count}",
+                    f"{metric}_sum{self._format_labels(labels)} {histogram.total}",
+                    f"{metric}_count{self._format_labels(labels)} {histogram.count}",
+                ))
+
+        lines.extend((
+            f"# TYPE {self.prefix}_uptime_seconds gauge",
+            f"{self.prefix}_uptime_seconds {time.time() - self.started_at}",
+        ))
+        return "\n".join(lines) + "\n"
+
+    async def write_textfile(self, path: Path) -> None:
+        tmp_path = path.with_suffix(f"{path.suffix}.tmp")
+        async with async_open(tmp_path, "w") as file:
+            await file.write(self.render_prometheus())
+        tmp_path.replace(path)
+
+
+metrics = MetricsRegistry()
+
+
+async def export_metrics() -> None:
+    if config.metrics_file:
+        await metrics.write_textfile(config.metrics_file)
@@ -2,141 +2,287 @@
 # Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
 
 import asyncio
+import time
+from asyncio import CancelledError
+from collections import OrderedDict, defaultdict, deque
 from datetime import UTC, datetime
+from functools import partial
 
 from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from sambot import bot
 from sambot.config import config
-from sambot.database import Devices, Firmwares
+from sambot.database import Devices, Firmwares, Kernels, SyncQueue
+from sambot.database.queue import CLAIMED, PENDING
 from sambot.utils.channel_logging import channel_log
-from sambot.utils.firmware import fetch_latest_firmware
+from sambot.utils.firmware import FirmwareMeta, RegionGroups
+from sambot.utils.kernel import OSS_SEARCH_URL, KernelMeta, kernel_index
+from sambot.utils.lifecycle import lifecycle
 from sambot.utils.logging import log
+from sambot.utils.lookup import device_index
+from sambot.utils.metrics import export_metrics, metrics
+from sambot.utils.pipeline import stage
+from sambot.utils.tracing import tracer
 
 fw_queue = asyncio.Queue()
+# Held for a whole firmware sync, so cron runs never stack on a slow one.
+firmware_sync_lock = asyncio.Lock()
 
+CHANGELOG_CACHE_SIZE = 64
+changelog_cache: OrderedDict[str, str] = OrderedDict()
 
-async def process_firmware(model: str):
-    if not config.fw_channel:
-        log.warn("[FirmwaresSync] - Firmware channel not set!")
-        return
 
-    firmwares_db = Firmwares()
-
-    model_regions = await Devices().get_regions_by_model(model)
+async def process_firmware(
+    model: str, model_regions: list[str] | None, current_pda: str | None, groups: RegionGroups
+):
     if not model_regions:
         log.warn("[FirmwaresSync] - No regions found for model %s!", model)
         return
 
-    await process_regions(model, model_regions, firmwares_db)
+    try:
+        await process_regions(model, model_regions, current_pda, groups)
+    finally:
+        groups.forget(model)
 
 
-async def process_regions(model: str, model_regions: list | str, firmwares_db: Firmwares):
+async def process_regions(
+    model: str, model_regions: list[str], current_pda: str | None, groups: RegionGroups
+):
+    firmwares_db = groups.firmwares_db
     pdas = []
     for region in model_regions:
-        info = await fetch_latest_firmware(model, region)
+        history = await groups.fetch_history(model, region)
 
-        if not info:
+        if not history:
             log.warn(
                 "[FirmwaresSync] - No firmware found for model %s in region %s!",
                 model,
                 region,
             )
         else:
-            log.info(
-                "[FirmwaresSync] - Found firmware for model %s in region %s: PDA %s",
-                model,
-                region,
-                info.pda,
-            )
+            await firmwares_db.add_history(history)
+            pdas.append(history[0])
 
-            pdas.append(info)
-
-            pda = await firmwares_db.get_pda(model)
-            if pda and info.is_newer_than(str(pda)):
-                keyboard = InlineKeyboardBuilder()
-                keyboard.button(text="Download ⬇️", url=info.download_url())
-
-                build_date = info.build_date.strftime("%Y-%m-%d")
-                securitypatch = info.securitypatch.strftime("%Y-%m-%d")
-                text = (
-                    "<b>New firmware update available!</b>\n\n"
-                    f"<b>Device:</b> <code>{info.name}</code>\n"
-                    f"<b>Model:</b> <code>{info.model}</code>\n"
-                    f"<b>Android Version:</b> <code>{info.os_version}</code>\n"
-                    f"<b>Build Number:</b> <code>{info.pda}</code>\n"
-                    f"<b>Release Date:</b> <code>{build_date}</code>\n"
-                    f"<b>Security Patch Level:</b> <code>{securitypatch}</code>\n\n"
-                    f"<b>Changelog:</b>\n{info.changelog}"
-                )
+    await process_results(model, pdas, current_pda, firmwares_db)
 
-                await asyncio.sleep(0.5)
-                try:
-                    await bot.send_message(
-                        chat_id=config.fw_channel,  # type: ignore
-                        text=text,
-                        reply_markup=keyboard.as_markup(),
-                    )
-                except TelegramRetryAfter as e:
-                    log.warn(
-                        "[FirmwaresSync] - We are being rate limited! Waiting to retry...",
-                        wait_time=e.retry_after,
-                    )
-                    await asyncio.sleep(e.retry_after)
-                    await bot.send_message(
-                        chat_id=config.fw_channel,  # type: ignore
-                        text=text,
-                        reply_markup=keyboard.as_markup(),
-                    )
-                except TelegramBadRequest as e:
-                    if "message is too long" in str(e):
-                        await bot.send_message(
-                            chat_id=config.fw_channel,  # type: ignore
-                            text=f"{text[:4090]}[...]",
-                            reply_markup=keyboard.as_markup(),
-                        )
-                    else:
-                        log.error(
-                            "[FirmwaresSync] - Telegram Bad Request error!",
-                            exc_info=True,
-                        )
-                        await channel_log(
-                            text=(
-                                "<b>Alert!</b> Firmware sync have an error!\n"
-                                f"<b>Error:</b> <code>{e.message}</code>"
-                            )
-                        )
-                finally:
-                    try:
-                        await channel_log(
-                            text=(
-                                "<b>New firmware detected for "
-                                f"{info.name}</b> (<code>{info.model}</code>)"
-                            )
-                        )
-                    except TelegramRetryAfter as e:
-                        log.warn(
-                            "[FirmwaresSync] - We are being rate limited! Waiting to retry...",
-                            wait_time=e.retry_after,
-                        )
-                        await asyncio.sleep(e.retry_after)
+
+async def process_results(
+    model: str, pdas: list[FirmwareMeta], current_pda: str | None, firmwares_db: Firmwares
+):
+    for info in pdas:
+        log.info(
+            "[FirmwaresSync] - Found firmware for model %s in region %s: PDA %s",
+            model,
+            info.region,
+            info.pda,
+            sampled=True,
+        )
+
+        if current_pda and info.is_newer_than(current_pda):
+            await send_notification(info)
 
     if pdas:
-        pda = await firmwares_db.get_pda(model)
-        latest_pda_info = max(pdas, key=lambda info: info.is_newer_than(str(pda)))
+        latest_pda_info = max(pdas, key=lambda info: info.is_newer_than(str(current_pda)))
         await firmwares_db.set_pda(model, latest_pda_info.pda)
 
 
-async def sync_firmwares():
+async def render_changelog(info: FirmwareMeta) -> str:
+    digest = info.changelog_hash
+    if digest is None:
+        return "<b>Changelog:</b>\n"
+
+    if (rendered := changelog_cache.get(digest)) is not None:
+        changelog_cache.move_to_end(digest)
+        metrics.inc("changelog_cache_total", result="hit")
+        return rendered
+
+    metrics.inc("changelog_cache_total", result="miss")
+    changelog = info.changelog
+    if changelog is None:
+        changelog = await Firmwares().get_changelog(digest) or ""
+
+    rendered = f"<b>Changelog:</b>\n{changelog}"
+    changelog_cache[digest] = rendered
+    if len(changelog_cache) > CHANGELOG_CACHE_SIZE:
+        changelog_cache.popitem(last=False)
+    return rendered
+
+
+@tracer.traced("telegram.notify")
+async def send_notification(info: FirmwareMeta):
+    keyboard = InlineKeyboardBuilder()
+    keyboard.button(text="Download ⬇️", url=info.download_url())
+
+    build_date = info.build_date.strftime("%Y-%m-%d")
+    securitypatch = info.securitypatch.strftime("%Y-%m-%d")
+    text = (
+        "<b>New firmware update available!</b>\n\n"
+        f"<b>Device:</b> <code>{info.name}</code>\n"
+        f"<b>Model:</b> <code>{info.model}</code>\n"
+        f"<b>Android Version:</b> <code>{info.os_version}</code>\n"
+        f"<b>Build Number:</b> <code>{info.pda}</code>\n"
+        f"<b>Release Date:</b> <code>{build_date}</code>\n"
+        f"<b>Security Patch Level:</b> <code>{securitypatch}</code>\n\n"
+        f"{await render_changelog(info)}"
+    )
+
+    await asyncio.sleep(0.5)
+    try:
+        await bot.send_message(
+            chat_id=config.fw_channel,  # type: ignore
+            text=text,
+            reply_markup=keyboard.as_markup(),
+        )
+        metrics.inc("notifications_sent_total", kind="firmware")
+    except TelegramRetryAfter as e:
+        metrics.inc("telegram_rate_limited_total")
+        log.warn(
+            "[FirmwaresSync] - We are being rate limited! Waiting to retry...",
+            wait_time=e.retry_after,
+        )
+        await asyncio.sleep(e.retry_after)
+        await bot.send_message(
+            chat_id=config.fw_channel,  # type: ignore
+            text=text,
+            reply_markup=keyboard.as_markup(),
+        )
+        metrics.inc("notifications_sent_total", kind="firmware")
+    except TelegramBadRequest as e:
+        if "message is too long" in str(e):
+            await bot.send_message(
+                chat_id=config.fw_channel,  # type: ignore
+                text=f"{text[:4090]}[...]",
+                reply_markup=keyboard.as_markup(),
+            )
+            metrics.inc("notifications_sent_total", kind="firmware")
+        else:
+            metrics.inc("notifications_failed_total", kind="firmware")
+            log.error(
+                "[FirmwaresSync] - Telegram Bad Request error!",
+                exc_info=True,
+            )
+            await channel_log(
+                text=(
+                    "<b>Alert!</b> Firmware sync have an error!\n"
+                    f"<b>Error:</b> <code>{e.message}</code>"
+                )
+            )
+    finally:
+        try:
+            await channel_log(
+                text=f"<b>New firmware detected for {info.name}</b> (<code>{info.model}</code>)"
+            )
+        except TelegramRetryAfter as e:
+            metrics.inc("telegram_rate_limited_total")
+            log.warn(
+                "[FirmwaresSync] - We are being rate limited! Waiting to retry...",
+                wait_time=e.retry_after,
+            )
+            await asyncio.sleep(e.retry_after)
+
+
+async def enqueue_run(queue: SyncQueue, all_models: list[str]) -> str:
+    run_id = datetime.now(tz=UTC).strftime("%Y%m%d%H%M%S")
+
+    regions_by_model = await Devices().get_regions_by_models(all_models)
+    jobs = []
+    for model in all_models:
+        model_regions = regions_by_model.get(model)
+        if not model_regions:
+            log.warn("[FirmwaresSync] - No regions found for model %s!", model)
+            continue
+        jobs.extend((model, region) for region in model_regions)
+
+    await queue.enqueue(run_id, jobs)
+    log.info("[FirmwaresSync] - Queued jobs for sync workers.", run=run_id, jobs=len(jobs))
+    return run_id
+
+
+async def wait_for_workers(queue: SyncQueue, run_id: str) -> dict[str, int] | None:
+    start = time.monotonic()
+    while True:
+        if lifecycle.stopping:
+            # Jobs live in the queue database and workers keep claiming them,
+            # so only the run id is needed to collect the results later.
+            await lifecycle.checkpoint("firmwares", {"run": run_id})
+            log.info("[FirmwaresSync] - Firmware sync interrupted, will resume after restart.")
+            return None
+
+        await queue.expire(config.worker_max_attempts)
+        counts = await queue.get_counts(run_id)
+        remaining = counts.get(PENDING, 0) + counts.get(CLAIMED, 0)
+        metrics.set("firmware_queue_depth", remaining)
+        if not remaining:
+            return counts
+
+        elapsed = time.monotonic() - start
+        if counts.get(PENDING, 0) == sum(counts.values()) and elapsed > config.worker_claim_grace:
+            log.error("[FirmwaresSync] - No sync worker claimed a job!", run=run_id)
+            await channel_log(
+                text="<b>Alert!</b> Firmware sync aborted because no sync worker is running!"
+            )
+            await queue.purge(run_id)
+            return None
+        if elapsed > config.worker_run_timeout:
+            log.warn("[FirmwaresSync] - Workers did not finish in time!", remaining=remaining)
+            return counts
+        await asyncio.sleep(10)
+
+
+async def sync_with_workers(all_models: list[str], run_id: str | None = None) -> bool:
+    if not config.fw_channel:
+        log.warn("[FirmwaresSync] - Firmware channel not set!")
+        return False
+
+    queue = SyncQueue()
+    if run_id is None:
+        run_id = await enqueue_run(queue, all_models)
+    else:
+        log.info("[FirmwaresSync] - Resuming sync workers run.", run=run_id)
+
+    counts = await wait_for_workers(queue, run_id)
+    if counts is None:
+        return False
+
+    log.info("[FirmwaresSync] - Workers finished.", run=run_id, **counts)
+
+    firmwares_db = Firmwares()
+    done_jobs = await queue.get_jobs(run_id) or []
+    done_models = [model for model, _ in done_jobs]
+    latest = await firmwares_db.get_latest_by_models(done_models)
+    current_pdas = await firmwares_db.get_pdas(done_models)
+
+    results: dict[str, list[FirmwareMeta]] = defaultdict(list)
+    for model, region in done_jobs:
+        row = latest.get((model, region))
+        if row:
+            results[model].append(FirmwareMeta.from_row(row))
+
+    for model, pdas in results.items():
+        await process_results(model, pdas, current_pdas.get(model), firmwares_db)
+        metrics.inc("models_processed_total", job="firmwares")
+
+    await queue.purge(run_id)
+    return True
+
+
+@lifecycle.tracked("firmwares")
+@tracer.traced("sync", name="sync_firmwares", transaction=True)
+async def sync_firmwares(models: list[str] | None = None, run_id: str | None = None):
     log.info("[FirmwaresSync] - Starting firmware sync...")
-    if not fw_queue.empty():
-        log.warn("[FirmwaresSync] - Queue is not empty, aborting sync!")
+    if firmware_sync_lock.locked() or not fw_queue.empty():
+        log.warn("[FirmwaresSync] - Another sync is still running, aborting sync!")
         await channel_log(
-            text="<b>Alert!</b> Firmware sync aborted because the queue is not empty!"
+            text="<b>Alert!</b> Firmware sync aborted because another sync is still running!"
         )
         return
 
+    async with firmware_sync_lock:
+        await _sync_firmwares(models, run_id)
+
+
+async def _sync_firmwares(models: list[str] | None, run_id: str | None) -> None:
     await channel_log(
         text=(
             "<b>Starting firmwares sync...</b>\n\n"
@@ -144,28 +290,83 @@ async def sync_firmwares():
         )
     )
 
-    all_models = await Devices().get_all_models()
-    if not all_models:
+    all_models = models if models is not None else await Devices().get_all_models()
+    if not all_models and run_id is None:
         log.warn("[FirmwaresSync] - No models found in database!")
         return
 
+    with metrics.timer("sync_duration_seconds", job="firmwares"):
+        if config.sync_workers or run_id is not None:
+            completed = await sync_with_workers(all_models, run_id)
+        else:
+            completed = await sync_locally(all_models)
+
+    if completed:
+        await finish_sync()
+
+
+async def sync_locally(all_models: list[str]) -> bool:
+    if not config.fw_channel:
+        log.warn("[FirmwaresSync] - Firmware channel not set!")
+        return False
+
+    firmwares_db = Firmwares()
+    regions_by_model = await Devices().get_regions_by_models(all_models)
+    current_pdas = await firmwares_db.get_pdas(all_models)
+    groups = RegionGroups(firmwares_db)
+    await groups.preload(all_models)
+
     for model in all_models:
-        log.debug("[FirmwaresSync] - Adding model %s to the queue.", model)
+        log.debug("[FirmwaresSync] - Adding model %s to the queue.", model, sampled=True)
         await fw_queue.put(model)
+    metrics.set("firmware_queue_depth", fw_queue.qsize())
+
+    in_flight: set[str] = set()
 
     async def task():
-        while not fw_queue.empty():
+        while not fw_queue.empty() and not lifecycle.stopping:
             try:
                 model = await asyncio.wait_for(fw_queue.get(), timeout=60)
             except TimeoutError:
                 break
             else:
-                log.info("[FirmwaresSync] - Processing model %s.", model)
-                await process_firmware(model)
+                in_flight.add(model)
+                metrics.set("firmware_queue_depth", fw_queue.qsize())
+                log.info("[FirmwaresSync] - Processing model %s.", model, sampled=True)
+                with metrics.timer("model_sync_duration_seconds", job="firmwares"):
+                    await process_firmware(
+                        model, regions_by_model.get(model), current_pdas.get(model), groups
+                    )
+                in_flight.discard(model)
+                metrics.inc("models_processed_total", job="firmwares")
 
-    async with asyncio.TaskGroup() as tg:
-        for _ in range(10):
-            tg.create_task(task())
+    remaining: list[str] = []
+    try:
+        async with asyncio.TaskGroup() as tg:
+            for _ in range(10):
+                tg.create_task(task())
+    finally:
+        if lifecycle.stopping:
+            remaining = await checkpoint_queue(in_flight)
+    return not remaining
+
+
+async def checkpoint_queue(in_flight: set[str]) -> list[str]:
+    # Models still in flight were cancelled past the shutdown deadline.
+    remaining = list(in_flight)
+    while not fw_queue.empty():
+        remaining.append(fw_queue.get_nowait())
+    metrics.set("firmware_queue_depth", 0)
+    if remaining:
+        await lifecycle.checkpoint("firmwares", {"models": remaining})
+        log.info("[FirmwaresSync] - Firmware sync interrupted, will resume after restart.")
+    return remaining
+
+
+async def finish_sync():
+    metrics.inc("sync_runs_total", job="firmwares")
+    await device_index.refresh()
+    await export_metrics()
 
     await channel_log(
         text=(
@@ -173,3 +374,112 @@ async def sync_firmwares():
             f"<b>Time</b>: <code>{datetime.now(tz=UTC).strftime("%d/%m/%Y - %H:%M:%S")}</code>\n"
         )
     )
+
+
+async def check_kernel(model: str, known: dict, kernels_db: Kernels) -> KernelMeta | None:
+    try:
+        latest = await kernel_index.lookup(model)
+        metrics.inc("models_processed_total", job="kernels")
+        if latest is None or not latest.pda:
+            return None
+
+        stored = known.get(model)
+        if stored is None:
+            # First sighting only records a baseline, like firmwares do.
+            await kernels_db.save_kernel(latest)
+            return None
+
+        if latest.pda != stored["PDA"] and latest.is_newer_than(stored["PDA"]):
+            await kernels_db.save_kernel(latest)
+            return latest
+
+        await kernels_db.mark_checked(model)
+    except (KeyboardInterrupt, CancelledError):
+        raise
+    except Exception:
+        log.exception("[KernelsSync] - Failed to check kernel!", model=model)
+    return None
+
+
+@tracer.traced("telegram.notify")
+async def send_kernel_notification(kernel: KernelMeta):
+    keyboard = InlineKeyboardBuilder()
+    keyboard.button(text="Source ⬇️", url=f"{OSS_SEARCH_URL}{kernel.model}")
+
+    text = (
+        "<b>New kernel source available!</b>\n\n"
+        f"<b>Model:</b> <code>{kernel.model}</code>\n"
+        f"<b>Build Number:</b> <code>{kernel.pda}</code>\n"
+    )
+    if kernel.patch_kernel:
+        text += f"<b>Patch for:</b> <code>{kernel.patch_kernel}</code>\n"
+
+    await asyncio.sleep(0.5)
+    try:
+        await bot.send_message(
+            chat_id=config.fw_channel,  # type: ignore
+            text=text,
+            reply_markup=keyboard.as_markup(),
+        )
+    except TelegramRetryAfter as e:
+        metrics.inc("telegram_rate_limited_total")
+        log.warn(
+            "[KernelsSync] - We are being rate limited! Waiting to retry...",
+            wait_time=e.retry_after,
+        )
+        await asyncio.sleep(e.retry_after)
+        await bot.send_message(
+            chat_id=config.fw_channel,  # type: ignore
+            text=text,
+            reply_markup=keyboard.as_markup(),
+        )
+    except TelegramBadRequest:
+        metrics.inc("notifications_failed_total", kind="kernel")
+        log.error("[KernelsSync] - Telegram Bad Request error!", exc_info=True)
+        return
+    metrics.inc("notifications_sent_total", kind="kernel")
+    await channel_log(text=f"<b>New kernel source detected for</b> <code>{kernel.model}</code>")
+
+
+@lifecycle.tracked("kernels")
+@tracer.traced("sync", name="sync_kernels", transaction=True)
+async def sync_kernels(models: list[str] | None = None):
+    log.info("[KernelsSync] - Starting kernel sync...")
+    if not config.fw_channel:
+        log.warn("[KernelsSync] - Firmware channel not set!")
+        return
+
+    all_models = models if models is not None else await Devices().get_all_models()
+    if not all_models:
+        log.warn("[KernelsSync] - No models found in database!")
+        return
+
+    kernels_db = Kernels()
+    known = await kernels_db.get_kernels(all_models)
+    # Sorted so models of a family are looked up together and share one search.
+    all_models = sorted(all_models)
+    pending = deque(all_models)
+
+    async def source():  # noqa: RUF029
+        while pending and not lifecycle.stopping:
+            yield pending.popleft()
+
+    updates = 0
+    with metrics.timer("sync_duration_seconds", job="kernels"):
+        check = partial(check_kernel, known=known, kernels_db=kernels_db)
+        try:
+            async for kernel in stage(source(), check, config.kernel_sync_concurrency):
+                updates += 1
+                await send_kernel_notification(kernel)
+        finally:
+            if lifecycle.stopping and pending:
+                await lifecycle.checkpoint("kernels", {"models": list(pending)})
+
+    if lifecycle.stopping and pending:
+        log.info("[KernelsSync] - Kernel sync interrupted.", remaining=len(pending))
+        return
+
+    kernel_index.purge()
+    metrics.inc("sync_runs_total", job="kernels")
+    await export_metrics()
+    log.info("[KernelsSync] - Kernel sync finished.", models=len(all_models), updates=updates)
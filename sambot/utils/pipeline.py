@@ -0,0 +1,78 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
+
+import asyncio
+from collections.abc import AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable
+from dataclasses import dataclass
+from typing import Any, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+_DONE = object()
+
+
+@dataclass(slots=True)
+class _Failure:
+    error: BaseException
+
+
+async def iterate(items: Iterable[T]) -> AsyncIterator[T]:  # noqa: RUF029
+    for item in items:
+        yield item
+
+
+async def _feed(
+    source: AsyncIterable[Any], inbox: asyncio.Queue, outbox: asyncio.Queue, workers: int
+) -> None:
+    try:
+        async for item in source:
+            await inbox.put(item)
+    except Exception as error:
+        await outbox.put(_Failure(error))
+    for _ in range(workers):
+        await inbox.put(_DONE)
+
+
+async def _work(
+    func: Callable[[Any], Awaitable[Any]], inbox: asyncio.Queue, outbox: asyncio.Queue
+) -> None:
+    try:
+        while (item := await inbox.get()) is not _DONE:
+            result = await func(item)
+            if result is not None:
+                await outbox.put(result)
+    except Exception as error:
+        await outbox.put(_Failure(error))
+    await outbox.put(_DONE)
+
+
+async def stage(
+    source: AsyncIterable[T],
+    func: Callable[[T], Awaitable[R | None]],
+    workers: int = 1,
+    maxsize: int = 16,
+) -> AsyncIterator[R]:
+    """Run `func` over `source` with `workers` tasks, yielding non-None results.
+
+    Both queues are bounded, so a slow consumer pauses the workers and the
+    workers pause the source instead of buffering the whole stream.
+    """
+    inbox: asyncio.Queue[Any] = asyncio.Queue(maxsize)
+    outbox: asyncio.Queue[Any] = asyncio.Queue(maxsize)
+
+    tasks = [asyncio.create_task(_feed(source, inbox, outbox, workers))]
+    tasks.extend(asyncio.create_task(_work(func, inbox, outbox)) for _ in range(workers))
+    try:
+        finished = 0
+        while finished < workers:
+            item = await outbox.get()
+            if item is _DONE:
+                finished += 1
+            elif isinstance(item, _Failure):
+                raise item.error
+            else:
+                yield item
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,105 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
+
+import asyncio
+import sys
+import time
+
+from sambot.config import config
+from sambot.database.regions import RegionsCache
+from sambot.utils.aiohttp import RegionsClient
+from sambot.utils.logging import log
+from sambot.utils.metrics import metrics
+from sambot.utils.soup import make_soup
+
+DAY = 86400
+
+
+def parse_regions(body: bytes) -> set[str]:
+    with metrics.timer("parse_duration_seconds", page="regions"):
+        document = make_soup(body)
+        region_elements = document.select(
+            "body > div.intro.bg-light > div > div > div > div > "
+            "div.card-body.text-justify.card-csc > div.item_csc > a > b"
+        )
+        regions = {sys.intern(element.text) for element in region_elements}
+        document.decompose()
+        return regions
+
+
+class RegionLookup:
+    def __init__(self, cache: RegionsCache | None = None) -> None:
+        self.cache = cache or RegionsCache()
+        self._inflight: dict[str, asyncio.Task[set[str] | None]] = {}
+        self._revalidating: set[asyncio.Task] = set()
+
+    async def get(self, model: str) -> set[str] | None:
+        cached = await self.cache.get(model)
+        if cached is None:
+            metrics.inc("regions_cache_total", result="miss")
+            return await self._fetch(model)
+
+        regions, fetched_at = cached
+        age = time.time() - fetched_at
+        if age < config.regions_ttl_days * DAY:
+            metrics.inc("regions_cache_total", result="hit")
+            return regions
+
+        if age < (config.regions_ttl_days + config.regions_stale_days) * DAY:
+            metrics.inc("regions_cache_total", result="stale")
+            self._revalidate(model)
+            return regions
+
+        metrics.inc("regions_cache_total", result="expired")
+        try:
+            return await self._fetch(model) or regions
+        except Exception:
+            log.exception("[RegionLookup] - Refresh failed, serving expired regions.", model=model)
+            return regions
+
+    def _fetch(self, model: str) -> asyncio.Future[set[str] | None]:
+        task = self._inflight.get(model)
+        if task is None:
+            metrics.inc("regions_fetches_total")
+            task = self._inflight[model] = asyncio.create_task(self._refresh(model))
+            task.add_done_callback(lambda _: self._inflight.pop(model, None))
+        else:
+            metrics.inc("regions_deduplicated_total")
+        # Shielded so a cancelled caller does not cancel the lookup others await.
+        return asyncio.shield(task)
+
+    def _revalidate(self, model: str) -> None:
+        if model in self._inflight:
+            return
+
+        async def revalidate() -> None:
+            try:
+                await self._fetch(model)
+            except Exception:
+                log.exception("[RegionLookup] - Background refresh failed!", model=model)
+
+        task = asyncio.create_task(revalidate())
+        self._revalidating.add(task)
+        task.add_done_callback(self._revalidating.discard)
+
+    async def purge(self) -> None:
+        # Past this age an entry is never served, not even as stale.
+        max_age = (config.regions_ttl_days + config.regions_stale_days) * DAY
+        await self.cache.purge(time.time() - max_age)
+
+    async def _refresh(self, model: str) -> set[str] | None:
+        body = await RegionsClient.get_regions(model)
+        if not body:
+            return None
+
+        regions = parse_regions(body)
+        if not regions:
+            # Never cache an empty page, the next sync should try again.
+            metrics.inc("regions_empty_total")
+            return regions
+
+        await self.cache.put(model, regions)
+        return regions
+
+
+region_lookup = RegionLookup()
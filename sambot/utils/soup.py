@@ -0,0 +1,15 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup
+
+
+def make_soup(markup: str | bytes, features: str = "lxml") -> "BeautifulSoup":
+    # bs4 and lxml take longer to import than the rest of the bot together and
+    # are only needed by the sync jobs, so they are loaded on first parse.
+    from bs4 import BeautifulSoup  # noqa: PLC0415
+
+    return BeautifulSoup(markup, features)
@@ -0,0 +1,37 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
+
+import sys
+import time
+from dataclasses import dataclass
+
+
+@dataclass(slots=True)
+class Phase:
+    name: str
+    seconds: float
+    modules: int
+
+
+class StartupTimer:
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.last = self.started
+        self.modules = len(sys.modules)
+        self.phases: list[Phase] = []
+        self.first_update: float | None = None
+
+    def mark(self, name: str) -> Phase:
+        now = time.perf_counter()
+        modules = len(sys.modules)
+        phase = Phase(name, now - self.last, modules - self.modules)
+        self.phases.append(phase)
+        self.last, self.modules = now, modules
+        return phase
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+
+startup = StartupTimer()
@@ -2,6 +2,19 @@
 # Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
 
 import asyncio
+import os
+import signal
+import tempfile
+import time
+from asyncio import CancelledError
+from collections.abc import Awaitable, Callable
+from contextlib import suppress
+from dataclasses import dataclass
+from pathlib import Path
+
+from aiofile import async_open
+
+STREAM_CHUNK_SIZE = 64 * 1024
 
 
 class ShellExceptionError(Exception):
@@ -39,3 +52,134 @@ async def shell_run(command: str) -> str:
         f"Command '{command}' exited with {process.returncode}:\n{stderr.decode("utf-8").strip()}"
     )
     raise ShellExceptionError(msg)
+
+
+class ShellOutput:
+    def __init__(self, spill_size: int, tail_size: int = 4096) -> None:
+        self.spill_size = spill_size
+        self.tail_size = tail_size
+        self.buffer = bytearray()
+        self.size = 0
+        self.path: Path | None = None
+        self._file = None
+
+    @property
+    def spilled(self) -> bool:
+        return self.path is not None
+
+    async def write(self, data: bytes) -> None:
+        self.size += len(data)
+        if self.path is None and self.size > self.spill_size:
+            fd, name = tempfile.mkstemp(prefix="sambot-shell-", suffix=".txt")
+            os.close(fd)
+            self.path = Path(name)
+            self._file = await async_open(self.path, "wb")
+            await self._file.write(bytes(self.buffer))
+        elif self.path is None:
+            self.buffer += data
+            return
+
+        await self._file.write(data)  # type: ignore[union-attr]
+        # Past the threshold only the tail is kept in memory, for the message.
+        self.buffer = (self.buffer + data)[-self.tail_size :]
+
+    def tail(self, size: int) -> str:
+        return self.buffer[-size:].decode("utf-8", errors="replace")
+
+    def getvalue(self) -> bytes:
+        return bytes(self.buffer)
+
+    async def close(self) -> None:
+        if self._file is not None:
+            await self._file.close()
+            self._file = None
+
+    def cleanup(self) -> None:
+        if self.path is not None:
+            self.path.unlink(missing_ok=True)
+
+
+@dataclass(slots=True)
+class ShellResult:
+    returncode: int | None
+    output: ShellOutput
+    timed_out: bool = False
+    cancelled: bool = False
+
+
+async def terminate(process: asyncio.subprocess.Process, grace: float = 5.0) -> None:
+    if process.returncode is not None:
+        return
+    # The shell runs in its own session, so this also reaches its children.
+    with suppress(ProcessLookupError):
+        os.killpg(process.pid, signal.SIGTERM)
+    try:
+        await asyncio.wait_for(process.wait(), grace)
+    except TimeoutError:
+        with suppress(ProcessLookupError):
+            os.killpg(process.pid, signal.SIGKILL)
+        await process.wait()
+
+
+async def _pump(
+    stream: asyncio.StreamReader,
+    output: ShellOutput,
+    on_output: Callable[[ShellOutput], Awaitable[None]] | None,
+    interval: float,
+) -> None:
+    last_update = time.monotonic()
+    pending: asyncio.Task | None = None
+    try:
+        while chunk := await stream.read(STREAM_CHUNK_SIZE):
+            await output.write(chunk)
+            now = time.monotonic()
+            # Updates run beside the reader, so a slow edit never stalls the pipe.
+            if on_output and now - last_update >= interval and (not pending or pending.done()):
+                last_update = now
+                pending = asyncio.create_task(on_output(output))
+    finally:
+        if pending:
+            await asyncio.gather(pending, return_exceptions=True)
+
+
+async def stream_shell(
+    command: str,
+    on_output: Callable[[ShellOutput], Awaitable[None]] | None = None,
+    *,
+    deadline: float | None = None,
+    cancel: asyncio.Event | None = None,
+    interval: float = 3.0,
+    spill_size: int = 256 * 1024,
+) -> ShellResult:
+    process = await asyncio.create_subprocess_shell(
+        command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+        start_new_session=True,
+    )
+    result = ShellResult(None, ShellOutput(spill_size))
+    reader = asyncio.create_task(_pump(process.stdout, result.output, on_output, interval))  # type: ignore[arg-type]
+    waiters = {reader}
+    if cancel:
+        waiters.add(asyncio.create_task(cancel.wait()))
+    try:
+        done, _ = await asyncio.wait(
+            waiters, timeout=deadline, return_when=asyncio.FIRST_COMPLETED
+        )
+        if reader not in done:
+            result.cancelled = bool(done)
+            result.timed_out = not done
+            await terminate(process)
+            # Background children may keep the pipe open after the shell exits.
+            with suppress(TimeoutError):
+                await asyncio.wait_for(reader, 5)
+        result.returncode = await process.wait()
+    except CancelledError:
+        reader.cancel()
+        await terminate(process)
+        raise
+    finally:
+        for waiter in waiters - {reader}:
+            waiter.cancel()
+        await result.output.close()
+    return result
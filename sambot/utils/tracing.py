@@ -0,0 +1,71 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
+
+import functools
+from collections.abc import Awaitable, Callable
+from contextlib import AbstractContextManager, nullcontext
+from typing import Any
+
+import sentry_sdk
+
+from sambot.config import config
+from sambot.utils.logging import log
+
+_NULL_CONTEXT = nullcontext()
+
+
+class Tracer:
+    def __init__(self) -> None:
+        self.enabled: bool = False
+
+    def setup(self) -> None:
+        if not config.sentry_url:
+            return
+
+        log.info(
+            "Starting sentry.io integraion.",
+            traces_sample_rate=config.sentry_traces_sample_rate,
+            profiles_sample_rate=config.sentry_profiles_sample_rate,
+        )
+        sentry_sdk.init(
+            str(config.sentry_url),
+            traces_sample_rate=config.sentry_traces_sample_rate,
+            profiles_sample_rate=config.sentry_profiles_sample_rate,
+        )
+        self.enabled = config.sentry_traces_sample_rate > 0
+
+    def transaction(self, name: str, op: str) -> AbstractContextManager:
+        if not self.enabled:
+            return _NULL_CONTEXT
+        return sentry_sdk.start_transaction(name=name, op=op)
+
+    def span(self, op: str, description: str | None = None) -> AbstractContextManager:
+        if not self.enabled:
+            return _NULL_CONTEXT
+        return sentry_sdk.start_span(op=op, description=description)
+
+    def traced(
+        self, op: str, name: str | None = None, transaction: bool = False
+    ) -> Callable[[Callable[..., Awaitable[Any]]], Callable[..., Awaitable[Any]]]:
+        def decorator(func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+            description = name or func.__qualname__
+
+            @functools.wraps(func)
+            async def wrapper(*args: Any, **kwargs: Any) -> Any:
+                if not self.enabled:
+                    return await func(*args, **kwargs)
+
+                context = (
+                    self.transaction(description, op)
+                    if transaction
+                    else self.span(op, description)
+                )
+                with context:
+                    return await func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+
+tracer = Tracer()
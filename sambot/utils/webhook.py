@@ -0,0 +1,121 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
+
+import asyncio
+import hmac
+import time
+from asyncio import CancelledError
+
+import orjson
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+from pydantic import ValidationError
+
+from sambot.utils.logging import log
+from sambot.utils.metrics import metrics
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        path: str = "/webhook",
+        secret: str | None = None,
+        concurrency: int = 32,
+    ) -> None:
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.tasks: set[asyncio.Task] = set()
+        self.closing = False
+        self.url = ""
+
+        self.app = web.Application()
+        self.app.router.add_post(path, self.handle)
+        self.runner = web.AppRunner(self.app, access_log=None)
+
+    def _authorized(self, request: web.Request) -> bool:
+        if self.secret is None:
+            return True
+        token = request.headers.get(SECRET_HEADER, "")
+        return hmac.compare_digest(token.encode(), self.secret.encode())
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.closing:
+            # Telegram keeps the update and retries it, so the next process gets it.
+            metrics.inc("webhook_updates_total", status="closing")
+            return web.Response(status=503)
+        if not self._authorized(request):
+            metrics.inc("webhook_updates_total", status="unauthorized")
+            return web.Response(status=401)
+
+        try:
+            update = Update.model_validate(
+                orjson.loads(await request.read()), context={"bot": self.bot}
+            )
+        except (orjson.JSONDecodeError, ValidationError):
+            metrics.inc("webhook_updates_total", status="invalid")
+            return web.Response(status=400)
+
+        # Waiting for a slot before answering makes Telegram hold back further
+        # deliveries instead of piling up handler tasks.
+        await self.semaphore.acquire()
+        if self.closing:
+            self.semaphore.release()
+            metrics.inc("webhook_updates_total", status="closing")
+            return web.Response(status=503)
+        task = asyncio.create_task(self._process(update))
+        self.tasks.add(task)
+        task.add_done_callback(self._done)
+        metrics.set("webhook_in_flight", len(self.tasks))
+        return web.Response()
+
+    def _done(self, task: asyncio.Task) -> None:
+        self.tasks.discard(task)
+        self.semaphore.release()
+        metrics.set("webhook_in_flight", len(self.tasks))
+
+    async def _process(self, update: Update) -> None:
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            await self.dispatcher.feed_update(self.bot, update)
+        except (KeyboardInterrupt, CancelledError):
+            status = "cancelled"
+            raise
+        except Exception:
+            status = "error"
+            log.exception("[Webhook] - Failed to process update!", update_id=update.update_id)
+        finally:
+            metrics.inc("webhook_updates_total", status=status)
+            metrics.observe("webhook_update_duration_seconds", time.perf_counter() - start)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        bound_host, bound_port = self.runner.addresses[0][:2]
+        self.url = f"http://{bound_host}:{bound_port}{self.path}"
+        return self.url
+
+    async def drain(self, grace: float) -> None:
+        if not self.tasks:
+            return
+        log.info("[Webhook] - Waiting for in-flight updates.", updates=len(self.tasks))
+        _, pending = await asyncio.wait(set(self.tasks), timeout=grace)
+        if pending:
+            log.warn("[Webhook] - Cancelling unfinished updates.", updates=len(pending))
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def stop(self, grace: float = 30.0) -> None:
+        self.closing = True
+        await self.drain(grace)
+        await self.runner.cleanup()
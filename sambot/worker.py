@@ -0,0 +1,124 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2024 Hitalo M. <https://github.com/HitaloM>
+
+import argparse
+import asyncio
+import os
+import socket
+from asyncio import CancelledError
+
+import uvloop
+
+from sambot.config import config
+from sambot.database import Firmwares, SyncQueue, create_tables
+from sambot.utils.firmware import RegionGroups
+from sambot.utils.logging import log
+from sambot.utils.metrics import metrics
+from sambot.utils.tracing import tracer
+
+POLL_INTERVAL = 5
+
+
+async def heartbeat(queue: SyncQueue, owner: str, job_ids: set[int]) -> None:
+    while True:
+        await asyncio.sleep(config.worker_lease_seconds / 3)
+        await queue.heartbeat(owner, list(job_ids), config.worker_lease_seconds)
+
+
+async def process_job(
+    queue: SyncQueue,
+    groups: RegionGroups,
+    owner: str,
+    job,
+    job_ids: set[int],
+    semaphore: asyncio.Semaphore,
+) -> None:
+    async with semaphore:
+        try:
+            with tracer.transaction("worker.job", op="sync"):
+                history = await groups.fetch_history(job["Model"], job["Region"], strict=True)
+                await groups.firmwares_db.add_history(history)
+        except (KeyboardInterrupt, CancelledError):
+            raise
+        except Exception:
+            log.exception(
+                "[SyncWorker] - Failed to process job!",
+                model=job["Model"],
+                region=job["Region"],
+                attempt=job["Attempts"],
+            )
+            await queue.release(owner, job["JobID"], config.worker_max_attempts)
+            metrics.inc("worker_jobs_total", state="failed")
+        else:
+            await queue.complete(owner, job["JobID"])
+            metrics.inc("worker_jobs_total", state="done")
+        finally:
+            job_ids.discard(job["JobID"])
+
+
+async def run_worker(owner: str, concurrency: int, once: bool = False) -> None:
+    tracer.setup()
+    await create_tables()
+    queue = SyncQueue()
+    groups = RegionGroups(Firmwares())
+    semaphore = asyncio.Semaphore(concurrency)
+    job_ids: set[int] = set()
+
+    log.info("[SyncWorker] - Worker started.", worker=owner, concurrency=concurrency)
+    beat = asyncio.create_task(heartbeat(queue, owner, job_ids))
+    try:
+        while True:
+            jobs = await queue.claim(
+                owner,
+                config.worker_shard_size,
+                config.worker_lease_seconds,
+                config.worker_max_attempts,
+            )
+            if not jobs:
+                if once:
+                    break
+                await asyncio.sleep(POLL_INTERVAL)
+                continue
+
+            log.info("[SyncWorker] - Claimed shard.", worker=owner, jobs=len(jobs))
+            job_ids.update(job["JobID"] for job in jobs)
+            models = {job["Model"] for job in jobs}
+            await groups.preload(list(models))
+            async with asyncio.TaskGroup() as tg:
+                for job in jobs:
+                    tg.create_task(process_job(queue, groups, owner, job, job_ids, semaphore))
+            for model in models:
+                groups.forget(model)
+    finally:
+        beat.cancel()
+        log.info("[SyncWorker] - Worker stopped.", worker=owner)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m sambot.worker",
+        description="Claim and process firmware sync jobs from the shared queue.",
+    )
+    parser.add_argument(
+        "--id",
+        default=f"{socket.gethostname()}-{os.getpid()}",
+        help="worker identifier used to own leases (default: hostname-pid)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=config.worker_concurrency,
+        help="jobs processed at once by this worker",
+    )
+    parser.add_argument("--once", action="store_true", help="exit as soon as the queue is empty")
+    parser.add_argument("--debug", action="store_true", help="enable debug logging")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    try:
+        with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+            runner.run(run_worker(args.id, args.concurrency, args.once))
+    except (KeyboardInterrupt, SystemExit):
+        log.info("[SyncWorker] - Worker interrupted.", worker=args.id)